@@ -0,0 +1,136 @@
+"""Measure throughput and latency of purge batches, purge polling, clone_host and command line startup against a local
+fake server, optionally adding latency and failing a share of requests
+
+    python -m benchmarks.bench_api [--requests N] [--latency MS] [--error-rate RATE] [--save FILE] [--compare FILE]
+
+Results saved with --save can be compared against a later run, e.g. of another version, with --compare.
+"""
+import argparse
+import json
+import math
+import os
+import platform
+import subprocess
+import sys
+import time
+
+from striketracker import APIClient
+from striketracker.clone import HostCloner
+from striketracker.concurrency import parallel_map
+from striketracker.retry import RetryPolicy
+from striketracker.tests.fakeserver import FakeStrikeTrackerServer
+
+SCRIPT = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'bin', 'striketracker')
+
+
+def percentile(timings, percent):
+    # Nearest rank, so that small samples report a timing that was actually observed
+    if not timings:
+        return None
+    timings = sorted(timings)
+    return timings[max(0, int(math.ceil(percent / 100.0 * len(timings))) - 1)]
+
+
+def run(name, fn, items, workers):
+    # Call fn on each item from a pool of workers, returning the statistics and the results of successful calls
+    def timed(item):
+        start = time.time()
+        result = fn(item)
+        return time.time() - start, result
+
+    timings, results, errors = [], [], 0
+    start = time.time()
+    for item, future in parallel_map(timed, items, workers):
+        if future.exception() is None:
+            elapsed, result = future.result()
+            timings.append(elapsed)
+            results.append(result)
+        else:
+            errors += 1
+    elapsed = time.time() - start
+    p50, p99 = percentile(timings, 50), percentile(timings, 99)
+    return {
+        "name": name,
+        "ops": len(timings),
+        "errors": errors,
+        "opsPerSec": len(timings) / elapsed if elapsed else None,
+        "p50": p50 * 1000 if p50 is not None else None,
+        "p99": p99 * 1000 if p99 is not None else None,
+    }, results
+
+
+def report(stats, baseline=None):
+    line = '{name:<16}{opsPerSec:>12.1f} ops/sec{p50:>10.2f} ms p50{p99:>10.2f} ms p99{errors:>6} errors'.format(
+        **dict(stats, opsPerSec=stats['opsPerSec'] or 0, p50=stats['p50'] or 0, p99=stats['p99'] or 0))
+    if baseline and baseline.get('opsPerSec') and stats['opsPerSec']:
+        line += '{0:>+10.1f}% ops/sec'.format((stats['opsPerSec'] / baseline['opsPerSec'] - 1) * 100)
+    sys.stdout.write(line + '\n')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--requests', type=int, default=500, help='Purge batches to send and statuses to poll')
+    parser.add_argument('--batch-size', type=int, default=100, help='Urls per purge batch')
+    parser.add_argument('--clones', type=int, default=10, help='Hosts to clone')
+    parser.add_argument('--scopes', type=int, default=20, help='Scopes on the cloned host')
+    parser.add_argument('--startup-runs', type=int, default=10, help='Times to start the command line client')
+    parser.add_argument('--workers', type=int, default=8, help='Concurrent requests')
+    parser.add_argument('--latency', type=float, default=0, help='Milliseconds the server waits before responding')
+    parser.add_argument('--error-rate', type=float, default=0, help='Share of requests the server fails with a 503')
+    parser.add_argument('--retries', type=int, default=3, help='Times the client retries a failed request')
+    parser.add_argument('--seed', type=int, default=0, help='Seed for choosing which requests fail')
+    parser.add_argument('--save', help='Write results to this file as JSON')
+    parser.add_argument('--compare', help='Compare against results saved by an earlier run')
+    args = parser.parse_args(argv)
+    settings = dict((name, value) for name, value in vars(args).items() if name not in ('save', 'compare'))
+
+    baseline = {}
+    if args.compare:
+        with open(args.compare) as f:
+            saved = json.load(f)
+        if saved['settings'] != settings:
+            sys.stderr.write('Warning: %s was measured with different settings\n' % args.compare)
+        baseline = dict((stats['name'], stats) for stats in saved['results'])
+
+    server = FakeStrikeTrackerServer(token='token', purge_steps=10, latency=args.latency / 1000.0,
+                                     error_rate=args.error_rate, seed=args.seed).start()
+    client = APIClient(server.base_url, 'token', pool_maxsize=args.workers,
+                       retry=RetryPolicy(retries=args.retries, backoff=0.01))
+    env = dict(os.environ, STRIKETRACKER_BASE_URL=server.base_url, PYTHONPATH=os.path.dirname(os.path.dirname(SCRIPT)))
+    results = []
+    try:
+        def measure(name, fn, items, workers):
+            stats, outcomes = run(name, fn, items, workers)
+            report(stats, baseline.get(name))
+            results.append(stats)
+            return outcomes
+
+        batches = ([{"url": "//cdn.example.com/%d/%d.js" % (batch, url)} for url in range(args.batch_size)]
+                   for batch in range(args.requests))
+        job_ids = measure('purge', lambda batch: client.purge('y1y2y3y4', batch), batches, args.workers)
+
+        polls = (job_ids[index % len(job_ids)] for index in range(args.requests if job_ids else 0))
+        measure('purge_status', lambda job_id: client.purge_status('y1y2y3y4', job_id), polls, args.workers)
+
+        server.add_host('y1y2y3y4', {"name": "source", "hashCode": "x1x2x3x4", "services": []},
+                        [{"platform": "CDS", "path": "/%d" % scope} for scope in range(args.scopes)],
+                        [{"originPullHost": {"id": scope, "primary": scope}} for scope in range(args.scopes)])
+        cloner = HostCloner(client, workers=args.workers)
+        measure('clone_host', lambda _: cloner.clone('y1y2y3y4', 'x1x2x3x4'), range(args.clones), 1)
+
+        with open(os.devnull, 'w') as devnull:
+            measure('startup', lambda _: subprocess.check_call([sys.executable, SCRIPT, 'version'], stdout=devnull,
+                                                               stderr=devnull, env=env),
+                    range(args.startup_runs), 1)
+    finally:
+        client.close()
+        server.stop()
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump({"settings": settings, "python": platform.python_version(), "results": results}, f,
+                      indent=2, sort_keys=True)
+
+
+if __name__ == '__main__':
+    main()
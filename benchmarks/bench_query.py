@@ -0,0 +1,51 @@
+"""Measure how long it takes to index an export, load the saved index and query it. Each query is timed on an index
+that has already parsed the fields it needs, apart from its first run
+
+    python -m benchmarks.bench_query [hosts] [scopes per host]
+"""
+import shutil
+import sys
+import tempfile
+import time
+
+from striketracker.export import SnapshotStore
+from striketracker.query import ConfigurationIndex
+
+
+def measure(name, fn, runs=1):
+    start = time.time()
+    for _ in range(runs):
+        result = fn()
+    sys.stdout.write('{name:<40}{elapsed:>10.2f} ms\n'.format(name=name, elapsed=(time.time() - start) * 1000 / runs))
+    return result
+
+
+def main(hosts=1000, scopes=20):
+    directory = tempfile.mkdtemp()
+    store = SnapshotStore(directory)
+    try:
+        for host in range(hosts):
+            store.save('y1y2y3y4', {"host": {"hashCode": "h%d" % host, "name": "host %d" % host}, "scopes": [{
+                "scope": {"id": scope, "platform": "CDS", "path": "/%d" % scope},
+                "configuration": {
+                    "originPullHost": {"id": scope, "primary": host % 50},
+                    "cacheControl": [{"statusCodeMatch": "200", "maxAge": (host * scope) % 3600},
+                                     {"statusCodeMatch": "4*,5*", "maxAge": 1}],
+                    "hostname": [{"domain": "www%d.example.com" % host}],
+                    "compression": {"gzip": "txt,js,css", "level": scope % 9}
+                }} for scope in range(scopes)]})
+
+        measure('index %d scopes' % (hosts * scopes), lambda: ConfigurationIndex(store).refresh())
+        index = measure('load saved index', lambda: ConfigurationIndex(store).refresh())
+        # What the query command does: load the saved index, parsing only the fields the query asks about
+        measure('load and query one field', lambda: ConfigurationIndex(store).refresh().query(['compression.level=3']))
+        for expression in ('originPullHost.primary=7', 'cacheControl.maxAge<60', 'hostname.domain~www12',
+                           'compression'):
+            count = len(measure(expression, lambda: index.query([expression]), runs=10))
+            sys.stdout.write('{0:>40}{1:>10} scopes\n'.format('', count))
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,37 @@
+"""Compare calls per second of the pooled APIClient session against one-off requests
+
+    python -m benchmarks.bench_session [calls]
+"""
+import sys
+import time
+
+import requests
+
+from striketracker.tests.fakeserver import FakeStrikeTrackerServer
+from striketracker import APIClient
+
+
+def measure(name, calls, fn):
+    start = time.time()
+    for _ in range(calls):
+        fn()
+    elapsed = time.time() - start
+    sys.stdout.write('{name:<24}{rate:>10.1f} calls/sec\n'.format(name=name, rate=calls / elapsed))
+
+
+def main(calls=1000):
+    server = FakeStrikeTrackerServer(token='token').start()
+    server.add_host('y1y2y3y4', {"name": "test host", "hashCode": "x1x2x3x4", "services": []})
+    try:
+        url = server.base_url + '/api/v1/accounts/y1y2y3y4/hosts/x1x2x3x4'
+        measure('requests.get', calls, lambda: requests.get(url, headers={'Authorization': 'Bearer token'}))
+
+        client = APIClient(server.base_url, 'token')
+        measure('APIClient (pooled)', calls, lambda: client.get_host('y1y2y3y4', 'x1x2x3x4'))
+        client.close()
+    finally:
+        server.stop()
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,44 @@
+"""Measure cold start time of the striketracker command line client for each subcommand
+
+    python -m benchmarks.bench_startup [runs]
+"""
+import os
+import subprocess
+import sys
+import time
+
+from striketracker import _commands
+from striketracker.tests.fakeserver import FakeStrikeTrackerServer
+
+SCRIPT = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'bin', 'striketracker')
+# Every registered command, so that new ones are measured too
+COMMANDS = sorted(_commands)
+
+
+def measure(name, args, runs, env):
+    timings = []
+    with open(os.devnull, 'w') as devnull:
+        for _ in range(runs):
+            start = time.time()
+            subprocess.call([sys.executable, SCRIPT] + args, stdout=devnull, stderr=devnull, env=env)
+            timings.append(time.time() - start)
+    timings.sort()
+    sys.stdout.write('{name:<24}{best:>8.1f} ms best{median:>8.1f} ms median\n'.format(
+        name=name, best=timings[0] * 1000, median=timings[len(timings) // 2] * 1000))
+
+
+def main(runs=10):
+    server = FakeStrikeTrackerServer().start()
+    env = dict(os.environ, STRIKETRACKER_BASE_URL=server.base_url,
+               PYTHONPATH=os.path.dirname(os.path.dirname(SCRIPT)))
+    try:
+        measure('--help', ['--help'], runs, env)
+        for command in COMMANDS:
+            measure('%s --help' % command, [command, '--help'], runs, env)
+        measure('version', ['version'], runs, env)
+    finally:
+        server.stop()
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -1,4 +1,17 @@
+import sys
+
 from setuptools import setup
+from setuptools.command.build_py import build_py
+
+
+class BuildPy(build_py):
+    # striketracker.aio uses async/await, so leave it out where it would not even compile
+    def find_package_modules(self, package, package_dir):
+        modules = build_py.find_package_modules(self, package, package_dir)
+        if sys.version_info < (3, 5, 2):
+            modules = [module for module in modules if module[:2] != ('striketracker', 'aio')]
+        return modules
+
 
 setup(name='striketracker',
       version='0.5.2',
@@ -15,4 +28,5 @@ setup(name='striketracker',
       scripts=['bin/striketracker'],
       test_suite='nose.collector',
       tests_require=['nose', 'responses', 'coverage'],
+      cmdclass={'build_py': BuildPy},
       zip_safe=False)
\ No newline at end of file
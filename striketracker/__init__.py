@@ -1,34 +1,111 @@
-import argparse
-import getpass
+import contextlib
+import errno
+import functools
 import os
 from os.path import expanduser
-import requests
 import sys
+import threading
 import time
-import yaml
-from yaml import SafeDumper
-import logging
-
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# requests, yaml, argparse and friends are slow to import, so they are only imported once something needs them
+
+
+def _load_yaml(stream):
+    import yaml
+    return yaml.load(stream, Loader=getattr(yaml, 'CSafeLoader', yaml.SafeLoader))
+
+
+def _dump_yaml(obj, stream):
+    import yaml
+    return yaml.dump(obj, stream, Dumper=getattr(yaml, 'CSafeDumper', yaml.SafeDumper), default_flow_style=False)
+
+
+def _replace(source, destination):
+    # Python 2 has no os.replace, and on Windows os.rename will not overwrite an existing file
+    if hasattr(os, 'replace'):
+        os.replace(source, destination)
+        return
+    if os.name == 'nt' and os.path.exists(destination):
+        os.remove(destination)
+    os.rename(source, destination)
+
+
+def atomic_write(path, data, prefix='.'):
+    # Write data to a temporary file beside path and flush it to disk before swapping it in, so that readers see
+    # either the old file or all of the new one, even after a crash. The temporary file is removed if anything fails
+    import tempfile
+    fd, temporary = tempfile.mkstemp(prefix=prefix, dir=os.path.dirname(os.path.abspath(path)))
+    try:
+        with os.fdopen(fd, 'w') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        _replace(temporary, path)
+    except BaseException:
+        try:
+            os.unlink(temporary)
+        except OSError:
+            pass
+        raise
 
 
 class ConfigurationCache():
     def __init__(self, filename=None):
         self.cache = None
+        self.stamp = None
         self.filename = filename if filename is not None else os.path.join(expanduser('~'), '.highwinds')
 
+    def _stamp(self):
+        try:
+            stat = os.stat(self.filename)
+        except OSError:
+            return None
+        return stat.st_mtime, stat.st_size, stat.st_ino
+
+    @contextlib.contextmanager
+    def _lock(self):
+        # Serialize writers across processes with a lock file next to the cache, since the cache itself gets replaced
+        if fcntl is None:
+            yield
+            return
+        with os.fdopen(os.open(self.filename + '.lock', os.O_WRONLY | os.O_CREAT, 0o600), 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
     def read(self):
-        with os.fdopen(os.open(self.filename, os.O_RDONLY | os.O_CREAT, 0600), 'r') as f:
-            self.cache = yaml.load(f)
-            if self.cache is None:
-                self.cache = {}
+        # Only parse the file again if it has changed since it was last read
+        stamp = self._stamp()
+        if self.cache is not None and stamp is not None and stamp == self.stamp:
+            return self.cache
+        try:
+            with open(self.filename, 'r') as f:
+                self.cache = _load_yaml(f)
+        except IOError as e:
+            if e.errno != errno.ENOENT:
+                raise
+            self.cache = None
+        if self.cache is None:
+            self.cache = {}
+        self.stamp = stamp
         return self.cache
 
     def set(self, key, value):
-        if self.cache is None:
+        self.update(key, lambda current: value)
+
+    def update(self, key, function):
+        # Replace the value of key with function(current value), holding the lock so no other writer can interleave
+        with self._lock():
             self.read()
-        self.cache[key] = value
-        with os.fdopen(os.open(self.filename, os.O_WRONLY | os.O_CREAT, 0600), 'w') as f:
-            return yaml.dump(self.cache, f, Dumper=SafeDumper, default_flow_style=False)
+            self.cache[key] = function(self.cache.get(key))
+            atomic_write(self.filename, _dump_yaml(self.cache, None), prefix='.highwinds')
+            self.stamp = self._stamp()
 
     def get(self, key, default=None):
         if self.cache is None:
@@ -43,103 +120,223 @@ class APIError(Exception):
         self.context = context
 
 
-class APIClient:
-    def __init__(self, base_url='https://striketracker.highwinds.com', token=None):
+class APIClient(object):
+    def __init__(self, base_url='https://striketracker.highwinds.com', token=None, pool_connections=10,
+                 pool_maxsize=10, timeout=None, keep_alive=True, rate_limiter=None,
+                 retry=None, response_cache=None, hooks=None):
         self.base_url = base_url
         self.token = token
+        self.timeout = timeout
+        self.rate_limiter = rate_limiter
+        self.retry = retry
+        self.response_cache = response_cache
+        self.pool_connections = pool_connections
+        self.pool_maxsize = pool_maxsize
+        self.keep_alive = keep_alive
+        # Callables passed a striketracker.instrumentation.RequestEvent after every attempt at a request
+        self.hooks = list(hooks or [])
+        self._session = None
+        self._session_lock = threading.Lock()
+
+    @property
+    def session(self):
+        # Share one pooled session across every call so connections are reused, created on first use. Threads that
+        # get here together must not each build one, since all but the last would leak their connections
+        if self._session is None:
+            with self._session_lock:
+                if self._session is None:
+                    import requests
+                    session = requests.Session()
+                    self._mount(session)
+                    if not self.keep_alive:
+                        session.headers['Connection'] = 'close'
+                    self._session = session
+        return self._session
+
+    def _mount(self, session):
+        import requests.adapters
+        adapter = requests.adapters.HTTPAdapter(pool_connections=self.pool_connections, pool_maxsize=self.pool_maxsize)
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+
+    def resize_pool(self, pool_maxsize):
+        # Keep at least pool_maxsize connections per host. The adapter only reads its size when created, so once the
+        # session exists a new one is mounted in place of the old, whose idle connections are closed
+        with self._session_lock:
+            if pool_maxsize <= self.pool_maxsize:
+                return
+            self.pool_maxsize = pool_maxsize
+            if self._session is not None:
+                previous = self._session.get_adapter('https://')
+                self._mount(self._session)
+                previous.close()
+
+    def close(self):
+        if self._session is not None:
+            self._session.close()
+
+    def _request(self, method, endpoint, url_args=None, token=None, authenticate=True, message=None, expect=None,
+                 **kwargs):
+        # With a message, a final response whose status is not in expect (or is an error, if expect is not given)
+        # raises APIError(message), which hooks see on the RequestEvent of that attempt
+        import requests
+        headers = kwargs.pop('headers', {})
+        if authenticate:
+            headers['Authorization'] = 'Bearer %s' % (token if token is not None else self.token)
+        kwargs.setdefault('timeout', self.timeout)
+        url = self.base_url + endpoint.format(**(url_args or {}))
+        attempt = 0
+        while True:
+            queued = time.time()
+            if self.rate_limiter is not None:
+                self.rate_limiter.acquire()
+            start = time.time()
+            try:
+                response = self.session.request(method, url, headers=headers, **kwargs)
+            except requests.RequestException as e:
+                retry = self.retry is not None and self.retry.should_retry(method, attempt, error=e)
+                if self.hooks:
+                    self._notify(method, endpoint, url, attempt, start - queued, start, error=e, retried=retry)
+                if not retry:
+                    raise
+                delay = self.retry.delay(attempt)
+            else:
+                retry = self.retry is not None and self.retry.should_retry(method, attempt, response=response)
+                api_error = None
+                if message is not None and not retry and \
+                        (response.status_code not in expect if expect else response.status_code >= 400):
+                    api_error = APIError(message, response)
+                if self.hooks:
+                    self._notify(method, endpoint, url, attempt, start - queued, start, response=response,
+                                 api_error=api_error, retried=retry)
+                if api_error is not None:
+                    raise api_error
+                if not retry:
+                    return response
+                delay = self.retry.delay(attempt, response)
+                if response.status_code == 429 and self.rate_limiter is not None:
+                    self.rate_limiter.pause(delay)
+                    delay = 0
+            time.sleep(delay)
+            attempt += 1
+
+    def _notify(self, method, endpoint, url, attempt, queued, start, response=None, error=None, api_error=None,
+                retried=False):
+        from striketracker.instrumentation import RequestEvent
+        event = RequestEvent(method, endpoint, url, attempt, error=error, queued=queued, duration=time.time() - start,
+                             api_error=api_error, retried=retried)
+        if response is not None:
+            body = response.request.body if response.request is not None else None
+            event.response = response
+            event.status = response.status_code
+            event.sent = len(body) if body else 0
+            event.received = len(response.content or b'')
+            event.elapsed = response.elapsed.total_seconds() if response.elapsed is not None else None
+        for hook in self.hooks:
+            hook(event)
+
+    def _get_if_changed(self, message, endpoint, url_args, etag=None):
+        # The response to a GET of endpoint, or None when the server confirms the copy tagged etag is still current
+        headers = {}
+        if etag:
+            headers['If-None-Match'] = etag
+        response = self._request('GET', endpoint, url_args, headers=headers, message=message,
+                                 expect=(200, 304) if etag else (200,))
+        return None if response.status_code == 304 else response
+
+    def _cached_get(self, key, message, endpoint, url_args):
+        if self.response_cache is None:
+            return self._get_if_changed(message, endpoint, url_args).json()
+
+        entry = self.response_cache.get(key)
+        if entry is not None and entry.fresh(self.response_cache.ttl):
+            return entry.value()
+
+        # Revalidate a stale entry rather than downloading it again when the server supports ETags
+        response = self._get_if_changed(message, endpoint, url_args, entry.etag if entry is not None else None)
+        if response is None:
+            return self.response_cache.touch(key, entry).value()
+        value = response.json()
+        self.response_cache.set(key, response.text, response.headers.get('ETag'))
+        return value
+
+    def _invalidate(self, account, host):
+        if self.response_cache is not None:
+            self.response_cache.invalidate(str(account), str(host))
 
     def version(self):
-        response = requests.get(self.base_url + '/version')
+        response = self._request('GET', '/version', authenticate=False)
         return response.headers['X-Cdnws-Version']
 
     def me(self):
-        user_response = requests.get(
-            self.base_url + '/api/v1/users/me', headers={'Authorization': 'Bearer %s' % self.token})
-        if user_response.status_code == 200:
-            return user_response.json()
-        else:
-            raise APIError('Could not fetch user details', user_response)
+        return self._request('GET', '/api/v1/users/me', message='Could not fetch user details', expect=(200,)).json()
+
+    def list_hosts(self, account):
+        return self._request('GET', '/api/v1/accounts/{account}/hosts', {'account': account},
+                             message='Could not fetch hosts', expect=(200,)).json()['list']
+
+    def list_subaccounts(self, account):
+        return self._request('GET', '/api/v1/accounts/{account}/subaccounts', {'account': account},
+                             message='Could not fetch subaccounts', expect=(200,)).json()['list']
 
     def get_host(self, account, host):
-        response = requests.get(
-            self.base_url + '/api/v1/accounts/{account}/hosts/{host}'.format(account=account, host=host),
-            headers={'Authorization': 'Bearer %s' % self.token})
-        if response.status_code == 200:
-            return response.json()
-        else:
-            raise APIError('Could not fetch host', response)
+        return self._cached_get((str(account), str(host), None), 'Could not fetch host',
+                                '/api/v1/accounts/{account}/hosts/{host}', {'account': account, 'host': host})
+
+    def get_host_if_changed(self, account, host, etag):
+        # (host, ETag), or None if the host still has the given ETag. Never answered from the response cache
+        response = self._get_if_changed('Could not fetch host', '/api/v1/accounts/{account}/hosts/{host}',
+                                        {'account': account, 'host': host}, etag)
+        return (response.json(), response.headers.get('ETag')) if response is not None else None
 
     def create_host(self, account, host):
-        response = requests.post(
-            self.base_url + '/api/v1/accounts/{account}/hosts'.format(account=account, host=host),
-            headers={
-                'Authorization': 'Bearer %s' % self.token,
-                'Content-Type': 'application/json'
-            },
-            json=host)
-        if response.status_code == 201:
-            return response.json()
-        else:
-            raise APIError('Could not create host', response)
+        return self._request('POST', '/api/v1/accounts/{account}/hosts', {'account': account}, json=host,
+                             message='Could not create host', expect=(201,)).json()
 
     def create_scope(self, account, host, scope):
-        response = requests.post(
-            self.base_url + '/api/v1/accounts/{account}/hosts/{host}/configuration/scopes'
-                .format(account=account, host=host),
-            headers={
-                'Authorization': 'Bearer %s' % self.token,
-                'Content-Type': 'application/json'
-            },
-            json=scope)
-        if response.status_code == 200:
-            return response.json()
-        else:
-            raise APIError('Could not create scope', response)
+        response = self._request('POST', '/api/v1/accounts/{account}/hosts/{host}/configuration/scopes',
+                                 {'account': account, 'host': host}, json=scope, message='Could not create scope',
+                                 expect=(200,))
+        self._invalidate(account, host)
+        return response.json()
 
     def update_configuration(self, account, host, scope, configuration):
-        response = requests.put(
-            self.base_url + '/api/v1/accounts/{account}/hosts/{host}/configuration/{scope}'
-                .format(account=account, host=host, scope=scope),
-            headers={
-                'Authorization': 'Bearer %s' % self.token,
-                'Content-Type': 'application/json'
-            },
-            json=configuration)
-        if response.status_code == 200:
-            return response.json()
-        else:
-            raise APIError('Could not update configuration', response)
+        response = self._request('PUT', '/api/v1/accounts/{account}/hosts/{host}/configuration/{scope}',
+                                 {'account': account, 'host': host, 'scope': scope}, json=configuration,
+                                 message='Could not update configuration', expect=(200,))
+        self._invalidate(account, host)
+        return response.json()
 
     def get_configuration(self, account, host, scope):
-        response = requests.get(
-            self.base_url + '/api/v1/accounts/{account}/hosts/{host}/configuration/{scope}'
-                .format(account=account, host=host, scope=scope),
-            headers={
-                'Authorization': 'Bearer %s' % self.token,
-                'Content-Type': 'application/json'
-            })
-        if response.status_code == 200:
-            return response.json()
-        else:
-            raise APIError('Could not fetch configuration', response)
+        return self._cached_get((str(account), str(host), str(scope)), 'Could not fetch configuration',
+                                '/api/v1/accounts/{account}/hosts/{host}/configuration/{scope}',
+                                {'account': account, 'host': host, 'scope': scope})
+
+    def get_configuration_if_changed(self, account, host, scope, etag):
+        # (configuration, ETag), or None if the configuration still has the given ETag
+        response = self._get_if_changed('Could not fetch configuration',
+                                        '/api/v1/accounts/{account}/hosts/{host}/configuration/{scope}',
+                                        {'account': account, 'host': host, 'scope': scope}, etag)
+        return (response.json(), response.headers.get('ETag')) if response is not None else None
 
     def create_token(self, username, password, application=None):
         if application is None:
             application = 'StrikeTracker Python client'
 
         # Grab an access token to use to fetch user
-        response = requests.post(self.base_url + '/auth/token', data={
+        response = self._request('POST', '/auth/token', authenticate=False, data={
             "username": username, "password": password, "grant_type": "password"
         }, headers={
             'User-Agent': application
-        })
+        }, message='Could not fetch access token')
         auth = response.json()
         if 'access_token' not in auth:
             raise APIError('Could not fetch access token', response)
         access_token = auth['access_token']
 
         # Grab user's id and root account hash
-        user_response = requests.get(self.base_url + '/api/v1/users/me', headers={'Authorization': 'Bearer %s' % access_token})
+        user_response = self._request('GET', '/api/v1/users/me', token=access_token,
+                                      message='Could not fetch user\'s root account hash')
         user = user_response.json()
         if 'accountHash' not in user or 'id' not in user:
             raise APIError('Could not fetch user\'s root account hash', user_response)
@@ -147,53 +344,59 @@ class APIClient:
         user_id = user['id']
 
         # Generate a new API token
-        token_response = requests.post(self.base_url + ('/api/v1/accounts/{account_hash}/users/{user_id}/tokens'.format(
-            account_hash=account_hash, user_id=user_id
-        )), json={
+        token_response = self._request('POST', '/api/v1/accounts/{account_hash}/users/{user_id}/tokens', {
+            'account_hash': account_hash, 'user_id': user_id
+        }, token=access_token, json={
             "password": password, "application": application
-        }, headers={
-            'Authorization': 'Bearer %s' % access_token,
-            'Content-Type': 'application/json'
-        })
+        }, message='Could not generate API token')
         if 'token' not in token_response.json():
             raise APIError('Could not generate API token', token_response)
         self.token = token_response.json()['token']
         return self.token
 
     def purge(self, account_hash, urls):
-        purge_response = requests.post(self.base_url + ('/api/v1/accounts/%s/purge' % account_hash), json={
-            "list": urls
-        }, headers={
-            'Content-Type': 'application/json',
-            'Authorization': 'Bearer %s' % self.token
-        })
+        purge_response = self._request('POST', '/api/v1/accounts/{account_hash}/purge',
+                                       {'account_hash': account_hash}, json={"list": urls},
+                                       message='Could not send purge batch')
         if 'id' not in purge_response.json():
             raise APIError('Could not send purge batch', purge_response)
         return purge_response.json()['id']
 
     def purge_status(self, account_hash, job_id):
-        status_response = requests.get(self.base_url + ('/api/v1/accounts/%s/purge/%s' % (account_hash, job_id,)), headers={
-            'Authorization': 'Bearer %s' % self.token,
-            })
+        status_response = self._request('GET', '/api/v1/accounts/{account_hash}/purge/{job_id}',
+                                        {'account_hash': account_hash, 'job_id': job_id},
+                                        message='Could not fetch purge status')
         if 'progress' not in status_response.json():
             raise APIError('Could not fetch purge status', status_response)
         return float(status_response.json()['progress'])
 
 
 
+# Names of every command, registered by the command decorator
+_commands = []
+
+
 def command(arguments=()):
     def apply_args(fn):
+        _commands.append(fn.__name__)
+
+        @functools.wraps(fn)
         def wrapper(self, *args, **kwargs):
             # Apply arguments
+            self.parser.add_argument('--profile', help='Profile in the configuration file whose token to use',
+                                     default=os.environ.get('STRIKETRACKER_PROFILE'))
             for arg in arguments:
                 name = arg['name']
                 arg_copy = arg.copy()
                 del arg_copy['name']
                 self.parser.add_argument(name, **arg_copy)
             self.args = self.parser.parse_args()
+            from striketracker.tokens import TokenManager
+            self.tokens = TokenManager(self.client, self.cache, profile=self.args.profile)
 
             # Optionally turn on verbose logging
             if self.args.verbose:
+                import logging
                 try:
                     import http.client as http_client
                 except ImportError:
@@ -207,41 +410,84 @@ def command(arguments=()):
                 requests_log.setLevel(logging.DEBUG)
                 requests_log.propagate = True
 
-            # Load token store
-            if not self.args.token:
-                self.client.token = self.cache.get('token')
-            else:
+                # Time every request and print a histogram per endpoint once the command is done
+                from striketracker.instrumentation import LatencyHistogram
+                self.timings = LatencyHistogram()
+                self.client.hooks.append(self.timings)
+
+            # Token supplied on the command line, otherwise authenticated commands load it from the token store
+            if self.args.token:
                 self.client.token = self.args.token
 
             # Call original function
-            fn(self, *args, **kwargs)
+            try:
+                fn(self, *args, **kwargs)
+            finally:
+                if self.timings is not None:
+                    self.timings.report(sys.stderr)
         return wrapper
     return apply_args
 
 
+# Appended to the help of account arguments that may be left out
+_default_account_help = ' (defaults to the profile\'s account, otherwise your root account)'
+
+# Shared by every command that prints API objects
+_output_argument = {'name': '--output', 'help': 'Format in which to print results', 'choices': ['yaml', 'json', 'jsonl'],
+                    'default': 'yaml'}
+
+
 def authenticated(fn):
+    @functools.wraps(fn)
     def wrapper(self, *args, **kwargs):
+        if self.client.token is None:
+            self.client.token = self.tokens.token()
         if self.client.token is None:
             sys.stderr.write(
                 "This command requires authentication. Either run `striketracker init` to cache credentials locally, or "
                 "supply the --token parameter on the command line.\n")
             exit(1)
+
+        # Fill in a left out account from the configuration, or from the account context remembered for the token
+        if 'account' in vars(self.args) and self.args.account is None:
+            try:
+                self.args.account = self.tokens.default_account()
+            except APIError as e:
+                self._error(e)
+        fn(self, *args, **kwargs)
+    return wrapper
+
+
+def validated(fn):
+    # Check a token from the configuration file before commands that send many requests, so that an expired or
+    # revoked token fails at once rather than partway through. Successful checks are remembered for an hour
+    @functools.wraps(fn)
+    def wrapper(self, *args, **kwargs):
+        if not self.args.token:
+            try:
+                self.tokens.validate()
+            except APIError as e:
+                if getattr(e.context, 'status_code', None) in (401, 403):
+                    sys.stderr.write("The saved token was rejected. Run `striketracker init` to save a new one.\n")
+                self._error(e)
         fn(self, *args, **kwargs)
     return wrapper
 
 
 class Command:
     def __init__(self, cache=None):
+        import argparse
+        from striketracker.retry import RetryPolicy
+
         # Instantiate library
         base_url = os.environ.get('STRIKETRACKER_BASE_URL', 'https://striketracker.highwinds.com')
-        self.client = APIClient(base_url)
+        self.client = APIClient(base_url, retry=RetryPolicy())
         self.cache = ConfigurationCache(cache)
+        self.timings = None
 
         # Read in command line arguments
         self.parser = argparse.ArgumentParser(description='Command line interface to the Highwinds CDN')
-        methodList = [method for method in dir(self) if callable(getattr(self, method)) and method[0] != '_']
-        methodList.sort()
-        self.parser.add_argument('action', help=",".join(methodList))
+        self.parser.add_argument('action', help=",".join(sorted(_commands)))
         self.parser.add_argument('--token', help='Token to use for this action')
         self.parser.add_argument('-v', '--verbose', help='Turn on verbose logging', action='store_true')
 
@@ -249,26 +495,42 @@ class Command:
         command = sys.argv[1] if len(sys.argv) > 1 else None
         if len(sys.argv) == 1 or "-" in sys.argv[1]:
             self.parser.print_help(file=sys.stdout)
-        elif hasattr(self, sys.argv[1]):
+        elif sys.argv[1] in _commands:
             getattr(self, sys.argv[1])()
         else:
             sys.stderr.write("Unknown command: %s\n" % command)
 
     def _print(self, obj):
-        yaml.dump(obj, sys.stdout, Dumper=SafeDumper, default_flow_style=False)
+        output = getattr(self.args, 'output', 'yaml')
+        start = time.time()
+        if output == 'yaml':
+            _dump_yaml(obj, sys.stdout)
+        else:
+            import json
+            if output == 'json':
+                sys.stdout.write(json.dumps(obj, sort_keys=True, indent=2, separators=(',', ': ')) + "\n")
+            else:
+                sys.stdout.write(json.dumps(obj, sort_keys=True) + "\n")
+        if self.timings is not None:
+            self.timings.record('%s output' % output, time.time() - start)
 
-    def _error(self, e):
-        sys.stderr.write(e.message + "\n")
+    def _write_error(self, e):
+        sys.stderr.write("%s\n" % e)
         try:
             sys.stderr.write(e.context.json()['error'] + "\n")
         except:
             pass
+
+    def _error(self, e):
+        self._write_error(e)
         exit(1)
 
     @command([
-        {'name': '--application', 'help': 'Name of application with which to register this token'}
+        {'name': '--application', 'help': 'Name of application with which to register this token'},
+        {'name': '--account', 'help': 'Account to use when a command\'s account is left out'},
     ])
     def init(self):
+        import getpass
         sys.stdout.write("Initializing configuration...\n")
         if self.args.token:
             token = self.args.token
@@ -278,7 +540,7 @@ class Command:
                 password=getpass.getpass(),
                 application=self.args.application if hasattr(self.args, 'application') else None
             )
-        self.cache.set('token', token)
+        self.tokens.save(token, self.args.account)
         sys.stdout.write('Successfully saved token\n')
 
     @command()
@@ -286,14 +548,14 @@ class Command:
         sys.stdout.write(self.client.version())
         sys.stdout.write("\n")
 
-    @command()
+    @command([_output_argument])
     @authenticated
     def me(self):
         user = self.client.me()
         self._print(user)
 
     @command([
-        {'name': 'account', 'help': 'Account from which to purge assets'},
+        {'name': 'account', 'help': 'Account from which to purge assets' + _default_account_help, 'nargs': '?'},
         {'name': '--poll', 'help': 'Poll for purge status to be complete instead of returning id',
             'action': 'store_true'},
         {'name': '--invalidate-only', 'help': 'Force revalidation on assets instead of removing them',
@@ -302,40 +564,93 @@ class Command:
             'action': 'store_true'},
         {'name': '--recursive', 'help': 'Purge all assets at this path recursively',
             'action': 'store_true'},
+        {'name': '--batch-size', 'help': 'Maximum number of urls to send in each purge request',
+            'type': int, 'default': 1000},
+        {'name': '--workers', 'help': 'Number of purge requests to send concurrently',
+            'type': int, 'default': 4},
+        {'name': '--retries', 'help': 'Number of times to retry a request that fails transiently',
+            'type': int, 'default': 3},
+        {'name': '--optimize', 'help': 'Drop duplicate urls and urls covered by a recursive purge before sending',
+            'action': 'store_true'},
+        {'name': '--collapse-threshold', 'help': 'Replace the urls in any directory directly holding at least this '
+            'many with one recursive purge of the directory (implies --optimize)', 'type': int},
+        {'name': '--dry-run', 'help': 'Print the optimized purges instead of sending them', 'action': 'store_true'},
+        {'name': '--journal', 'help': 'File in which to record submitted batches, job ids and progress'},
+        {'name': '--resume', 'help': 'Skip the batches that --journal shows were submitted, and poll only the jobs '
+            'it does not show finished', 'action': 'store_true'},
         ])
     @authenticated
+    @validated
     def purge(self):
+        from striketracker.purge import BatchPurger, PurgeJournal, PurgeOptimizer, PurgePoller, read_urls
+        if self.args.resume and not self.args.journal:
+            sys.stderr.write('--resume requires --journal\n')
+            exit(1)
         sys.stderr.write('Reading urls from stdin\n')
-        urls = []
-        for url in sys.stdin:
-            urls.append({
-                "url": url.strip(),
-                "purgeAllDynamic": self.args.purge_all_dynamic,
-                "recursive": self.args.recursive,
-                "invalidateOnly": self.args.invalidate_only
-            })
-
-        # Send batch to CDN
-        try:
-            job_id = self.client.purge(self.args.account, urls)
-        except APIError as e:
-            self._error(e)
+        urls = read_urls(sys.stdin, purge_all_dynamic=self.args.purge_all_dynamic, recursive=self.args.recursive,
+                         invalidate_only=self.args.invalidate_only)
+
+        # Optimizing needs every url before it can send the first batch
+        optimizer = None
+        if self.args.optimize or self.args.collapse_threshold or self.args.dry_run:
+            optimizer = PurgeOptimizer(threshold=self.args.collapse_threshold)
+            urls = optimizer.optimize(urls)
+        if self.args.dry_run:
+            import json
+            for entry in urls:
+                sys.stdout.write(json.dumps(entry, sort_keys=True) + "\n")
+            sys.stderr.write(optimizer.summary() + "\n")
+            return
+
+        # Journal the settings that decide each batch's contents, so that a resumed purge can check they still match
+        journal = None
+        if self.args.journal:
+            journal = PurgeJournal(self.args.journal, resume=self.args.resume)
+            try:
+                journal.start(dict((name, getattr(self.args, name)) for name in (
+                    'account', 'batch_size', 'purge_all_dynamic', 'recursive', 'invalidate_only', 'optimize',
+                    'collapse_threshold')))
+            except ValueError as e:
+                sys.stderr.write("%s\n" % e)
+                exit(1)
+
+        # Send each batch to CDN as soon as it fills
+        self.client.retry.retries = self.args.retries
+        purger = BatchPurger(self.client, self.args.account, batch_size=self.args.batch_size,
+                             workers=self.args.workers)
+        result = purger.submit(urls, journal=journal)
+        if optimizer is not None:
+            sys.stderr.write(optimizer.summary() + "\n")
+        if result.failed:
+            for e in result.errors:
+                self._write_error(e)
+            for job_id in result.job_ids:
+                sys.stdout.write(job_id)
+                sys.stdout.write("\n")
+            sys.stderr.write(result.summary() + "\n")
+            exit(1)
+        if result.resumed:
+            sys.stderr.write(result.summary() + "\n")
 
-        # Optionally poll for progress
+        # Optionally poll for progress, skipping jobs that a resumed journal shows are finished
         if self.args.poll:
-            progress = 0.0
-            sys.stderr.write('Sending purge...')
-            while progress < 1.0:
-                progress = self.client.purge_status(self.args.account, job_id)
+            def report(job_id, progress, overall):
+                if journal is not None:
+                    journal.polled(job_id, progress)
                 sys.stderr.write('.')
-                time.sleep(0.1)
+            sys.stderr.write('Sending purge...')
+            poller = PurgePoller(self.client, self.args.account, workers=self.args.workers)
+            poller.poll(journal.pending(result.job_ids) if journal is not None else result.job_ids, callback=report)
             sys.stderr.write('Done!\n')
         else:
-            sys.stdout.write(job_id)
-            sys.stdout.write("\n")
+            for job_id in result.job_ids:
+                sys.stdout.write(job_id)
+                sys.stdout.write("\n")
+        if journal is not None:
+            journal.close()
 
     @command([
-        {'name': 'account', 'help': 'Account from which to purge assets'},
+        {'name': 'account', 'help': 'Account from which to purge assets' + _default_account_help, 'nargs': '?'},
         {'name': 'job_id', 'help': 'Job id for which to fetch status'},
     ])
     @authenticated
@@ -344,71 +659,297 @@ class Command:
         sys.stdout.write("\n")
 
     @command([
-        {'name': 'account', 'help': 'Account from which to purge assets'},
+        {'name': 'account', 'help': 'Account from which to purge assets' + _default_account_help, 'nargs': '?'},
         {'name': 'host', 'help': 'Hash of host to clone'},
+        {'name': '--with-configuration', 'help': 'Include the configuration of every scope, as read by diff_host',
+            'action': 'store_true'},
+        _output_argument,
         ])
     @authenticated
     def get_host(self):
+        import requests
         try:
-            host = self.client.get_host(self.args.account, self.args.host)
-        except APIError as e:
+            if self.args.with_configuration:
+                from striketracker.diff import host_snapshot
+                host = host_snapshot(self.client, self.args.account, self.args.host)
+            else:
+                host = self.client.get_host(self.args.account, self.args.host)
+        except (APIError, requests.RequestException) as e:
             self._error(e)
         self._print(host)
 
     @command([
-        {'name': 'account', 'help': 'Account from which to purge assets'},
+        {'name': 'account', 'help': 'Account containing the host' + _default_account_help, 'nargs': '?'},
+        {'name': 'host', 'help': 'Hash of host to compare'},
+        {'name': '--to-host', 'help': 'Hash of host to compare against'},
+        {'name': '--to-account', 'help': 'Account containing the host to compare against (defaults to account)'},
+        {'name': '--file', 'help': 'Compare against a snapshot saved with get_host --with-configuration'},
+        {'name': '--workers', 'help': 'Number of requests to make concurrently', 'type': int, 'default': 8},
+        _output_argument,
+    ])
+    @authenticated
+    def diff_host(self):
+        import requests
+        from striketracker.diff import diff_snapshots, host_snapshot, host_snapshots
+        if (self.args.to_host is None) == (self.args.file is None):
+            sys.stderr.write("Supply exactly one of --to-host or --file\n")
+            exit(1)
+        try:
+            if self.args.file is not None:
+                with open(self.args.file, 'r') as f:
+                    other = _load_yaml(f)
+                snapshot = host_snapshot(self.client, self.args.account, self.args.host, self.args.workers)
+            else:
+                snapshot, other = host_snapshots(self.client, [
+                    (self.args.account, self.args.host),
+                    (self.args.to_account or self.args.account, self.args.to_host)], self.args.workers)
+        except (APIError, requests.RequestException) as e:
+            self._error(e)
+        differences = diff_snapshots(snapshot, other)
+        if self.args.output == 'jsonl':
+            for difference in differences:
+                self._print(difference)
+        else:
+            self._print(differences)
+
+        # Like diff, exit non-zero when the hosts differ
+        if differences:
+            exit(1)
+
+    @command([
+        {'name': 'account', 'help': 'Account from which to purge assets' + _default_account_help, 'nargs': '?'},
         {'name': 'host', 'help': 'Hash of host to clone'},
+        {'name': '--workers', 'help': 'Number of scopes to clone concurrently', 'type': int, 'default': 4},
+        _output_argument,
     ])
     @authenticated
     def clone_host(self):
+        import json
+        import requests
+        from striketracker.clone import HostCloner
+        cloner = HostCloner(self.client, workers=self.args.workers)
         try:
             # Grab host to clone
             host = self.client.get_host(self.args.account, self.args.host)
 
             # Create new host
-            new_host = self.client.create_host(self.args.account, {
-                "name": "%s (copy)" % host['name'],
-                "services": host['services']
-            })
-        except APIError as e:
+            new_host = cloner.create_host(self.args.account, host)
+        except (APIError, requests.RequestException) as e:
+            self._error(e)
+        if self.args.output == 'yaml':
+            sys.stdout.write("\nHost:\n")
+            _dump_yaml(new_host, sys.stdout)
+            sys.stdout.write("\nConfiguration:")
+        elif self.args.output == 'json':
+            # Stream a single JSON document, writing each scope as soon as it is cloned
+            sys.stdout.write('{"host": %s, "scopes": [' % json.dumps(new_host, sort_keys=True))
+        else:
+            sys.stdout.write(json.dumps({"host": new_host}, sort_keys=True) + "\n")
+        sys.stdout.flush()
+
+        # Clone the source's scopes, reporting each in order as it completes
+        failed = 0
+        separator = "\n"
+        for result in cloner.clone_scopes(self.args.account, self.args.host, self.args.account,
+                                          new_host['hashCode'], host['scopes']):
+            if result.error is not None:
+                failed += 1
+                sys.stderr.write("{platform}\t{path}\t".format(**result.scope))
+                self._write_error(result.error)
+                continue
+            if self.args.output == 'yaml':
+                sys.stdout.write("\n{platform}\t{path}\n".format(**result.new_scope))
+                _dump_yaml(result.configuration, sys.stdout)
+            else:
+                scope = json.dumps({"scope": result.new_scope, "configuration": result.configuration}, sort_keys=True)
+                if self.args.output == 'json':
+                    sys.stdout.write(separator)
+                    separator = ",\n"
+                sys.stdout.write(scope + ("" if self.args.output == 'json' else "\n"))
+            sys.stdout.flush()
+        if self.args.output == 'json':
+            sys.stdout.write("\n]}\n")
+        if failed:
+            sys.stderr.write("Could not clone %d of %d scopes\n" % (failed, len(host['scopes'])))
+            exit(1)
+
+    @command([
+        {'name': 'account', 'help': 'Account containing the source host' + _default_account_help, 'nargs': '?'},
+        {'name': 'host', 'help': 'Hash of host to copy configuration from'},
+        {'name': 'target_host', 'help': 'Hash of host to copy configuration to'},
+        {'name': '--to-account', 'help': 'Account containing the target host (defaults to account)'},
+        {'name': '--workers', 'help': 'Number of scopes to sync concurrently', 'type': int, 'default': 4},
+        _output_argument,
+    ])
+    @authenticated
+    def sync_host(self):
+        import requests
+        from striketracker.sync import HostSyncer
+        target_account = self.args.to_account or self.args.account
+        try:
+            source = self.client.get_host(self.args.account, self.args.host)
+            target = self.client.get_host(target_account, self.args.target_host)
+        except (APIError, requests.RequestException) as e:
             self._error(e)
-        sys.stdout.write("\nHost:\n")
-        yaml.dump(new_host, sys.stdout, Dumper=SafeDumper, default_flow_style=False)
 
-        # Iterate over the source's scopes
-        sys.stdout.write("\nConfiguration:")
-        for scope in host['scopes']:
-            # Create each required scope
+        # Report each scope in source order as soon as it is synced
+        syncer = HostSyncer(self.client, workers=self.args.workers)
+        changes = {'created': 0, 'updated': 0, 'unchanged': 0}
+        results = []
+        failed = 0
+        for result in syncer.sync_scopes(self.args.account, self.args.host, target_account, self.args.target_host,
+                                         source['scopes'], target['scopes']):
+            if result.error is not None:
+                failed += 1
+                sys.stderr.write("{platform}\t{path}\t".format(**result.scope))
+                self._write_error(result.error)
+                continue
+            changes[result.change] += 1
+            item = {"platform": result.scope['platform'], "path": result.scope['path'], "change": result.change}
+            if self.args.output == 'jsonl':
+                self._print(item)
+                sys.stdout.flush()
+            else:
+                results.append(item)
+        if self.args.output != 'jsonl':
+            self._print(results)
+        sys.stderr.write("Created {created}, updated {updated} and left {unchanged} scopes unchanged\n".format(
+            **changes))
+        if failed:
+            sys.stderr.write("Could not sync %d of %d scopes\n" % (failed, len(source['scopes'])))
+            exit(1)
+
+    @command([
+        {'name': 'manifest', 'help': 'CSV file of account,host,target account,new name rows (defaults to stdin)',
+            'nargs': '?', 'default': '-'},
+        {'name': '--workers', 'help': 'Number of hosts to clone concurrently', 'type': int, 'default': 2},
+        {'name': '--scope-workers', 'help': 'Number of scopes to clone concurrently for each host',
+            'type': int, 'default': 4},
+        {'name': '--rate', 'help': 'Maximum number of API requests per second across all hosts', 'type': float},
+    ])
+    @authenticated
+    @validated
+    def bulk_clone(self):
+        import json
+        from striketracker.clone import BulkCloner, read_manifest
+        from striketracker.ratelimit import TokenBucket
+        if self.args.rate:
+            self.client.rate_limiter = TokenBucket(self.args.rate)
+        manifest = sys.stdin if self.args.manifest == '-' else open(self.args.manifest)
+        self.client.resize_pool(self.args.workers * self.args.scope_workers)
+        failed = 0
+        cloner = BulkCloner(self.client, workers=self.args.workers, scope_workers=self.args.scope_workers)
+        for result in cloner.clone(read_manifest(manifest)):
+            if result['error'] is not None or result['failedScopes']:
+                failed += 1
+            sys.stdout.write(json.dumps(result, sort_keys=True) + "\n")
+            sys.stdout.flush()
+        if manifest is not sys.stdin:
+            manifest.close()
+        if failed:
+            exit(1)
+
+    @command([
+        {'name': 'account', 'help': 'Account whose hosts to export' + _default_account_help, 'nargs': '?'},
+        {'name': 'directory', 'help': 'Directory in which to store the export, refreshing any previous export there'},
+        {'name': '--workers', 'help': 'Number of requests to make concurrently', 'type': int, 'default': 8},
+        _output_argument,
+    ])
+    @authenticated
+    @validated
+    def export(self):
+        import requests
+        from striketracker.export import AccountExporter, SnapshotStore
+        from striketracker.query import ConfigurationIndex
+        self.client.resize_pool(self.args.workers)
+        store = SnapshotStore(self.args.directory)
+        exporter = AccountExporter(self.client, store, workers=self.args.workers)
+        try:
+            result = exporter.export(self.args.account)
+        except (APIError, requests.RequestException) as e:
+            self._error(e)
+
+        # Index the new snapshots now so that queries need not
+        ConfigurationIndex(store).refresh()
+        self._print(result)
+        if result['errors']:
+            exit(1)
+
+    @command([
+        {'name': 'directory', 'help': 'Directory containing an export'},
+        {'name': 'expressions', 'help': 'Conditions that every matching scope meets, such as '
+            'originPullHost.primary=1234 or cacheControl.maxAge<60', 'nargs': '*'},
+        _output_argument,
+    ])
+    def query(self):
+        from striketracker.export import SnapshotStore
+        from striketracker.query import ConfigurationIndex
+        try:
+            scopes = ConfigurationIndex(SnapshotStore(self.args.directory)).refresh().query(self.args.expressions)
+        except ValueError as e:
+            sys.stderr.write("%s\n" % e)
+            exit(1)
+        if self.args.output == 'jsonl':
+            for scope in scopes:
+                self._print(scope)
+        else:
+            self._print(scopes)
+
+    @command([
+        {'name': 'directory', 'help': 'Directory containing an export'},
+        {'name': 'account', 'help': 'Account whose exported hosts to restore'},
+        {'name': 'hosts', 'help': 'Hashes of the exported hosts to restore (defaults to all)', 'nargs': '*'},
+        {'name': '--to-account', 'help': 'Account in which to create the hosts (defaults to account)'},
+        {'name': '--workers', 'help': 'Number of hosts to restore concurrently', 'type': int, 'default': 2},
+        {'name': '--scope-workers', 'help': 'Number of scopes to restore concurrently for each host',
+            'type': int, 'default': 4},
+    ])
+    @authenticated
+    @validated
+    def restore(self):
+        import json
+        from striketracker.export import AccountImporter, SnapshotStore
+        self.client.resize_pool(self.args.workers * self.args.scope_workers)
+        importer = AccountImporter(self.client, SnapshotStore(self.args.directory), workers=self.args.workers,
+                                   scope_workers=self.args.scope_workers)
+        failed = 0
+        for result in importer.restore(self.args.account, self.args.to_account, self.args.hosts):
+            if result['error'] is not None or result['failedScopes']:
+                failed += 1
+            sys.stdout.write(json.dumps(result, sort_keys=True) + "\n")
+            sys.stdout.flush()
+        if failed:
+            exit(1)
+
+    @command([
+        {'name': '--socket', 'help': 'Serve requests on this Unix socket instead of reading them from stdin'},
+        {'name': '--workers', 'help': 'Number of requests to run concurrently', 'type': int, 'default': 8},
+    ])
+    @authenticated
+    @validated
+    def batch(self):
+        from striketracker.batch import BatchRunner, remove_socket
+        self.client.resize_pool(self.args.workers)
+        runner = BatchRunner(self.client, workers=self.args.workers)
+        if not self.args.socket:
+            runner.serve(sys.stdin, sys.stdout)
+            runner.close()
+            return
+
+        try:
+            server = runner.listen(self.args.socket)
+        except ValueError as e:
+            runner.close()
+            self._error(e)
+        sys.stderr.write('Listening on %s\n' % self.args.socket)
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
             try:
-                new_scope = self.client.create_scope(self.args.account, new_host['hashCode'], {
-                    "platform": scope['platform'],
-                    "path": scope['path']
-                })
-
-                # Get configuration from source
-                old_configuration = self.client.get_configuration(
-                    self.args.account, self.args.host, scope['id'])
-
-                # Delete scope and hostnames
-                del old_configuration['scope']
-                if 'hostname' in old_configuration.keys():
-                    del old_configuration['hostname']
-
-                # Delete IDs
-                def strip_ids(typeInstance):
-                    if 'id' in typeInstance:
-                        del typeInstance['id']
-                for typeName, confType in old_configuration.iteritems():
-                    if type(confType) is list:
-                        for index in range(len(confType)):
-                            strip_ids(confType[index])
-                    else:
-                        strip_ids(confType)
-
-                # Post configuration to target
-                new_configuration = self.client.update_configuration(
-                    self.args.account, new_host['hashCode'], new_scope['id'], old_configuration)
-                sys.stdout.write("\n{platform}\t{path}\n".format(**new_scope))
-                yaml.dump(new_configuration, sys.stdout, Dumper=SafeDumper, default_flow_style=False)
-            except APIError as e:
-                self._error(e)
\ No newline at end of file
+                remove_socket(self.args.socket)
+            except ValueError:
+                pass
+            runner.close()
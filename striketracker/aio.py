@@ -0,0 +1,245 @@
+# Python 3.5.2 or later, since it uses async/await and asyncio streams. setup.py leaves it out on Python 2
+import asyncio
+import json
+import ssl
+from urllib.parse import urlencode, urlsplit
+
+from striketracker import APIError
+from striketracker.retry import RetryPolicy
+
+
+class AsyncResponse(object):
+    def __init__(self, status_code, headers, content):
+        self.status_code = status_code
+        self.headers = headers
+        self.content = content
+
+    def json(self):
+        return json.loads(self.content.decode('utf-8'))
+
+
+class _Connection(object):
+    # Minimal HTTP/1.1 client connection that handles one request at a time and can be kept alive between them
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+        self.keep_alive = True
+
+    def close(self):
+        self.writer.close()
+
+    async def _line(self):
+        line = await self.reader.readline()
+        if not line.endswith(b'\n'):
+            raise ConnectionError('Connection closed before response completed')
+        return line.rstrip(b'\r\n')
+
+    async def request(self, payload):
+        self.writer.write(payload)
+        status = int((await self._line()).split(b' ', 2)[1])
+        headers = {}
+        while True:
+            line = await self._line()
+            if not line:
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+        if status in (204, 304) or status < 200:
+            content = b''
+        elif headers.get('transfer-encoding', '').lower() == 'chunked':
+            content = await self._dechunk()
+        elif 'content-length' in headers:
+            content = await self.reader.readexactly(int(headers['content-length']))
+        else:
+            # Body runs until the server closes the connection
+            content = await self.reader.read()
+            self.keep_alive = False
+        if headers.get('connection', '').lower() == 'close':
+            self.keep_alive = False
+        return AsyncResponse(status, headers, content)
+
+    async def _dechunk(self):
+        content = []
+        while True:
+            size = int((await self._line()).split(b';')[0], 16)
+            if size == 0:
+                break
+            content.append(await self.reader.readexactly(size))
+            await self._line()
+        # Trailers may follow the last chunk up to a blank line. They are part of this response, so they must be read
+        # here rather than left to be taken for the start of the next one
+        while await self._line():
+            pass
+        return b''.join(content)
+
+
+class AsyncAPIClient(object):
+    def __init__(self, base_url='https://striketracker.highwinds.com', token=None, pool_maxsize=10, timeout=None):
+        self.base_url = base_url
+        self.token = token
+        self.pool_maxsize = pool_maxsize
+        self.timeout = timeout
+
+        parts = urlsplit(base_url)
+        self._host = parts.hostname
+        self._secure = parts.scheme == 'https'
+        self._port = parts.port or (443 if self._secure else 80)
+        self._prefix = parts.path.rstrip('/')
+        self._ssl = ssl.create_default_context() if self._secure else None
+
+        # Idle keep-alive connections, and a semaphore holding at most pool_maxsize requests in flight. It is created
+        # on first use so that it belongs to the loop the client is used from
+        self._idle = []
+        self._slots = None
+
+    def close(self):
+        while self._idle:
+            self._idle.pop().close()
+
+    async def _open(self):
+        reader, writer = await asyncio.open_connection(self._host, self._port, ssl=self._ssl)
+        return _Connection(reader, writer)
+
+    async def _exchange(self, connection, payload):
+        # Keep the connection for the next request only if this one completed and the server allows it
+        try:
+            response = await connection.request(payload)
+        except BaseException:
+            connection.close()
+            raise
+        if connection.keep_alive:
+            self._idle.append(connection)
+        else:
+            connection.close()
+        return response
+
+    async def _send(self, method, payload):
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.pool_maxsize)
+        async with self._slots:
+            while self._idle:
+                connection = self._idle.pop()
+                if connection.reader.at_eof():
+                    connection.close()
+                    continue
+                try:
+                    return await self._exchange(connection, payload)
+                except (ConnectionError, EOFError):
+                    # The server closed an idle keep-alive connection, so try once more on a fresh one. Other methods
+                    # are not sent again, since the server may have acted on them before the connection closed
+                    if method not in RetryPolicy.IDEMPOTENT_METHODS:
+                        raise
+                    break
+            return await self._exchange(await self._open(), payload)
+
+    def _payload(self, method, path, headers, body):
+        headers = dict(headers, Host=self._host if self._port in (80, 443) else '%s:%d' % (self._host, self._port))
+        headers['Content-Length'] = str(len(body))
+        headers.setdefault('Connection', 'keep-alive')
+        lines = ['%s %s HTTP/1.1' % (method, path)] + ['%s: %s' % header for header in headers.items()]
+        return ('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1') + body
+
+    async def _request(self, method, endpoint, url_args=None, token=None, authenticate=True, json_body=None,
+                       data=None, headers=None):
+        headers = dict(headers or {})
+        if authenticate:
+            headers['Authorization'] = 'Bearer %s' % (token if token is not None else self.token)
+        body = b''
+        if json_body is not None:
+            body = json.dumps(json_body).encode('utf-8')
+            headers['Content-Type'] = 'application/json'
+        elif data is not None:
+            body = urlencode(data).encode('utf-8')
+            headers['Content-Type'] = 'application/x-www-form-urlencoded'
+        path = self._prefix + endpoint.format(**(url_args or {}))
+        payload = self._payload(method, path, headers, body)
+        if self.timeout is None:
+            return await self._send(method, payload)
+        # One timeout covers waiting for a free slot, connecting and the request itself
+        return await asyncio.wait_for(self._send(method, payload), self.timeout)
+
+    async def _json(self, request, status, message, key=None):
+        response = await request
+        if status is not None and response.status_code != status:
+            raise APIError(message, response)
+        try:
+            body = response.json()
+        except ValueError:
+            raise APIError(message, response)
+        if key is not None:
+            if not isinstance(body, dict) or key not in body:
+                raise APIError(message, response)
+            return body[key]
+        return body
+
+    async def version(self):
+        response = await self._request('GET', '/version', authenticate=False)
+        return response.headers['x-cdnws-version']
+
+    async def me(self):
+        return await self._json(self._request('GET', '/api/v1/users/me'), 200, 'Could not fetch user details')
+
+    async def list_hosts(self, account):
+        return await self._json(self._request('GET', '/api/v1/accounts/{account}/hosts', {'account': account}),
+                                200, 'Could not fetch hosts', 'list')
+
+    async def list_subaccounts(self, account):
+        return await self._json(self._request('GET', '/api/v1/accounts/{account}/subaccounts', {'account': account}),
+                                200, 'Could not fetch subaccounts', 'list')
+
+    async def get_host(self, account, host):
+        return await self._json(self._request('GET', '/api/v1/accounts/{account}/hosts/{host}',
+                                              {'account': account, 'host': host}), 200, 'Could not fetch host')
+
+    async def create_host(self, account, host):
+        return await self._json(self._request('POST', '/api/v1/accounts/{account}/hosts', {'account': account},
+                                              json_body=host), 201, 'Could not create host')
+
+    async def create_scope(self, account, host, scope):
+        return await self._json(self._request('POST', '/api/v1/accounts/{account}/hosts/{host}/configuration/scopes',
+                                              {'account': account, 'host': host}, json_body=scope),
+                                200, 'Could not create scope')
+
+    async def update_configuration(self, account, host, scope, configuration):
+        return await self._json(self._request('PUT', '/api/v1/accounts/{account}/hosts/{host}/configuration/{scope}',
+                                              {'account': account, 'host': host, 'scope': scope},
+                                              json_body=configuration), 200, 'Could not update configuration')
+
+    async def get_configuration(self, account, host, scope):
+        return await self._json(self._request('GET', '/api/v1/accounts/{account}/hosts/{host}/configuration/{scope}',
+                                              {'account': account, 'host': host, 'scope': scope}),
+                                200, 'Could not fetch configuration')
+
+    async def create_token(self, username, password, application=None):
+        if application is None:
+            application = 'StrikeTracker Python client'
+
+        # Grab an access token, then the user's id and root account hash, then generate a new API token
+        access_token = await self._json(self._request('POST', '/auth/token', authenticate=False, data={
+            "username": username, "password": password, "grant_type": "password"
+        }, headers={'User-Agent': application}), None, 'Could not fetch access token', 'access_token')
+
+        user_response = await self._request('GET', '/api/v1/users/me', token=access_token)
+        try:
+            user = user_response.json()
+        except ValueError:
+            user = {}
+        if 'accountHash' not in user or 'id' not in user:
+            raise APIError('Could not fetch user\'s root account hash', user_response)
+
+        self.token = await self._json(self._request('POST', '/api/v1/accounts/{account_hash}/users/{user_id}/tokens', {
+            'account_hash': user['accountHash'], 'user_id': user['id']
+        }, token=access_token, json_body={
+            "password": password, "application": application
+        }), None, 'Could not generate API token', 'token')
+        return self.token
+
+    async def purge(self, account_hash, urls):
+        return await self._json(self._request('POST', '/api/v1/accounts/{account_hash}/purge',
+                                              {'account_hash': account_hash}, json_body={"list": urls}),
+                                None, 'Could not send purge batch', 'id')
+
+    async def purge_status(self, account_hash, job_id):
+        return float(await self._json(self._request('GET', '/api/v1/accounts/{account_hash}/purge/{job_id}',
+                                                    {'account_hash': account_hash, 'job_id': job_id}),
+                                      None, 'Could not fetch purge status', 'progress'))
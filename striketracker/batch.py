@@ -0,0 +1,104 @@
+import json
+import os
+import stat
+import threading
+try:
+    import socketserver
+except ImportError:
+    import SocketServer as socketserver
+
+from striketracker import APIError
+from striketracker.concurrency import WorkerPool
+
+# APIClient methods that batch requests may call
+METHODS = ('version', 'me', 'list_hosts', 'list_subaccounts', 'get_host', 'create_host', 'create_scope',
+           'get_configuration', 'update_configuration', 'purge', 'purge_status')
+
+
+def remove_socket(path):
+    # Remove a socket left behind by an earlier server, but never a file that --socket named by mistake
+    try:
+        mode = os.stat(path).st_mode
+    except OSError:
+        return
+    if not stat.S_ISSOCK(mode):
+        raise ValueError('%s exists and is not a socket' % path)
+    os.unlink(path)
+
+
+def _error(e):
+    if isinstance(e, APIError):
+        error = {"message": '%s' % e}
+        try:
+            error["status"] = e.context.status_code
+            error["detail"] = e.context.json()['error']
+        except Exception:
+            pass
+        return error
+    return {"message": "%s: %s" % (type(e).__name__, e)}
+
+
+class BatchRunner(object):
+    def __init__(self, client, workers=8):
+        self.client = client
+        self.workers = workers
+        self.pool = WorkerPool(workers)
+
+    def handle(self, line):
+        # Run one request, e.g. {"id": 1, "method": "get_host", "params": {"account": "x1x2x3x4", "host": "a1b2c3d4"}}
+        try:
+            request = json.loads(line)
+        except ValueError as e:
+            return {"id": None, "result": None, "error": {"message": "Invalid JSON: %s" % e}}
+        request_id = request.get('id') if isinstance(request, dict) else None
+        try:
+            if not isinstance(request, dict) or request.get('method') not in METHODS:
+                raise ValueError('Unknown method: %s' % (request.get('method') if isinstance(request, dict) else None))
+            params = request.get('params') or {}
+            method = getattr(self.client, request['method'])
+            result = method(*params) if isinstance(params, list) else method(**params)
+        except Exception as e:
+            return {"id": request_id, "result": None, "error": _error(e)}
+        return {"id": request_id, "result": result, "error": None}
+
+    def serve(self, input, output):
+        # Run each line of input concurrently, writing responses to output as they complete
+        lock = threading.Lock()
+        in_flight = threading.Semaphore(self.workers * 2)
+
+        def write(future):
+            try:
+                with lock:
+                    output.write(json.dumps(future.result(), sort_keys=True) + "\n")
+                    output.flush()
+            finally:
+                in_flight.release()
+
+        for line in iter(input.readline, ''):
+            if not line.strip():
+                continue
+            in_flight.acquire()
+            self.pool.submit(self.handle, line).add_done_callback(write)
+
+        # Wait for everything still running
+        for _ in range(self.workers * 2):
+            in_flight.acquire()
+        for _ in range(self.workers * 2):
+            in_flight.release()
+
+    def listen(self, path):
+        # Serve requests from every connection to a Unix socket until shutdown() is called on the returned server
+        runner = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def handle(self):
+                runner.serve(self.rfile, self.wfile)
+
+        class Server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+            daemon_threads = True
+
+        remove_socket(path)
+        return Server(path, Handler)
+
+    def close(self):
+        self.pool.shutdown()
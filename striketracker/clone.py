@@ -0,0 +1,124 @@
+import csv
+
+import requests
+
+from striketracker import APIError
+from striketracker.concurrency import parallel_map
+
+
+def strip_ids(type_instance):
+    if isinstance(type_instance, dict) and 'id' in type_instance:
+        type_instance = dict(type_instance)
+        del type_instance['id']
+    return type_instance
+
+
+def normalize_configuration(configuration):
+    # Copy of a scope's configuration without its scope, hostnames or type ids so it can be applied to another scope
+    normalized = {}
+    for type_name, conf_type in configuration.items():
+        if type_name in ('scope', 'hostname'):
+            continue
+        if type(conf_type) is list:
+            normalized[type_name] = [strip_ids(instance) for instance in conf_type]
+        else:
+            normalized[type_name] = strip_ids(conf_type)
+    return normalized
+
+
+class ScopeResult(object):
+    def __init__(self, scope, new_scope=None, configuration=None, error=None, change=None):
+        self.scope = scope
+        self.new_scope = new_scope
+        self.configuration = configuration
+        self.error = error
+        self.change = change
+
+
+class HostCloner(object):
+    def __init__(self, client, workers=4):
+        self.client = client
+        self.workers = workers
+
+    def create_host(self, account, host, name=None, target_account=None):
+        return self.client.create_host(target_account or account, {
+            "name": name or "%s (copy)" % host['name'],
+            "services": host['services']
+        })
+
+    def _clone_scope(self, account, host, target_account, target_host, scope):
+        # Fetch the source configuration before creating anything so a failed fetch leaves no empty scope behind
+        configuration = normalize_configuration(self.client.get_configuration(account, host, scope['id']))
+        new_scope = self.client.create_scope(target_account, target_host, {
+            "platform": scope['platform'],
+            "path": scope['path']
+        })
+        new_configuration = self.client.update_configuration(
+            target_account, target_host, new_scope['id'], configuration)
+        return new_scope, new_configuration
+
+    def clone_scopes(self, account, host, target_account, target_host, scopes):
+        # Clone scopes concurrently, yielding a ScopeResult for each in source order as soon as it is ready
+        clone = lambda scope: self._clone_scope(account, host, target_account, target_host, scope)
+        for scope, future in parallel_map(clone, scopes, self.workers):
+            error = future.exception()
+            if error is None:
+                new_scope, configuration = future.result()
+                yield ScopeResult(scope, new_scope, configuration)
+            elif isinstance(error, (APIError, requests.RequestException)):
+                yield ScopeResult(scope, error=error)
+            else:
+                raise error
+
+    def clone(self, account, host, name=None, target_account=None):
+        source = self.client.get_host(account, host)
+        new_host = self.create_host(account, source, name, target_account)
+        results = list(self.clone_scopes(
+            account, host, target_account or account, new_host['hashCode'], source['scopes']))
+        return new_host, results
+
+
+def read_manifest(stream):
+    # Each row is: source account, source host, target account (defaults to source) and new name (optional)
+    for row in csv.reader(line for line in stream if line.strip() and not line.startswith('#')):
+        row = [column.strip() for column in row] + [''] * (4 - len(row))
+        yield {
+            "account": row[0],
+            "host": row[1],
+            "target_account": row[2] or row[0],
+            "name": row[3] or None
+        }
+
+
+class BulkCloner(object):
+    def __init__(self, client, workers=2, scope_workers=4):
+        self.client = client
+        self.workers = workers
+        self.cloner = HostCloner(client, workers=scope_workers)
+
+    def _clone(self, row):
+        result = dict(row, hashCode=None, scopes=0, failedScopes=[], error=None)
+        try:
+            host = self.client.get_host(row['account'], row['host'])
+            new_host = self.cloner.create_host(row['account'], host, row['name'], row['target_account'])
+        except (APIError, requests.RequestException) as e:
+            result['error'] = str(e)
+            return result
+        result['hashCode'] = new_host['hashCode']
+        result['name'] = new_host['name']
+        for scope in self.cloner.clone_scopes(row['account'], row['host'], row['target_account'],
+                                              new_host['hashCode'], host['scopes']):
+            if scope.error is None:
+                result['scopes'] += 1
+            else:
+                result['failedScopes'].append({
+                    "platform": scope.scope['platform'],
+                    "path": scope.scope['path'],
+                    "error": str(scope.error)
+                })
+        return result
+
+    def clone(self, rows):
+        # Clone hosts concurrently, yielding a result for each manifest row in order as soon as it is ready
+        for row, future in parallel_map(self._clone, rows, self.workers):
+            yield future.result()
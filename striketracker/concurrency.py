@@ -0,0 +1,111 @@
+import collections
+import threading
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+
+class Future(object):
+    def __init__(self):
+        self._done = threading.Event()
+        self._result = None
+        self._exception = None
+        self._callbacks = []
+        self._lock = threading.Lock()
+
+    def done(self):
+        return self._done.is_set()
+
+    def set_result(self, result):
+        self._result = result
+        self._finish()
+
+    def set_exception(self, exception):
+        self._exception = exception
+        self._finish()
+
+    def _finish(self):
+        with self._lock:
+            self._done.set()
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            callback(self)
+
+    def add_done_callback(self, callback):
+        with self._lock:
+            if not self._done.is_set():
+                self._callbacks.append(callback)
+                return
+        callback(self)
+
+    def exception(self, timeout=None):
+        if not self._done.wait(timeout):
+            raise RuntimeError('Timed out waiting for result')
+        return self._exception
+
+    def result(self, timeout=None):
+        if self.exception(timeout) is not None:
+            raise self._exception
+        return self._result
+
+
+def _run(fn, future, *args):
+    try:
+        future.set_result(fn(*args))
+    except Exception as e:
+        future.set_exception(e)
+
+
+class WorkerPool(object):
+    def __init__(self, workers=4):
+        self.tasks = queue.Queue()
+        self.threads = []
+        for _ in range(workers):
+            thread = threading.Thread(target=self._work)
+            thread.daemon = True
+            thread.start()
+            self.threads.append(thread)
+
+    def _work(self):
+        while True:
+            task = self.tasks.get()
+            if task is None:
+                return
+            _run(*task)
+
+    def submit(self, fn, *args):
+        future = Future()
+        self.tasks.put((fn, future) + args)
+        return future
+
+    def shutdown(self, wait=True):
+        for _ in self.threads:
+            self.tasks.put(None)
+        if wait:
+            for thread in self.threads:
+                thread.join()
+
+
+def parallel_map(fn, iterable, workers=4):
+    # Lazily pull items from iterable and yield (item, future) pairs in input order, never holding
+    # more than twice as many items in flight as there are workers
+    pool = WorkerPool(workers)
+    pending = collections.deque()
+    drained = False
+    try:
+        for item in iterable:
+            pending.append((item, pool.submit(fn, item)))
+            if len(pending) >= workers * 2:
+                item, future = pending.popleft()
+                future.exception()
+                yield item, future
+        while pending:
+            item, future = pending.popleft()
+            future.exception()
+            yield item, future
+        drained = True
+    finally:
+        # Join the workers once every task has finished, so none is left running as the interpreter exits. A caller
+        # that stops early does not wait for the tasks still in flight
+        pool.shutdown(wait=drained)
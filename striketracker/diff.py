@@ -0,0 +1,83 @@
+import collections
+
+from striketracker.clone import normalize_configuration
+from striketracker.concurrency import parallel_map
+
+
+def host_snapshots(client, hosts, workers=8):
+    # Fetch each (account, host) pair and every one of their scopes' configurations concurrently, returning one
+    # {"host": ..., "scopes": [{"scope": ..., "configuration": ...}]} snapshot per pair
+    fetched = [future.result() for pair, future in parallel_map(lambda pair: client.get_host(*pair), hosts, workers)]
+    snapshots = [{"host": host, "scopes": []} for host in fetched]
+    scopes = [(position, account, hash_code, scope)
+              for position, ((account, hash_code), host) in enumerate(zip(hosts, fetched))
+              for scope in host['scopes']]
+    fetch = lambda item: client.get_configuration(item[1], item[2], item[3]['id'])
+    for (position, account, hash_code, scope), future in parallel_map(fetch, scopes, workers):
+        snapshots[position]['scopes'].append({"scope": scope, "configuration": future.result()})
+    return snapshots
+
+
+def host_snapshot(client, account, host, workers=8):
+    return host_snapshots(client, [(account, host)], workers)[0]
+
+
+def scope_key(scope):
+    return '%s %s' % (scope['platform'], scope['path'])
+
+
+def scope_configurations(snapshot):
+    # Normalized configurations keyed by platform and path, which identify a scope across hosts
+    return collections.OrderedDict((scope_key(item['scope']), normalize_configuration(item['configuration']))
+                                   for item in snapshot['scopes'])
+
+
+def diff_values(left, right, path=''):
+    # Yield (change, path, left, right) for every difference between two JSON values
+    if left == right:
+        return
+    if isinstance(left, dict) and isinstance(right, dict):
+        for key in sorted(set(left) | set(right)):
+            child = '%s.%s' % (path, key) if path else key
+            if key not in right:
+                yield 'removed', child, left[key], None
+            elif key not in left:
+                yield 'added', child, None, right[key]
+            else:
+                for difference in diff_values(left[key], right[key], child):
+                    yield difference
+    elif isinstance(left, list) and isinstance(right, list):
+        for index in range(max(len(left), len(right))):
+            child = '%s[%d]' % (path, index)
+            if index >= len(right):
+                yield 'removed', child, left[index], None
+            elif index >= len(left):
+                yield 'added', child, None, right[index]
+            else:
+                for difference in diff_values(left[index], right[index], child):
+                    yield difference
+    else:
+        yield 'changed', path, left, right
+
+
+def diff_snapshots(left, right):
+    left_scopes = scope_configurations(left)
+    right_scopes = scope_configurations(right)
+    differences = []
+    for key in list(left_scopes) + [key for key in right_scopes if key not in left_scopes]:
+        if key not in right_scopes:
+            differences.append({"scope": key, "change": "removed", "path": "", "left": left_scopes[key],
+                                "right": None})
+        elif key not in left_scopes:
+            differences.append({"scope": key, "change": "added", "path": "", "left": None,
+                                "right": right_scopes[key]})
+        else:
+            for change, path, left_value, right_value in diff_values(left_scopes[key], right_scopes[key]):
+                differences.append({"scope": key, "change": change, "path": path, "left": left_value,
+                                    "right": right_value})
+    return differences
+
+
+def diff_host(client, account, host, other_account, other_host, workers=8):
+    left, right = host_snapshots(client, [(account, host), (other_account, other_host)], workers)
+    return diff_snapshots(left, right)
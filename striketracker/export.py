@@ -0,0 +1,197 @@
+import json
+import os
+
+import requests
+
+from striketracker import APIError, atomic_write
+from striketracker.clone import normalize_configuration
+from striketracker.concurrency import parallel_map
+
+
+class SnapshotStore(object):
+    # One compact JSON file per host at directory/account/host.json, in the format printed by
+    # get_host --with-configuration plus the ETag of each document so later exports can revalidate it
+    def __init__(self, directory):
+        self.directory = directory
+
+    def _path(self, account, host=None):
+        if host is None:
+            return os.path.join(self.directory, account)
+        return os.path.join(self.directory, account, '%s.json' % host)
+
+    def accounts(self):
+        try:
+            return sorted(name for name in os.listdir(self.directory)
+                          if os.path.isdir(os.path.join(self.directory, name)))
+        except OSError:
+            return []
+
+    def hosts(self, account):
+        try:
+            names = os.listdir(self._path(account))
+        except OSError:
+            return []
+        return sorted(name[:-len('.json')] for name in names if name.endswith('.json') and not name.startswith('.'))
+
+    def stamp(self, account, host):
+        # Changes whenever a host's snapshot is rewritten
+        try:
+            stat = os.stat(self._path(account, host))
+        except OSError:
+            return None
+        return [stat.st_mtime, stat.st_size]
+
+    def load(self, account, host):
+        try:
+            with open(self._path(account, host)) as f:
+                return json.load(f)
+        except (IOError, OSError, ValueError):
+            return None
+
+    def save(self, account, snapshot):
+        directory = self._path(account)
+        try:
+            os.makedirs(directory)
+        except OSError:
+            pass
+        atomic_write(self._path(account, snapshot['host']['hashCode']),
+                     json.dumps(snapshot, sort_keys=True, separators=(',', ':')))
+
+    def remove(self, account, host):
+        try:
+            os.unlink(self._path(account, host))
+        except OSError:
+            pass
+
+
+class AccountExporter(object):
+    def __init__(self, client, store, workers=8):
+        self.client = client
+        self.store = store
+        self.workers = workers
+
+    def _revalidate(self, fetch, previous):
+        # Fetch a document unless the server confirms the previously exported copy is unchanged,
+        # returning (document, etag, fetched)
+        fetched = fetch(previous[1] if previous is not None else None)
+        if fetched is None:
+            return previous[0], previous[1], False
+        return fetched[0], fetched[1], True
+
+    def _fetch_host(self, account, listed, previous):
+        return self._revalidate(lambda etag: self.client.get_host_if_changed(account, listed['hashCode'], etag),
+                                (previous['host'], previous.get('etag')) if previous is not None else None)
+
+    def _fetch_configuration(self, account, host, scope, previous):
+        return self._revalidate(
+            lambda etag: self.client.get_configuration_if_changed(account, host, scope['id'], etag),
+            (previous['configuration'], previous.get('etag')) if previous is not None else None)
+
+    def export(self, account):
+        # Mirror every host in the account into the store, re-downloading only the hosts and configurations that
+        # changed since the last export. A host that fails to export keeps its previous snapshot
+        listed = self.client.list_hosts(account)
+        previous = dict((host['hashCode'], self.store.load(account, host['hashCode'])) for host in listed)
+        result = {"account": account, "hosts": len(listed), "scopes": 0, "fetched": 0, "unchanged": 0,
+                  "removed": 0, "errors": []}
+        failed = set()
+
+        def record(hash_code, future):
+            if isinstance(future.exception(), (APIError, requests.RequestException)):
+                if hash_code not in failed:
+                    failed.add(hash_code)
+                    result['errors'].append({"host": hash_code, "error": str(future.exception())})
+                return None
+            document, etag, fetched = future.result()
+            result['fetched' if fetched else 'unchanged'] += 1
+            return document, etag
+
+        # Revalidate every host, then every scope of every host, so requests stay concurrent across hosts
+        snapshots = []
+        fetch_host = lambda host: self._fetch_host(account, host, previous[host['hashCode']])
+        for listed_host, future in parallel_map(fetch_host, listed, self.workers):
+            fetched = record(listed_host['hashCode'], future)
+            if fetched is not None:
+                snapshots.append({"host": fetched[0], "etag": fetched[1], "scopes": []})
+
+        previous_scopes = dict(((hash_code, str(item['scope']['id'])), item)
+                               for hash_code, snapshot in previous.items() if snapshot is not None
+                               for item in snapshot['scopes'])
+
+        def fetch_configuration(item):
+            snapshot, scope = item
+            hash_code = snapshot['host']['hashCode']
+            return self._fetch_configuration(account, hash_code, scope,
+                                             previous_scopes.get((hash_code, str(scope['id']))))
+        scopes = [(snapshot, scope) for snapshot in snapshots for scope in snapshot['host']['scopes']]
+        for (snapshot, scope), future in parallel_map(fetch_configuration, scopes, self.workers):
+            fetched = record(snapshot['host']['hashCode'], future)
+            if fetched is not None:
+                snapshot['scopes'].append({"scope": scope, "configuration": fetched[0], "etag": fetched[1]})
+
+        for snapshot in snapshots:
+            if snapshot['host']['hashCode'] not in failed:
+                result['scopes'] += len(snapshot['scopes'])
+                self.store.save(account, snapshot)
+
+        # Forget hosts that no longer exist
+        for hash_code in self.store.hosts(account):
+            if hash_code not in previous:
+                self.store.remove(account, hash_code)
+                result['removed'] += 1
+        return result
+
+
+class AccountImporter(object):
+    def __init__(self, client, store, workers=2, scope_workers=4):
+        self.client = client
+        self.store = store
+        self.workers = workers
+        self.scope_workers = scope_workers
+
+    def _restore_scope(self, account, host, item):
+        new_scope = self.client.create_scope(account, host, {
+            "platform": item['scope']['platform'],
+            "path": item['scope']['path']
+        })
+        self.client.update_configuration(account, host, new_scope['id'],
+                                         normalize_configuration(item['configuration']))
+        return new_scope
+
+    def _restore(self, account, hash_code, target_account):
+        snapshot = self.store.load(account, hash_code)
+        result = {"account": target_account, "host": hash_code, "hashCode": None, "scopes": 0, "failedScopes": [],
+                  "error": None}
+        if snapshot is None:
+            result['error'] = 'Could not read snapshot'
+            return result
+        result['name'] = snapshot['host']['name']
+        try:
+            new_host = self.client.create_host(target_account, {
+                "name": snapshot['host']['name'],
+                "services": snapshot['host'].get('services', [])
+            })
+        except (APIError, requests.RequestException) as e:
+            result['error'] = str(e)
+            return result
+        result['hashCode'] = new_host['hashCode']
+        restore = lambda item: self._restore_scope(target_account, new_host['hashCode'], item)
+        for item, future in parallel_map(restore, snapshot['scopes'], self.scope_workers):
+            error = future.exception()
+            if error is None:
+                result['scopes'] += 1
+            elif isinstance(error, (APIError, requests.RequestException)):
+                result['failedScopes'].append({
+                    "platform": item['scope']['platform'],
+                    "path": item['scope']['path'],
+                    "error": str(error)
+                })
+            else:
+                raise error
+        return result
+
+    def restore(self, account, target_account=None, hosts=None):
+        # Recreate exported hosts as new hosts in target_account, yielding a result for each in order as it is ready
+        restore = lambda hash_code: self._restore(account, hash_code, target_account or account)
+        for hash_code, future in parallel_map(restore, hosts or self.store.hosts(account), self.workers):
+            yield future.result()
@@ -0,0 +1,76 @@
+import threading
+
+# Upper bounds of the histogram buckets, in milliseconds
+BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000, 30000)
+
+
+class RequestEvent(object):
+    # One HTTP attempt made by APIClient, passed to every hook once it has completed or failed. endpoint is the
+    # template, e.g. "/api/v1/accounts/{account}/hosts/{host}", so that calls to different hosts are grouped together.
+    # queued is the time spent waiting on the rate limiter, elapsed the time until the response headers arrived and
+    # duration the whole attempt including reading the body, all in seconds. response is the requests.Response, if any.
+    # error is the exception raised instead of a response, api_error the APIError the client raised for the response,
+    # and retried whether the client tried the request again after this attempt
+    def __init__(self, method, endpoint, url, attempt=0, status=None, error=None, sent=0, received=0, queued=0.0,
+                 elapsed=None, duration=0.0, response=None, api_error=None, retried=False):
+        self.method = method
+        self.endpoint = endpoint
+        self.url = url
+        self.attempt = attempt
+        self.status = status
+        self.error = error
+        self.sent = sent
+        self.received = received
+        self.queued = queued
+        self.elapsed = elapsed
+        self.duration = duration
+        self.response = response
+        self.api_error = api_error
+        self.retried = retried
+
+    @property
+    def failed(self):
+        return self.error is not None or self.status >= 400
+
+
+def percentile(durations, percent):
+    # Nearest rank of an already sorted list
+    return durations[max(0, -(-len(durations) * percent // 100) - 1)]
+
+
+class LatencyHistogram(object):
+    # Hook that collects the duration of every request per method and endpoint, and of anything else recorded by
+    # name, and writes a histogram of each when reported
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.timings = {}
+
+    def record(self, name, duration, failed=False, sent=0, received=0):
+        with self.lock:
+            timings = self.timings.setdefault(name, {"durations": [], "errors": 0, "sent": 0, "received": 0})
+            timings['durations'].append(duration)
+            timings['errors'] += 1 if failed else 0
+            timings['sent'] += sent
+            timings['received'] += received
+
+    def __call__(self, event):
+        self.record('%s %s' % (event.method, event.endpoint), event.duration, event.failed, event.sent, event.received)
+
+    def report(self, stream, width=40):
+        with self.lock:
+            timings = sorted(self.timings.items())
+        for name, timing in timings:
+            durations = sorted(duration * 1000 for duration in timing['durations'])
+            stream.write('%s: %d calls, %d failed, %d bytes sent, %d received\n' % (
+                name, len(durations), timing['errors'], timing['sent'], timing['received']))
+            stream.write('  p50 %.1f ms, p99 %.1f ms, max %.1f ms\n' % (
+                percentile(durations, 50), percentile(durations, 99), durations[-1]))
+            counts = [0] * (len(BUCKETS) + 1)
+            for duration in durations:
+                counts[next((index for index, bound in enumerate(BUCKETS) if duration < bound), len(BUCKETS))] += 1
+            # Only print buckets from the fastest to the slowest request
+            used = [index for index, count in enumerate(counts) if count]
+            for index in range(used[0], used[-1] + 1):
+                label = '< %d ms' % BUCKETS[index] if index < len(BUCKETS) else '>= %d ms' % BUCKETS[-1]
+                bar = '#' * int(round(width * counts[index] / float(len(durations))))
+                stream.write('  %10s |%-*s %d\n' % (label, width, bar, counts[index]))
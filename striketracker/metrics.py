@@ -0,0 +1,257 @@
+import bisect
+import collections
+import json
+import re
+import socket
+import threading
+import time
+
+# Upper bounds of the latency histogram buckets, in seconds
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+# Upper bounds of the purge job duration buckets, in seconds
+JOB_BUCKETS = (1.0, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0, 600.0, 1800.0, 3600.0)
+
+PURGE_ENDPOINT = '/api/v1/accounts/{account_hash}/purge'
+PURGE_STATUS_ENDPOINT = '/api/v1/accounts/{account_hash}/purge/{job_id}'
+
+DESCRIPTIONS = {
+    'requests': ('counter', 'HTTP requests made, by method, endpoint and status'),
+    'request_errors': ('counter', 'HTTP requests that failed, by method, endpoint and APIError'),
+    'request_duration': ('histogram', 'Duration of HTTP requests in seconds, by method and endpoint'),
+    'purge_urls': ('counter', 'Urls accepted in purge batches'),
+    'purge_job_duration': ('histogram', 'Seconds from submitting a purge batch until its job was seen complete'),
+}
+
+
+def _error_type(event):
+    # Failures are grouped by the APIError the client raised for them, e.g. "Could not fetch host". Attempts that were
+    # tried again, or that no APIError was raised for, are grouped by what happened instead
+    if event.api_error is not None:
+        return '%s' % event.api_error
+    if event.retried:
+        return 'retried'
+    return 'no response' if event.error is not None else 'unexpected response'
+
+
+class Metrics(object):
+    # Hook for APIClient that turns each RequestEvent into request counts, errors and latencies, plus the number of
+    # urls purged and the time purge jobs take to complete. Subclasses decide how the metrics are recorded, and this
+    # class records nothing
+    def __init__(self, max_jobs=10000):
+        self.max_jobs = max_jobs
+        self._jobs = collections.OrderedDict()
+        self._jobs_lock = threading.Lock()
+
+    def increment(self, name, labels=(), value=1):
+        pass
+
+    def observe(self, name, labels, seconds, buckets=BUCKETS):
+        pass
+
+    def __call__(self, event):
+        labels = (('method', event.method), ('endpoint', event.endpoint))
+        status = str(event.status) if event.status is not None else ''
+        self.increment('requests', labels + (('status', status),))
+        if event.failed:
+            self.increment('request_errors', labels + (('error', _error_type(event)),))
+        self.observe('request_duration', labels, event.duration)
+        if event.status == 200 and event.endpoint == PURGE_ENDPOINT:
+            self._submitted(event)
+        elif event.status == 200 and event.endpoint == PURGE_STATUS_ENDPOINT:
+            self._polled(event)
+
+    def _submitted(self, event):
+        # Only purges read the request body back, since counting urls means parsing it
+        try:
+            urls = len(json.loads(event.response.request.body)['list'])
+            job_id = event.response.json()['id']
+        except (AttributeError, KeyError, TypeError, ValueError):
+            return
+        self.increment('purge_urls', value=urls)
+        with self._jobs_lock:
+            # Forget the oldest jobs if their status is never polled to completion
+            self._jobs[job_id] = time.time() - event.duration
+            while len(self._jobs) > self.max_jobs:
+                self._jobs.popitem(last=False)
+
+    def _polled(self, event):
+        try:
+            complete = event.response.json()['progress'] >= 1.0
+        except (AttributeError, KeyError, TypeError, ValueError):
+            return
+        if complete:
+            with self._jobs_lock:
+                submitted = self._jobs.pop(event.url.rstrip('/').rsplit('/', 1)[-1], None)
+            if submitted is not None:
+                self.observe('purge_job_duration', (), time.time() - submitted, JOB_BUCKETS)
+
+
+def _escape(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{%s}' % ','.join('%s="%s"' % (name, _escape(value)) for name, value in labels)
+
+
+def _format_number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class PrometheusMetrics(Metrics):
+    # Keeps running totals in memory and renders them in the Prometheus text exposition format
+    def __init__(self, namespace='striketracker', max_jobs=10000):
+        super(PrometheusMetrics, self).__init__(max_jobs)
+        self.namespace = namespace
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.histograms = {}
+
+    def increment(self, name, labels=(), value=1):
+        with self.lock:
+            self.counters[(name, labels)] = self.counters.get((name, labels), 0) + value
+
+    def observe(self, name, labels, seconds, buckets=BUCKETS):
+        index = bisect.bisect_left(buckets, seconds)
+        with self.lock:
+            histogram = self.histograms.get((name, labels))
+            if histogram is None:
+                histogram = self.histograms[(name, labels)] = [buckets, [0] * (len(buckets) + 1), 0.0]
+            histogram[1][index] += 1
+            histogram[2] += seconds
+
+    def render(self):
+        with self.lock:
+            counters = sorted(self.counters.items())
+            histograms = sorted((key, (buckets, list(counts), total))
+                                for key, (buckets, counts, total) in self.histograms.items())
+        lines = []
+        described = set()
+
+        def describe(name, suffix):
+            if name not in described:
+                described.add(name)
+                kind, description = DESCRIPTIONS.get(name, ('untyped', name))
+                lines.append('# HELP %s_%s%s %s' % (self.namespace, name, suffix, description))
+                lines.append('# TYPE %s_%s%s %s' % (self.namespace, name, suffix, kind))
+
+        for (name, labels), value in counters:
+            describe(name, '_total')
+            lines.append('%s_%s_total%s %s' % (self.namespace, name, _format_labels(labels), _format_number(value)))
+        for (name, labels), (buckets, counts, total) in histograms:
+            suffix = '_seconds'
+            describe(name, suffix)
+            metric = '%s_%s%s' % (self.namespace, name, suffix)
+            cumulative = 0
+            for bound, count in zip(list(buckets) + ['+Inf'], counts):
+                cumulative += count
+                le = bound if bound == '+Inf' else _format_number(bound)
+                lines.append('%s_bucket%s %d' % (metric, _format_labels(labels + (('le', le),)), cumulative))
+            lines.append('%s_sum%s %s' % (metric, _format_labels(labels), _format_number(total)))
+            lines.append('%s_count%s %d' % (metric, _format_labels(labels), cumulative))
+        return ''.join(line + '\n' for line in lines)
+
+    def serve(self, port, address=''):
+        # Serve the metrics at /metrics from a background thread, returning the server so that it can be shut down
+        try:
+            from http.server import BaseHTTPRequestHandler, HTTPServer
+        except ImportError:
+            from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+        metrics = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, format, *args):
+                pass
+
+            def do_GET(self):
+                if self.path.split('?')[0] != '/metrics':
+                    self.send_error(404)
+                    return
+                payload = metrics.render().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4')
+                self.send_header('Content-Length', str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+        server = HTTPServer((address, port), Handler)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        return server
+
+
+def _statsd_segment(value):
+    return re.sub(r'[^A-Za-z0-9_-]+', '_', value).strip('_') or '_'
+
+
+class StatsdMetrics(Metrics):
+    # Buffers StatsD lines and pushes them over UDP from a background thread every interval seconds, so recording a
+    # metric only appends to a list. Labels become segments of the metric name, e.g.
+    # striketracker.requests.GET.api_v1_accounts_account_hash_purge.200:1|c
+    def __init__(self, host='127.0.0.1', port=8125, prefix='striketracker', interval=1.0, max_packet=1432,
+                 max_jobs=10000):
+        super(StatsdMetrics, self).__init__(max_jobs)
+        self.address = (host, port)
+        self.prefix = prefix
+        self.interval = interval
+        self.max_packet = max_packet
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.lines = []
+        self._names = {}
+        self.lock = threading.Lock()
+        self.closed = threading.Event()
+        self.thread = threading.Thread(target=self._run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def _name(self, name, labels):
+        # There are only as many names as endpoints and statuses, so build each once
+        key = (name, labels)
+        if key not in self._names:
+            self._names[key] = '.'.join([self.prefix, name] + [_statsd_segment(value) for _, value in labels])
+        return self._names[key]
+
+    def increment(self, name, labels=(), value=1):
+        line = '%s:%d|c' % (self._name(name, labels), value)
+        with self.lock:
+            self.lines.append(line)
+
+    def observe(self, name, labels, seconds, buckets=BUCKETS):
+        line = '%s:%.3f|ms' % (self._name(name, labels), seconds * 1000)
+        with self.lock:
+            self.lines.append(line)
+
+    def flush(self):
+        with self.lock:
+            lines, self.lines = self.lines, []
+        # Pack as many lines into each datagram as fit
+        packet = []
+        size = 0
+        for line in lines:
+            if packet and size + len(line) + 1 > self.max_packet:
+                self._send(packet)
+                packet, size = [], 0
+            packet.append(line)
+            size += len(line) + 1
+        if packet:
+            self._send(packet)
+
+    def _send(self, packet):
+        try:
+            self.socket.sendto('\n'.join(packet).encode('utf-8'), self.address)
+        except socket.error:
+            # Metrics are best effort, so a missing or unreachable collector never fails the caller
+            pass
+
+    def _run(self):
+        while not self.closed.wait(self.interval):
+            self.flush()
+
+    def close(self):
+        self.closed.set()
+        self.thread.join()
+        self.flush()
+        self.socket.close()
@@ -0,0 +1,540 @@
+import collections
+import hashlib
+import json
+import os
+import threading
+import time
+
+import requests
+
+from striketracker import APIError
+from striketracker.concurrency import Future, WorkerPool, parallel_map
+
+
+DEFAULT_PORTS = {'http:': ':80', 'https:': ':443'}
+
+
+def normalize_url(url):
+    # Scheme and hostname are case insensitive, the path is not. Fragments never reach the CDN, and default ports
+    # name the same asset as no port at all
+    url = url.strip().partition('#')[0]
+    scheme, sep, rest = url.partition('//')
+    if not sep or (scheme and not scheme.endswith(':')):
+        return url
+    host, slash, path = rest.partition('/')
+    scheme, host = scheme.lower(), host.lower()
+    if scheme in DEFAULT_PORTS and host.endswith(DEFAULT_PORTS[scheme]):
+        host = host[:-len(DEFAULT_PORTS[scheme])]
+    return scheme + sep + host + slash + path
+
+
+def read_urls(stream, purge_all_dynamic=False, recursive=False, invalidate_only=False, dedupe_window=100000):
+    # Lazily turn each line of stream into a purge entry, skipping blank lines and urls already seen among the
+    # last dedupe_window urls so that memory stays bounded however long the input is
+    seen = collections.OrderedDict()
+    for line in iter(stream.readline, ''):
+        url = normalize_url(line)
+        if not url:
+            continue
+        if url in seen:
+            continue
+        seen[url] = True
+        if len(seen) > dedupe_window:
+            seen.popitem(last=False)
+        yield {
+            "url": url,
+            "purgeAllDynamic": purge_all_dynamic,
+            "recursive": recursive,
+            "invalidateOnly": invalidate_only
+        }
+
+
+def batches(iterable, size):
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+class _Node(object):
+    __slots__ = ('children', 'entry', 'recursive', 'collapsed')
+
+    def __init__(self):
+        # Most nodes are leaves, so only those with children get a dict for them
+        self.children = None
+        self.entry = False
+        # None, or the url suffix ('' or '/') of a recursive purge covering everything below this node
+        self.recursive = None
+        self.collapsed = False
+
+
+class PurgeOptimizer(object):
+    # Trie of purge urls, one per origin and set of purge options, with a node per path segment. Adding urls drops
+    # duplicates and urls already covered by a recursive purge; optimize() then yields the remaining purges, replacing
+    # any directory that directly holds at least threshold purges by a single recursive purge of the directory
+    def __init__(self, threshold=None, min_depth=1):
+        self.threshold = threshold
+        self.min_depth = min_depth
+        self.roots = {}
+        self.urls = 0
+        self.duplicates = 0
+        self.covered = 0
+        self.collapsed = 0
+        self.purges = 0
+
+    def add(self, entry):
+        self.urls += 1
+        scheme, sep, rest = entry['url'].partition('//')
+        origin, slash, path = rest.partition('/')
+        options = (entry['purgeAllDynamic'], entry['invalidateOnly'])
+        node = self.roots.setdefault((scheme + sep + origin, options), _Node())
+        segments = path.split('/') if slash else []
+        suffix = None
+        if entry['recursive']:
+            # "http://host/a/" and "http://host/a" both cover everything below node "a"
+            suffix = ''
+            if segments and segments[-1] == '':
+                segments.pop()
+                suffix = '/'
+        for segment in segments:
+            if node.recursive is not None:
+                self.covered += 1
+                return
+            if node.children is None:
+                node.children = {}
+            node = node.children.setdefault(segment, _Node())
+        if suffix is None:
+            if node.entry or node.recursive == '':
+                self.duplicates += 1
+            else:
+                node.entry = True
+        elif node.recursive is not None:
+            self.duplicates += 1
+        else:
+            # Everything already added below this node is covered by the new recursive purge
+            self.covered += self._count(node)
+            node.children = None
+            node.recursive = suffix
+            if suffix == '' and node.entry:
+                node.entry = False
+                self.duplicates += 1
+
+    def _count(self, node):
+        return sum(int(child.entry) + (1 if child.recursive is not None else 0) + self._count(child)
+                   for child in (node.children or {}).values())
+
+    def _collapse(self, node, depth):
+        # Collapse the directories below node from the bottom up, and node itself once its direct children hold at
+        # least threshold purges, a subdirectory that was collapsed or purged recursively counting as one. Return how
+        # many urls below node are not yet counted in self.collapsed, so that each url is counted once however deep
+        if node.recursive is not None:
+            return 1
+        pending = 0
+        purges = 0
+        for child in (node.children or {}).values():
+            pending += int(child.entry) + self._collapse(child, depth + 1)
+            purges += int(child.entry) + int(child.collapsed or child.recursive is not None)
+        if self.threshold and depth >= self.min_depth and purges >= self.threshold:
+            node.collapsed = True
+            self.collapsed += pending
+            return 0
+        return pending
+
+    def _emit(self, node, url, options):
+        if node.recursive is not None:
+            yield self._entry(url + node.recursive, True, options)
+            return
+        if node.collapsed:
+            yield self._entry(url + '/', True, options)
+            return
+        for segment in sorted(node.children or ()):
+            child = node.children[segment]
+            if child.entry:
+                yield self._entry(url + '/' + segment, False, options)
+            for entry in self._emit(child, url + '/' + segment, options):
+                yield entry
+
+    def _entry(self, url, recursive, options):
+        self.purges += 1
+        return {
+            "url": url,
+            "purgeAllDynamic": options[0],
+            "recursive": recursive,
+            "invalidateOnly": options[1]
+        }
+
+    def optimize(self, entries=()):
+        for entry in entries:
+            self.add(entry)
+        for origin, options in sorted(self.roots):
+            root = self.roots[(origin, options)]
+            self._collapse(root, 0)
+            if root.entry:
+                yield self._entry(origin, False, options)
+            for entry in self._emit(root, origin, options):
+                yield entry
+
+    def summary(self):
+        return ('Read {urls} urls: dropped {duplicates} duplicates and {covered} covered by recursive purges, '
+                'collapsed {collapsed} into recursive purges, leaving {purges} purges').format(
+            urls=self.urls, duplicates=self.duplicates, covered=self.covered, collapsed=self.collapsed,
+            purges=self.purges)
+
+
+def batch_digest(batch):
+    return hashlib.sha1(json.dumps(batch, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+class PurgeJournal(object):
+    # Append-only log of a purge with one JSON line for its settings, each batch the CDN accepted and each status
+    # poll, so that a purge that was interrupted can resume where it stopped. Every line is fsynced as it is written
+    def __init__(self, filename, resume=False):
+        self.filename = filename
+        self.settings = None
+        self.batches = {}
+        self.progress = collections.OrderedDict()
+        self.lock = threading.Lock()
+        if resume:
+            end = self._read()
+            if end is not None:
+                # Drop a line the process died while writing, or the next record would be appended to it
+                with open(filename, 'rb+') as f:
+                    f.truncate(end)
+            self.file = open(filename, 'a')
+        else:
+            self.file = open(filename, 'w')
+
+    def _read(self):
+        # Returns the offset just past the last complete line
+        try:
+            f = open(self.filename, 'rb')
+        except IOError:
+            return None
+        end = 0
+        with f:
+            for line in f:
+                if not line.endswith(b'\n'):
+                    break
+                end += len(line)
+                try:
+                    record = json.loads(line.decode('utf-8'))
+                except ValueError:
+                    continue
+                if 'settings' in record:
+                    self.settings = record['settings']
+                elif 'batch' in record:
+                    self.batches[record['batch']] = (record['digest'], record['job'])
+                    self.progress.setdefault(record['job'], 0.0)
+                elif 'job' in record:
+                    self.progress[record['job']] = record['progress']
+        return end
+
+    def _write(self, record):
+        with self.lock:
+            self.file.write(json.dumps(record, sort_keys=True) + '\n')
+            self.file.flush()
+            os.fsync(self.file.fileno())
+
+    def start(self, settings):
+        # A journal can only be resumed by a purge with the same settings, since they decide what is in each batch
+        if self.settings is not None and self.settings != settings:
+            raise ValueError('Journal was written by a purge with different settings: %s' % json.dumps(
+                self.settings, sort_keys=True))
+        if self.settings is None:
+            self.settings = settings
+            self._write({"settings": settings})
+
+    def job(self, index, batch):
+        # Id of the job for this batch if it was already accepted, or None
+        digest, job_id = self.batches.get(index, (None, None))
+        return job_id if digest == batch_digest(batch) else None
+
+    def submitted(self, index, batch, job_id):
+        self.batches[index] = (batch_digest(batch), job_id)
+        self.progress.setdefault(job_id, 0.0)
+        self._write({"batch": index, "digest": batch_digest(batch), "job": job_id})
+
+    def polled(self, job_id, progress):
+        self.progress[job_id] = progress
+        self._write({"job": job_id, "progress": progress})
+
+    def pending(self, job_ids):
+        return [job_id for job_id in job_ids if self.progress.get(job_id, 0.0) < 1.0]
+
+    def close(self):
+        self.file.close()
+
+
+class PurgeResult(object):
+    def __init__(self):
+        self.job_ids = []
+        self.batches = 0
+        self.submitted = 0
+        self.resumed = 0
+        self.failed = 0
+        self.errors = []
+
+    def summary(self):
+        summary = 'Submitted {submitted} of {total} urls in {jobs} of {batches} batches'.format(
+            submitted=self.submitted, total=self.submitted + self.failed,
+            jobs=len(self.job_ids), batches=self.batches)
+        if self.resumed:
+            summary += ', {resumed} of them by an earlier run'.format(resumed=self.resumed)
+        return summary
+
+
+class BatchPurger(object):
+    # Failed batches are only retried by the client's RetryPolicy, which knows when a purge is safe to send again
+    def __init__(self, client, account, batch_size=1000, workers=4):
+        self.client = client
+        self.account = account
+        self.batch_size = batch_size
+        self.workers = workers
+
+    def _send(self, batch):
+        return self.client.purge(self.account, batch)
+
+    def _send_journaled(self, journal, numbered):
+        # Skip batches the journal shows were already accepted, and journal the rest once they are
+        index, batch = numbered
+        job_id = journal.job(index, batch)
+        if job_id is not None:
+            return job_id, True
+        job_id = self._send(batch)
+        journal.submitted(index, batch, job_id)
+        return job_id, False
+
+    def submit(self, urls, journal=None):
+        # Split urls into batches and send them concurrently, collecting job ids in batch order
+        result = PurgeResult()
+        if journal is None:
+            send, items = lambda batch: (self._send(batch), False), batches(urls, self.batch_size)
+        else:
+            send = lambda numbered: self._send_journaled(journal, numbered)
+            items = enumerate(batches(urls, self.batch_size))
+        for item, future in parallel_map(send, items, self.workers):
+            batch = item if journal is None else item[1]
+            result.batches += 1
+            error = future.exception()
+            if error is None:
+                job_id, resumed = future.result()
+                result.job_ids.append(job_id)
+                result.submitted += len(batch)
+                result.resumed += len(batch) if resumed else 0
+            elif isinstance(error, (APIError, requests.RequestException)):
+                result.failed += len(batch)
+                result.errors.append(error)
+            else:
+                raise error
+        return result
+
+
+class PurgePoller(object):
+    # Like BatchPurger, leaves retrying a failed status request to the client's RetryPolicy
+    def __init__(self, client, account, interval=0.1, max_interval=10.0, backoff=2.0, workers=4):
+        self.client = client
+        self.account = account
+        self.interval = interval
+        self.max_interval = max_interval
+        self.backoff = backoff
+        self.workers = workers
+
+    def _next_interval(self, job, progress, now):
+        if progress > job['progress'] and job['polled'] is not None:
+            # Poll again around halfway to the estimated completion time
+            rate = (progress - job['progress']) / max(now - job['polled'], 1e-6)
+            interval = (1.0 - progress) / rate / 2
+        else:
+            # No progress since last time, so back off
+            interval = job['interval'] * self.backoff if job['polled'] is not None else self.interval
+        return min(self.max_interval, max(self.interval, interval))
+
+    def poll(self, job_ids, callback=None, timeout=None):
+        # Poll every job until all are complete, calling callback(job_id, progress, overall) after each status
+        now = time.time()
+        deadline = now + timeout if timeout is not None else None
+        jobs = collections.OrderedDict((job_id, {
+            'progress': 0.0, 'polled': None, 'due': now, 'interval': self.interval
+        }) for job_id in job_ids)
+        pending = set(jobs.keys())
+        pool = WorkerPool(max(1, min(self.workers, len(pending))))
+        try:
+            self._poll(pool, jobs, pending, callback, deadline)
+        except BaseException:
+            pool.shutdown(wait=False)
+            raise
+        # Every status requested has been read by now, so the workers are idle and can be joined
+        pool.shutdown(wait=True)
+        return dict((job_id, job['progress']) for job_id, job in jobs.items())
+
+    def _poll(self, pool, jobs, pending, callback, deadline):
+        total = 0.0
+        while pending:
+            now = time.time()
+            statuses = [(job_id, pool.submit(self.client.purge_status, self.account, job_id))
+                        for job_id in jobs if job_id in pending and jobs[job_id]['due'] <= now]
+            for job_id, future in statuses:
+                job = jobs[job_id]
+                now = time.time()
+                progress = future.result()
+                job['interval'] = self._next_interval(job, progress, now)
+                total += progress - job['progress']
+                job['progress'] = progress
+                job['polled'] = now
+                job['due'] = now + job['interval']
+                if progress >= 1.0:
+                    pending.discard(job_id)
+                if callback is not None:
+                    callback(job_id, progress, total / len(jobs))
+            if not pending or (deadline is not None and time.time() >= deadline):
+                break
+            wait = min(jobs[job_id]['due'] for job_id in pending) - time.time()
+            if deadline is not None:
+                wait = min(wait, deadline - time.time())
+            if wait > 0:
+                time.sleep(wait)
+
+
+class PurgeQueue(object):
+    # Coalesces purges of single urls from many threads into batched purge requests, one per account and set of
+    # options. A batch is sent once it holds max_batch urls or its oldest url has waited max_delay seconds
+    def __init__(self, client, max_batch=1000, max_delay=0.5, workers=4, poll_interval=0.5, max_poll_interval=10.0,
+                 backoff=2.0, retries=3):
+        self.client = client
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.poll_interval = poll_interval
+        self.max_poll_interval = max_poll_interval
+        self.backoff = backoff
+        self.retries = retries
+        self.condition = threading.Condition()
+        self.batches = collections.OrderedDict()
+        self.jobs = {}
+        self.sending = 0
+        self.closed = False
+        self.pool = WorkerPool(workers)
+        self.thread = threading.Thread(target=self._run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def purge(self, account, url, purge_all_dynamic=False, recursive=False, invalidate_only=False, complete=False):
+        # Return a Future for the id of the purge job that includes url, resolved once the job is accepted or, with
+        # complete, once the job has finished
+        future = Future()
+        url = normalize_url(url)
+        key = (account, purge_all_dynamic, recursive, invalidate_only)
+        started = []
+        with self.condition:
+            if self.closed:
+                raise RuntimeError('Purge queue is closed')
+            batch = self.batches.get(key)
+            if batch is None:
+                batch = self.batches[key] = {
+                    'urls': collections.OrderedDict(), 'futures': [], 'deadline': time.time() + self.max_delay
+                }
+            # The same url is only sent once per batch however many callers purge it
+            batch['urls'][url] = {
+                "url": url,
+                "purgeAllDynamic": purge_all_dynamic,
+                "recursive": recursive,
+                "invalidateOnly": invalidate_only
+            }
+            batch['futures'].append((future, complete))
+            if len(batch['urls']) >= self.max_batch:
+                started.append(self._send(key))
+            else:
+                self.condition.notify()
+        self._attach(started)
+        return future
+
+    def _attach(self, started):
+        # Called once the lock is released: a request that has already finished runs its callback at once, and the
+        # callbacks resolve futures whose own callbacks belong to the caller and may purge again
+        for request, callback in started:
+            request.add_done_callback(callback)
+
+    def _send(self, key):
+        # Start sending a batch, returning the request and its callback for _attach
+        batch = self.batches.pop(key)
+        self.sending += 1
+        sent = self.pool.submit(self.client.purge, key[0], list(batch['urls'].values()))
+        return sent, lambda sent: self._sent(key[0], batch['futures'], sent)
+
+    def _sent(self, account, futures, sent):
+        # Resolve futures before updating the counts that close() waits on
+        error = sent.exception()
+        for future, complete in futures:
+            if error is not None:
+                future.set_exception(error)
+            elif not complete:
+                future.set_result(sent.result())
+        with self.condition:
+            self.sending -= 1
+            waiting = [future for future, complete in futures if complete and error is None]
+            if waiting:
+                self.jobs[sent.result()] = {
+                    'account': account, 'futures': waiting, 'due': time.time() + self.poll_interval,
+                    'interval': self.poll_interval, 'polling': False, 'failures': 0
+                }
+            self.condition.notify()
+
+    def _poll(self, job_id):
+        job = self.jobs[job_id]
+        job['polling'] = True
+        status = self.pool.submit(self.client.purge_status, job['account'], job_id)
+        return status, lambda status: self._polled(job_id, status)
+
+    def _polled(self, job_id, status):
+        job = self.jobs[job_id]
+        error = status.exception()
+        if (error is None and status.result() >= 1.0) or (error is not None and job['failures'] >= self.retries):
+            for future in job['futures']:
+                if error is not None:
+                    future.set_exception(error)
+                else:
+                    future.set_result(job_id)
+            with self.condition:
+                del self.jobs[job_id]
+                self.condition.notify()
+            return
+        with self.condition:
+            job['polling'] = False
+            job['failures'] = job['failures'] + 1 if error is not None else 0
+            job['interval'] = min(self.max_poll_interval, job['interval'] * self.backoff)
+            job['due'] = time.time() + job['interval']
+            self.condition.notify()
+
+    def _run(self):
+        while True:
+            with self.condition:
+                now = time.time()
+                started = [self._send(key) for key, batch in list(self.batches.items())
+                           if self.closed or batch['deadline'] <= now]
+                started += [self._poll(job_id) for job_id, job in list(self.jobs.items())
+                            if not job['polling'] and job['due'] <= now]
+                if self.closed and not self.batches and not self.sending and not self.jobs:
+                    self.pool.shutdown(wait=False)
+                    return
+                if not started:
+                    due = [batch['deadline'] for batch in self.batches.values()] + \
+                        [job['due'] for job in self.jobs.values() if not job['polling']]
+                    self.condition.wait(max(0, min(due) - now) if due else None)
+            self._attach(started)
+
+    def flush(self):
+        # Send every waiting url now rather than when its batch fills or times out
+        with self.condition:
+            started = [self._send(key) for key in list(self.batches)]
+        self._attach(started)
+
+    def close(self, wait=True):
+        # Send everything still queued and, with wait, block until every future is resolved
+        with self.condition:
+            self.closed = True
+            self.condition.notify()
+        if wait:
+            self.thread.join()
@@ -0,0 +1,226 @@
+import bisect
+import json
+import numbers
+import os
+
+from striketracker import atomic_write
+
+try:
+    _text = basestring
+except NameError:
+    _text = str
+
+OPERATORS = ('<=', '>=', '!=', '=', '<', '>', '~')
+
+
+def _flatten(value, path):
+    # Yield (field, value) for every scalar below a configuration type, e.g. ("cacheControl.maxAge", 600). Instances
+    # in lists share a field so that any of them can match, and ids are left out since they mean nothing across scopes
+    if isinstance(value, dict):
+        for key, child in value.items():
+            if key != 'id':
+                for item in _flatten(child, '%s.%s' % (path, key)):
+                    yield item
+    elif isinstance(value, list):
+        for child in value:
+            for item in _flatten(child, path):
+                yield item
+    else:
+        yield path, value
+
+
+def configuration_fields(configuration):
+    fields = []
+    for type_name, conf_type in configuration.items():
+        if type_name != 'scope':
+            fields.extend([field, value] for field, value in _flatten(conf_type, type_name))
+    return fields
+
+
+def parse_expression(expression):
+    # Split "cacheControl.maxAge<60" into ("cacheControl.maxAge", "<", 60). A bare field name matches scopes that set
+    # it at all, and values are read as JSON where possible so that numbers compare as numbers. The first operator
+    # wins, and the longest of those starting there, so that "<=" is not read as "<"
+    positions = [(expression.find(operator), -len(operator), operator) for operator in OPERATORS
+                 if expression.find(operator) > 0]
+    if not positions:
+        if not expression or any(character in expression for character in '<>=!~'):
+            raise ValueError('Invalid expression: %s' % expression)
+        return expression, None, None
+    position, _, operator = min(positions)
+    field, text = expression[:position], expression[position + len(operator):]
+    try:
+        value = json.loads(text)
+    except ValueError:
+        value = text
+    if isinstance(value, (dict, list)):
+        raise ValueError('Invalid expression: %s' % expression)
+    return field, operator, value
+
+
+def _number(value):
+    return isinstance(value, numbers.Number) and not isinstance(value, bool)
+
+
+def _key(value):
+    # True == 1 and False == 0 in Python, so booleans are indexed under a key of their own to keep them apart
+    return (bool, value) if isinstance(value, bool) else value
+
+
+def _value(key):
+    return key[1] if isinstance(key, tuple) else key
+
+
+class ConfigurationIndex(object):
+    # Inverted index from configuration field to value to the scopes that set it, over every snapshot in a
+    # SnapshotStore. It is saved alongside the snapshots as a line listing the hosts and their scopes followed by one
+    # line of postings per field, so that a query only parses the fields it asks about. Refreshing it re-reads only
+    # the snapshots that changed, and scopes are numbered in the order their hosts are listed
+    VERSION = 2
+
+    def __init__(self, store):
+        self.store = store
+        self.filename = os.path.join(store.directory, '.index.json')
+        self.hosts = []
+        self.scopes = []
+        self.fields = {}
+        self._unparsed = {}
+        self._numbers = {}
+
+    def _load(self):
+        # The saved hosts, and the postings of each field still as text
+        try:
+            with open(self.filename) as f:
+                header = json.loads(f.readline())
+                if not isinstance(header, dict) or header.get('version') != self.VERSION:
+                    return [], {}
+                unparsed = {}
+                for line in f:
+                    field, postings = line.split('\t', 1)
+                    unparsed[json.loads(field)] = postings
+                return header['hosts'], unparsed
+        except (IOError, OSError, ValueError, KeyError):
+            return [], {}
+
+    def _save(self):
+        lines = [json.dumps({"version": self.VERSION, "hosts": self.hosts}, separators=(',', ':'))]
+        for field in sorted(self.fields):
+            postings = [[_value(key), sorted(scopes)] for key, scopes in self.fields[field].items()]
+            lines.append('%s\t%s' % (json.dumps(field), json.dumps(postings, separators=(',', ':'))))
+        atomic_write(self.filename, '\n'.join(lines) + '\n', prefix='.index')
+
+    def _postings(self, field):
+        # Parse a field's saved postings the first time a query needs them
+        if field in self._unparsed:
+            self.fields[field] = dict((_key(value), set(scopes))
+                                      for value, scopes in json.loads(self._unparsed.pop(field)))
+        return self.fields.get(field, {})
+
+    def refresh(self):
+        saved, self._unparsed = self._load()
+        self.fields = {}
+        self._numbers = {}
+        previous = dict((entry[0], entry) for entry in saved)
+        hosts = []
+        changed = {}
+        for account in self.store.accounts():
+            for host in self.store.hosts(account):
+                key = '%s/%s' % (account, host)
+                stamp = self.store.stamp(account, host)
+                entry = previous.get(key)
+                if entry is None or entry[1] != stamp:
+                    snapshot = self.store.load(account, host)
+                    if snapshot is None:
+                        continue
+                    entry = [key, stamp, snapshot['host'].get('name'),
+                             [[item['scope']['platform'], item['scope']['path']] for item in snapshot['scopes']]]
+                    changed[key] = [configuration_fields(item['configuration']) for item in snapshot['scopes']]
+                hosts.append(entry)
+        self.hosts = hosts
+        if changed or [entry[0] for entry in hosts] != [entry[0] for entry in saved]:
+            self._update(saved, changed)
+            self._save()
+        self.scopes = []
+        for key, _, name, scopes in self.hosts:
+            account, host = key.split('/', 1)
+            for platform, path in scopes:
+                self.scopes.append({"account": account, "host": host, "name": name, "platform": platform, "path": path})
+        return self
+
+    def _update(self, saved, changed):
+        # Move the saved postings of unchanged hosts to their scopes' new numbers, then index the changed hosts
+        starts = {}
+        start = 0
+        for key, _, _, scopes in self.hosts:
+            starts[key] = start
+            start += len(scopes)
+        renumber = {}
+        start = 0
+        for key, _, _, scopes in saved:
+            if key in starts and key not in changed:
+                for offset in range(len(scopes)):
+                    renumber[start + offset] = starts[key] + offset
+            start += len(scopes)
+        fields = {}
+        for field in list(self._unparsed):
+            for value, scopes in self._postings(field).items():
+                scopes = set(renumber[scope] for scope in scopes if scope in renumber)
+                if scopes:
+                    fields.setdefault(field, {})[value] = scopes
+        for key, scope_fields in changed.items():
+            for offset, pairs in enumerate(scope_fields):
+                for field, value in pairs:
+                    fields.setdefault(field, {}).setdefault(_key(value), set()).add(starts[key] + offset)
+        self.fields = fields
+
+    def _union(self, postings, values):
+        matched = set()
+        for value in values:
+            matched.update(postings[value])
+        return matched
+
+    def _range(self, field, operator, value):
+        # Numeric values of each field are sorted once, on first use, so that ranges are found by bisection
+        if field not in self._numbers:
+            self._numbers[field] = sorted(key for key in self._postings(field) if _number(key))
+        numbers = self._numbers[field]
+        if operator == '<':
+            return numbers[:bisect.bisect_left(numbers, value)]
+        if operator == '<=':
+            return numbers[:bisect.bisect_right(numbers, value)]
+        if operator == '>':
+            return numbers[bisect.bisect_right(numbers, value):]
+        return numbers[bisect.bisect_left(numbers, value):]
+
+    def match(self, field, operator=None, value=None):
+        if operator is None:
+            # Any value of the field, or of any field below it
+            prefix = field + '.'
+            matched = set()
+            for name in set(self.fields) | set(self._unparsed):
+                if name == field or name.startswith(prefix):
+                    name_postings = self._postings(name)
+                    matched.update(self._union(name_postings, name_postings))
+            return matched
+        postings = self._postings(field)
+        if operator == '=':
+            return set(postings.get(_key(value), ()))
+        if operator == '!=':
+            return self._union(postings, [key for key in postings if key != _key(value)])
+        if operator == '~':
+            text = '%s' % value
+            return self._union(postings, [key for key in postings if isinstance(key, _text) and text in key])
+        if not _number(value):
+            raise ValueError('%s %s requires a number' % (field, operator))
+        return self._union(postings, self._range(field, operator, value))
+
+    def query(self, expressions):
+        # Scopes that meet every expression, in account, host and scope order
+        matched = None
+        for expression in expressions:
+            field, operator, value = parse_expression(expression)
+            scopes = self.match(field, operator, value)
+            matched = scopes if matched is None else matched & scopes
+        if matched is None:
+            return list(self.scopes)
+        return [self.scopes[scope] for scope in sorted(matched)]
@@ -0,0 +1,32 @@
+import threading
+import time
+
+
+class TokenBucket(object):
+    def __init__(self, rate, capacity=None):
+        self.rate = float(rate)
+        self.capacity = float(capacity if capacity is not None else max(1.0, self.rate))
+        self.tokens = self.capacity
+        self.updated = time.time()
+        self.lock = threading.Lock()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self, tokens=1):
+        # Block until tokens are available, sleeping outside the lock so other threads can keep refilling
+        while True:
+            with self.lock:
+                self._refill(time.time())
+                if self.tokens >= tokens:
+                    self.tokens -= tokens
+                    return
+                wait = (tokens - self.tokens) / self.rate
+            time.sleep(wait)
+
+    def pause(self, seconds):
+        # Hold back every caller sharing this bucket, e.g. after the server answers 429
+        with self.lock:
+            self._refill(time.time())
+            self.tokens = min(self.tokens, 0.0) - seconds * self.rate
@@ -0,0 +1,93 @@
+import collections
+import json
+import os
+import shutil
+import threading
+import time
+
+from striketracker import atomic_write
+
+
+class CacheEntry(object):
+    def __init__(self, content, etag=None, stored=None):
+        self.content = content
+        self.etag = etag
+        self.stored = stored if stored is not None else time.time()
+
+    def fresh(self, ttl):
+        return time.time() - self.stored < ttl
+
+    def value(self):
+        # Parse on every hit so callers can never modify what is cached
+        return json.loads(self.content)
+
+
+class ResponseCache(object):
+    def __init__(self, ttl=60, maxsize=1024, directory=None):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self.directory = directory
+        self.entries = collections.OrderedDict()
+        self.lock = threading.Lock()
+
+    def _path(self, key):
+        account, host, scope = key
+        return os.path.join(self.directory, account, host, '%s.json' % (scope if scope is not None else '_host'))
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.pop(key, None)
+            if entry is not None:
+                self.entries[key] = entry
+                return entry
+        if self.directory is None:
+            return None
+        try:
+            with open(self._path(key)) as f:
+                stored = json.load(f)
+        except (IOError, OSError, ValueError):
+            return None
+        entry = CacheEntry(stored['content'], stored['etag'], stored['stored'])
+        self._remember(key, entry)
+        return entry
+
+    def _remember(self, key, entry):
+        with self.lock:
+            self.entries.pop(key, None)
+            self.entries[key] = entry
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+
+    def set(self, key, content, etag=None):
+        entry = CacheEntry(content, etag)
+        self._remember(key, entry)
+        if self.directory is not None:
+            # The disk copy is only a convenience: a concurrent invalidate() can remove the directory under us, or the
+            # disk can be full or read-only, and none of that should fail the request this response answered
+            path = self._path(key)
+            try:
+                os.makedirs(os.path.dirname(path))
+            except OSError:
+                pass
+            try:
+                atomic_write(path, json.dumps({'content': content, 'etag': etag, 'stored': entry.stored}))
+            except (IOError, OSError):
+                pass
+        return entry
+
+    def touch(self, key, entry):
+        # The server confirmed our copy is still current, so restart its ttl
+        return self.set(key, entry.content, entry.etag)
+
+    def invalidate(self, account, host):
+        with self.lock:
+            for key in [key for key in self.entries if key[0] == account and key[1] == host]:
+                del self.entries[key]
+        if self.directory is not None:
+            shutil.rmtree(os.path.join(self.directory, account, host), ignore_errors=True)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+        if self.directory is not None:
+            shutil.rmtree(self.directory, ignore_errors=True)
@@ -0,0 +1,47 @@
+from email.utils import mktime_tz, parsedate_tz
+import random
+import time
+
+
+class RetryPolicy(object):
+    # Statuses that mean the request was not processed and can be retried whatever the method
+    RETRY_ANY_METHOD = (429, 503)
+    IDEMPOTENT_METHODS = ('GET', 'HEAD', 'PUT', 'DELETE', 'OPTIONS')
+
+    def __init__(self, retries=3, backoff=0.5, max_backoff=30.0, statuses=(429, 500, 502, 503, 504),
+                 max_retry_after=120.0):
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.statuses = statuses
+        self.max_retry_after = max_retry_after
+
+    def should_retry(self, method, attempt, response=None, error=None):
+        if attempt >= self.retries:
+            return False
+        if error is not None:
+            import requests
+            return isinstance(error, requests.ConnectionError) and method in self.IDEMPOTENT_METHODS
+        if response.status_code not in self.statuses:
+            return False
+        return response.status_code in self.RETRY_ANY_METHOD or method in self.IDEMPOTENT_METHODS
+
+    def retry_after(self, response):
+        value = response.headers.get('Retry-After') if response is not None else None
+        if not value:
+            return None
+        try:
+            seconds = float(value)
+        except ValueError:
+            date = parsedate_tz(value)
+            if date is None:
+                return None
+            seconds = mktime_tz(date) - time.time()
+        return min(self.max_retry_after, max(0.0, seconds))
+
+    def delay(self, attempt, response=None):
+        # Honor the server's Retry-After, otherwise back off exponentially with full jitter
+        retry_after = self.retry_after(response)
+        if retry_after is not None:
+            return retry_after
+        return random.uniform(0, min(self.max_backoff, self.backoff * (2 ** attempt)))
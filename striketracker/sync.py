@@ -0,0 +1,60 @@
+import hashlib
+import json
+
+import requests
+
+from striketracker import APIError
+from striketracker.clone import ScopeResult, normalize_configuration
+from striketracker.concurrency import parallel_map
+from striketracker.diff import scope_key
+
+
+def configuration_hash(configuration):
+    # Digest of a normalized configuration that ignores key order, so equal configurations hash equally
+    return hashlib.sha1(json.dumps(configuration, sort_keys=True, separators=(',', ':')).encode('utf-8')).hexdigest()
+
+
+class HostSyncer(object):
+    def __init__(self, client, workers=4):
+        self.client = client
+        self.workers = workers
+
+    def _sync_scope(self, account, host, target_account, target_host, scope, target_scope):
+        configuration = normalize_configuration(self.client.get_configuration(account, host, scope['id']))
+        if target_scope is None:
+            target_scope = self.client.create_scope(target_account, target_host, {
+                "platform": scope['platform'],
+                "path": scope['path']
+            })
+            change = 'created'
+        else:
+            current = normalize_configuration(self.client.get_configuration(
+                target_account, target_host, target_scope['id']))
+            if configuration_hash(current) == configuration_hash(configuration):
+                return target_scope, current, 'unchanged'
+            change = 'updated'
+        new_configuration = self.client.update_configuration(
+            target_account, target_host, target_scope['id'], configuration)
+        return target_scope, new_configuration, change
+
+    def sync_scopes(self, account, host, target_account, target_host, scopes, target_scopes):
+        # Push each source scope whose configuration differs from the target's scope at the same platform and path,
+        # creating missing scopes, and yield a ScopeResult for each in source order. Extra target scopes are left alone
+        existing = dict((scope_key(scope), scope) for scope in target_scopes)
+        sync = lambda scope: self._sync_scope(account, host, target_account, target_host, scope,
+                                              existing.get(scope_key(scope)))
+        for scope, future in parallel_map(sync, scopes, self.workers):
+            error = future.exception()
+            if error is None:
+                new_scope, configuration, change = future.result()
+                yield ScopeResult(scope, new_scope, configuration, change=change)
+            elif isinstance(error, (APIError, requests.RequestException)):
+                yield ScopeResult(scope, error=error)
+            else:
+                raise error
+
+    def sync(self, account, host, target_host, target_account=None):
+        target_account = target_account or account
+        source = self.client.get_host(account, host)
+        target = self.client.get_host(target_account, target_host)
+        return list(self.sync_scopes(account, host, target_account, target_host, source['scopes'], target['scopes']))
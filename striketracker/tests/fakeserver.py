@@ -0,0 +1,216 @@
+import hashlib
+import itertools
+import json
+import random
+import re
+import threading
+import time
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+except ImportError:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+
+
+class FakeStrikeTrackerHandler(BaseHTTPRequestHandler):
+    # HTTP/1.1 so that clients can keep their connections alive between requests
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+    wbufsize = -1
+
+    routes = [
+        ('GET', r'^/version$', 'version'),
+        ('POST', r'^/auth/token$', 'auth_token'),
+        ('GET', r'^/api/v1/users/me$', 'me'),
+        ('POST', r'^/api/v1/accounts/(?P<account>\w+)/users/(?P<user>\w+)/tokens$', 'create_token'),
+        ('GET', r'^/api/v1/accounts/(?P<account>\w+)/hosts$', 'list_hosts'),
+        ('GET', r'^/api/v1/accounts/(?P<account>\w+)/subaccounts$', 'list_subaccounts'),
+        ('GET', r'^/api/v1/accounts/(?P<account>\w+)/hosts/(?P<host>\w+)$', 'get_host'),
+        ('POST', r'^/api/v1/accounts/(?P<account>\w+)/hosts$', 'create_host'),
+        ('POST', r'^/api/v1/accounts/(?P<account>\w+)/hosts/(?P<host>\w+)/configuration/scopes$', 'create_scope'),
+        ('GET', r'^/api/v1/accounts/(?P<account>\w+)/hosts/(?P<host>\w+)/configuration/(?P<scope>\w+)$',
+            'get_configuration'),
+        ('PUT', r'^/api/v1/accounts/(?P<account>\w+)/hosts/(?P<host>\w+)/configuration/(?P<scope>\w+)$',
+            'update_configuration'),
+        ('POST', r'^/api/v1/accounts/(?P<account>\w+)/purge$', 'purge'),
+        ('GET', r'^/api/v1/accounts/(?P<account>\w+)/purge/(?P<job_id>\w+)$', 'purge_status'),
+    ]
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status, body=None, headers=None):
+        payload = json.dumps(body).encode('utf-8') if body is not None else b''
+        headers = dict(headers or {})
+        if self.command == 'GET' and status == 200 and body is not None and self.server.etags:
+            headers['ETag'] = '"%s"' % hashlib.md5(payload).hexdigest()
+            if self.headers.get('If-None-Match') == headers['ETag']:
+                status, payload = 304, b''
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def _body(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length).decode('utf-8') if length else ''
+        if self.headers.get('Content-Type', '').startswith('application/json'):
+            return json.loads(body)
+        return body
+
+    def _dispatch(self):
+        path = self.path.split('?')[0]
+        for method, pattern, name in self.routes:
+            match = re.match(pattern, path)
+            if method == self.command and match:
+                body = self._body()
+                authorization = self.headers.get('Authorization')
+                if name not in ('version', 'auth_token') and authorization not in self.server.valid_authorizations():
+                    return self._send(401, {"error": "This endpoint requires authentication"})
+                if self.server.latency:
+                    time.sleep(self.server.latency)
+                if self.server.inject_error():
+                    return self._send(self.server.error_status, {"error": "Injected failure"})
+                with self.server.lock:
+                    self.server.connections.add(self.client_address)
+                    self.server.requests.append((self.command, path))
+                    response = getattr(self.server, name)(body=body, **match.groupdict())
+                return self._send(*response)
+        self._send(404, {"error": "Not found"})
+
+    do_GET = do_POST = do_PUT = do_DELETE = _dispatch
+
+
+class FakeStrikeTrackerServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address=('127.0.0.1', 0), token='testtoken', account='x1x2x3x4', purge_steps=2, latency=0,
+                 etags=True, error_rate=0, error_status=503, seed=0):
+        HTTPServer.__init__(self, address, FakeStrikeTrackerHandler)
+        self.lock = threading.Lock()
+        self.token = token
+        self.account = account
+        self.purge_steps = purge_steps
+        self.latency = latency
+        self.etags = etags
+        # Fraction of authenticated requests that fail with error_status, chosen by a seeded generator so that runs
+        # with the same settings fail the same share of requests
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.random = random.Random(seed)
+        self.connections = set()
+        self.access_tokens = set()
+        self.requests = []
+        self.hosts = {}
+        self.subaccounts = {}
+        self.configurations = {}
+        self.purges = {}
+        self.ids = itertools.count(1000)
+
+    @property
+    def base_url(self):
+        return 'http://%s:%d' % self.server_address
+
+    def valid_authorizations(self):
+        return set('Bearer %s' % token for token in self.access_tokens | set([self.token]))
+
+    def inject_error(self):
+        if not self.error_rate:
+            return False
+        with self.lock:
+            return self.random.random() < self.error_rate
+
+    def start(self):
+        thread = threading.Thread(target=self.serve_forever, kwargs={'poll_interval': 0.05})
+        thread.daemon = True
+        thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+    # Endpoints
+    def version(self, body):
+        return 200, None, {'X-Cdnws-Version': '3.0.4-1600'}
+
+    def auth_token(self, body):
+        if 'password=password1' not in body:
+            return 401, {"error": "Invalid username or password"}
+        access_token = 'access%d' % next(self.ids)
+        self.access_tokens.add(access_token)
+        return 200, {"access_token": access_token}
+
+    def me(self, body):
+        return 200, {"id": 12345, "accountHash": self.account, "firstName": "Highwinds"}
+
+    def create_token(self, body, account, user):
+        return 200, {"token": self.token}
+
+    def add_host(self, account, host, scopes=(), configurations=None):
+        # Seed a host, returning it with its scopes' ids filled in
+        host = dict(host, scopes=[])
+        for index, scope in enumerate(scopes):
+            scope = dict(scope, id=next(self.ids))
+            host['scopes'].append(scope)
+            configuration = dict(configurations[index]) if configurations else {}
+            configuration['scope'] = scope
+            self.configurations[(host['hashCode'], str(scope['id']))] = configuration
+        self.hosts[(account, host['hashCode'])] = host
+        return host
+
+    def list_hosts(self, body, account):
+        hosts = [dict(host) for (owner, hash_code), host in sorted(self.hosts.items()) if owner == account]
+        for host in hosts:
+            del host['scopes']
+        return 200, {"list": hosts}
+
+    def list_subaccounts(self, body, account):
+        return 200, {"list": self.subaccounts.get(account, [])}
+
+    def get_host(self, body, account, host):
+        if (account, host) not in self.hosts:
+            return 404, {"error": "Host not found"}
+        return 200, self.hosts[(account, host)]
+
+    def create_host(self, body, account):
+        hash_code = 'h%d' % next(self.ids)
+        host = {"name": body['name'], "hashCode": hash_code, "services": body.get('services', []),
+                "scopes": []}
+        self.hosts[(account, hash_code)] = host
+        return 201, host
+
+    def create_scope(self, body, account, host):
+        if (account, host) not in self.hosts:
+            return 404, {"error": "Host not found"}
+        scope = {"id": next(self.ids), "platform": body['platform'], "path": body['path']}
+        self.hosts[(account, host)]['scopes'].append(scope)
+        self.configurations[(host, str(scope['id']))] = {"scope": scope}
+        return 200, scope
+
+    def get_configuration(self, body, account, host, scope):
+        if (host, scope) not in self.configurations:
+            return 404, {"error": "Scope not found"}
+        return 200, self.configurations[(host, scope)]
+
+    def update_configuration(self, body, account, host, scope):
+        if (host, scope) not in self.configurations:
+            return 404, {"error": "Scope not found"}
+        configuration = dict(body, scope=self.configurations[(host, scope)]['scope'])
+        self.configurations[(host, scope)] = configuration
+        return 200, configuration
+
+    def purge(self, body, account):
+        job_id = 'job%d' % next(self.ids)
+        self.purges[job_id] = [0, len(body['list'])]
+        return 200, {"id": job_id}
+
+    def purge_status(self, body, account, job_id):
+        if job_id not in self.purges:
+            return 404, {"error": "Purge not found"}
+        self.purges[job_id][0] = min(self.purges[job_id][0] + 1, self.purge_steps)
+        return 200, {"progress": float(self.purges[job_id][0]) / self.purge_steps}
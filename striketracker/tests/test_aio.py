@@ -0,0 +1,164 @@
+import contextlib
+import socket
+import sys
+import threading
+import time
+import unittest
+from striketracker import APIError
+from striketracker.tests.fakeserver import FakeStrikeTrackerServer
+# striketracker.aio uses async/await, so it cannot even be imported on older versions
+if sys.version_info >= (3, 5, 2):
+    import asyncio
+    from striketracker.aio import AsyncAPIClient
+
+
+@unittest.skipIf(sys.version_info < (3, 5, 2), 'striketracker.aio needs Python 3.5.2 or later')
+class TestAsyncAPIClient(unittest.TestCase):
+    def setUp(self):
+        self.server = FakeStrikeTrackerServer().start()
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self.client = AsyncAPIClient(self.server.base_url, 'testtoken')
+
+    def tearDown(self):
+        self.client.close()
+        # Let the closed connections finish closing before the loop goes
+        self.loop.run_until_complete(asyncio.sleep(0))
+        self.loop.close()
+        asyncio.set_event_loop(None)
+        self.server.stop()
+
+    def run_until_complete(self, future):
+        return self.loop.run_until_complete(future)
+
+    def test_version(self):
+        self.assertEqual('3.0.4-1600', self.run_until_complete(self.client.version()))
+
+    def test_me(self):
+        user = self.run_until_complete(self.client.me())
+        self.assertEqual('x1x2x3x4', user['accountHash'])
+
+    def test_me_fails(self):
+        self.client.token = 'badtoken'
+        with self.assertRaises(APIError) as e:
+            self.run_until_complete(self.client.me())
+        self.assertEqual('This endpoint requires authentication', e.exception.context.json()['error'])
+
+    def test_get_host(self):
+        host = self.server.add_host('y1y2y3y4', {"name": "test host", "hashCode": "x1x2x3x4", "services": []},
+                                    [{"platform": "CDS", "path": "/"}])
+        self.assertEqual(host, self.run_until_complete(self.client.get_host('y1y2y3y4', 'x1x2x3x4')))
+
+    def test_get_host_fails(self):
+        with self.assertRaises(APIError):
+            self.run_until_complete(self.client.get_host('y1y2y3y4', 'x1x2x3x4'))
+
+    def test_configuration(self):
+        host = self.run_until_complete(self.client.create_host('y1y2y3y4', {"name": "test host", "services": []}))
+        scope = self.run_until_complete(self.client.create_scope(
+            'y1y2y3y4', host['hashCode'], {"platform": "CDS", "path": "/"}))
+        configuration = {"originPullHost": {"primary": 42}}
+        updated = self.run_until_complete(self.client.update_configuration(
+            'y1y2y3y4', host['hashCode'], scope['id'], configuration))
+        self.assertEqual({"primary": 42}, updated['originPullHost'])
+        self.assertEqual(updated, self.run_until_complete(
+            self.client.get_configuration('y1y2y3y4', host['hashCode'], scope['id'])))
+
+    def test_create_token(self):
+        self.client.token = None
+        self.assertEqual('testtoken', self.run_until_complete(self.client.create_token('bob', 'password1')))
+        self.assertEqual('testtoken', self.client.token)
+
+    def test_create_token_fails_login(self):
+        with self.assertRaises(APIError) as e:
+            self.run_until_complete(self.client.create_token('bob', 'password2'))
+        self.assertEqual('Could not fetch access token', str(e.exception))
+
+    def test_purge(self):
+        job_id = self.run_until_complete(self.client.purge('x1x2x3x4', [{"url": "//cdn.foo.com/main.js"}]))
+        self.assertEqual(0.5, self.run_until_complete(self.client.purge_status('x1x2x3x4', job_id)))
+        self.assertEqual(1.0, self.run_until_complete(self.client.purge_status('x1x2x3x4', job_id)))
+
+    def test_concurrency_limit(self):
+        client = AsyncAPIClient(self.server.base_url, 'testtoken', pool_maxsize=2)
+        users = self.run_until_complete(asyncio.gather(*[client.me() for _ in range(20)]))
+        client.close()
+        self.assertEqual(20, len(users))
+        self.assertEqual(2, len(self.server.connections))
+
+    def test_timeout(self):
+        self.server.latency = 0.5
+        client = AsyncAPIClient(self.server.base_url, 'testtoken', timeout=0.05)
+        with self.assertRaises(asyncio.TimeoutError):
+            self.run_until_complete(client.me())
+        client.close()
+
+    def test_timeout_includes_waiting_for_a_slot(self):
+        # The second request spends most of its timeout waiting for the first to free the only connection
+        self.server.latency = 0.4
+        client = AsyncAPIClient(self.server.base_url, 'testtoken', pool_maxsize=1, timeout=0.6)
+        # Tasks made in order, since gather() on Python 3.6 starts coroutines in no particular order
+        requests = [asyncio.ensure_future(client.me(), loop=self.loop) for _ in range(2)]
+        first, second = self.run_until_complete(asyncio.gather(*requests, return_exceptions=True))
+        self.assertEqual('x1x2x3x4', first['accountHash'])
+        self.assertIsInstance(second, asyncio.TimeoutError)
+        # The slot it was waiting for is not leaked
+        self.server.latency = 0
+        self.assertEqual('x1x2x3x4', self.run_until_complete(client.me())['accountHash'])
+        client.close()
+
+    def _stale_connection(self):
+        # Keep one connection alive, then make it fail the next request the way a connection the server closed does
+        self.run_until_complete(self.client.version())
+        connection = self.client._idle[0]
+
+        def request(payload):
+            failed = self.loop.create_future()
+            failed.set_exception(ConnectionResetError())
+            return failed
+        connection.request = request
+
+    def test_stale_connection_retried(self):
+        self._stale_connection()
+        self.assertEqual('x1x2x3x4', self.run_until_complete(self.client.me())['accountHash'])
+
+    def test_stale_connection_post_not_replayed(self):
+        self._stale_connection()
+        with self.assertRaises(ConnectionResetError):
+            self.run_until_complete(self.client.purge('x1x2x3x4', [{"url": "//cdn.foo.com/main.js"}]))
+        self.assertEqual([], [request for request in self.server.requests if request[0] == 'POST'])
+
+    def serve_raw(self, *responses):
+        # Answer successive requests on one connection with canned responses, each sent in parts with a pause between
+        listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        listener.bind(('127.0.0.1', 0))
+        listener.listen(1)
+
+        def serve():
+            with contextlib.closing(listener):
+                connection, _ = listener.accept()
+            with contextlib.closing(connection):
+                for parts in responses:
+                    request = b''
+                    while b'\r\n\r\n' not in request:
+                        data = connection.recv(65536)
+                        if not data:
+                            return
+                        request += data
+                    for part in parts:
+                        connection.sendall(part)
+                        time.sleep(0.05)
+        thread = threading.Thread(target=serve)
+        thread.daemon = True
+        thread.start()
+        return 'http://127.0.0.1:%d' % listener.getsockname()[1]
+
+    def test_chunked_trailers(self):
+        # The blank line ending the trailers arrives late, and must not be taken for the start of the next response
+        client = AsyncAPIClient(self.serve_raw(
+            [b'HTTP/1.1 200 OK\r\nTransfer-Encoding: chunked\r\n\r\n5;name=value\r\n{"id"\r\n4\r\n: 1}\r\n0\r\n'
+             b'X-Checksum: abc\r\n', b'\r\n'],
+            [b'HTTP/1.1 200 OK\r\nContent-Length: 9\r\n\r\n{"id": 2}']), 'testtoken', timeout=5)
+        self.assertEqual({"id": 1}, self.run_until_complete(client.me()))
+        self.assertEqual({"id": 2}, self.run_until_complete(client.me()))
+        client.close()
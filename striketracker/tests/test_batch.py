@@ -0,0 +1,99 @@
+import json
+import os
+import shutil
+import socket
+from StringIO import StringIO
+from tempfile import mkdtemp
+import threading
+import unittest
+from striketracker import APIClient
+from striketracker.batch import BatchRunner
+from striketracker.tests.fakeserver import FakeStrikeTrackerServer
+
+
+class TestBatchRunner(unittest.TestCase):
+    def setUp(self):
+        self.server = FakeStrikeTrackerServer().start()
+        self.server.add_host('y1y2y3y4', {"name": "test host", "hashCode": "x1x2x3x4", "services": []})
+        self.client = APIClient(self.server.base_url, 'testtoken')
+        self.runner = BatchRunner(self.client, workers=4)
+
+    def tearDown(self):
+        self.runner.close()
+        self.client.close()
+        self.server.stop()
+
+    def run_lines(self, lines):
+        output = StringIO()
+        self.runner.serve(StringIO(''.join(line + '\n' for line in lines)), output)
+        return dict((response['id'], response) for response in map(json.loads, output.getvalue().splitlines()))
+
+    def test_serve(self):
+        responses = self.run_lines([json.dumps({
+            "id": index, "method": "get_host", "params": {"account": "y1y2y3y4", "host": "x1x2x3x4"}
+        }) for index in range(20)] + [
+            '',
+            json.dumps({"id": "me", "method": "me"}),
+            json.dumps({"id": "purge", "method": "purge", "params": ["x1x2x3x4", [{"url": "//cdn.foo.com/a"}]]})
+        ])
+        self.assertEqual(22, len(responses))
+        self.assertEqual('test host', responses[7]['result']['name'])
+        self.assertEqual('x1x2x3x4', responses['me']['result']['accountHash'])
+        self.assertIsNone(responses['purge']['error'])
+
+    def test_errors(self):
+        responses = self.run_lines([
+            json.dumps({"id": 1, "method": "get_host", "params": {"account": "y1y2y3y4", "host": "missing"}}),
+            json.dumps({"id": 2, "method": "create_token", "params": ["bob", "password1"]}),
+            json.dumps({"id": 3, "method": "get_host", "params": {"hostname": "x1x2x3x4"}}),
+            '{"id": 4,'
+        ])
+        self.assertEqual({"message": "Could not fetch host", "status": 404, "detail": "Host not found"},
+                         responses[1]['error'])
+        self.assertEqual('ValueError: Unknown method: create_token', responses[2]['error']['message'])
+        self.assertIn('TypeError', responses[3]['error']['message'])
+        self.assertIn('Invalid JSON', responses[None]['error']['message'])
+
+    def test_listen(self):
+        directory = mkdtemp()
+        path = os.path.join(directory, 'striketracker.sock')
+        server = self.runner.listen(path)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.start()
+        try:
+            connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            connection.connect(path)
+            stream = connection.makefile('rw')
+            stream.write(json.dumps({"id": 1, "method": "me"}) + '\n')
+            stream.flush()
+            self.assertEqual('x1x2x3x4', json.loads(stream.readline())['result']['accountHash'])
+            connection.close()
+        finally:
+            server.shutdown()
+            server.server_close()
+            thread.join()
+            shutil.rmtree(directory)
+
+    def test_listen_replaces_stale_socket(self):
+        directory = mkdtemp()
+        path = os.path.join(directory, 'striketracker.sock')
+        try:
+            self.runner.listen(path).server_close()
+            self.assertTrue(os.path.exists(path))
+            self.runner.listen(path).server_close()
+        finally:
+            shutil.rmtree(directory)
+
+    def test_listen_keeps_other_files(self):
+        directory = mkdtemp()
+        path = os.path.join(directory, 'notes.txt')
+        try:
+            with open(path, 'w') as f:
+                f.write('keep me')
+            with self.assertRaises(ValueError) as raised:
+                self.runner.listen(path)
+            self.assertEqual('%s exists and is not a socket' % path, str(raised.exception))
+            with open(path) as f:
+                self.assertEqual('keep me', f.read())
+        finally:
+            shutil.rmtree(directory)
@@ -1,6 +1,11 @@
+import threading
+import time
 import unittest
 import responses
+from mock import patch
 from striketracker import APIClient, APIError
+from striketracker.ratelimit import TokenBucket
+from striketracker.retry import RetryPolicy
 
 
 class TestStrikeTrackerAPIClient(unittest.TestCase):
@@ -87,6 +92,32 @@ class TestStrikeTrackerAPIClient(unittest.TestCase):
         self.assertEqual(self.client.get_host('y1y2y3y4', 'x1x2x3x4'), host)
 
 
+    @responses.activate
+    def test_list_hosts(self):
+        hosts = [{"name": "test host", "hashCode": "x1x2x3x4", "type": "HOST", "services": []}]
+        responses.add(responses.GET, 'http://127.0.0.1/api/v1/accounts/y1y2y3y4/hosts', json={"list": hosts},
+                      status=200)
+        self.assertEqual(hosts, self.client.list_hosts('y1y2y3y4'))
+
+    @responses.activate
+    def test_list_hosts_fails(self):
+        responses.add(responses.GET, 'http://127.0.0.1/api/v1/accounts/y1y2y3y4/hosts', status=401)
+        with self.assertRaises(APIError):
+            self.client.list_hosts('y1y2y3y4')
+
+    @responses.activate
+    def test_list_subaccounts(self):
+        subaccounts = [{"accountHash": "z1z2z3z4", "accountName": "Sub account"}]
+        responses.add(responses.GET, 'http://127.0.0.1/api/v1/accounts/y1y2y3y4/subaccounts',
+                      json={"list": subaccounts}, status=200)
+        self.assertEqual(subaccounts, self.client.list_subaccounts('y1y2y3y4'))
+
+    @responses.activate
+    def test_list_subaccounts_fails(self):
+        responses.add(responses.GET, 'http://127.0.0.1/api/v1/accounts/y1y2y3y4/subaccounts', status=403)
+        with self.assertRaises(APIError):
+            self.client.list_subaccounts('y1y2y3y4')
+
     @responses.activate
     def test_get_host_fails(self):
         responses.add(responses.GET, 'http://127.0.0.1/api/v1/accounts/y1y2y3y4/hosts/x1x2x3x4', status=401)
@@ -280,3 +311,122 @@ class TestStrikeTrackerAPIClient(unittest.TestCase):
             })
         with self.assertRaises(APIError):
             self.client.purge_status('x1x2x3x4', 'mwx9034mtc049myx2')
+
+    def test_session_pool(self):
+        client = APIClient('http://127.0.0.1', 'testtoken', pool_connections=4, pool_maxsize=32)
+        adapter = client.session.get_adapter('https://striketracker.highwinds.com')
+        self.assertEqual(32, adapter._pool_maxsize)
+        self.assertIs(adapter, client.session.get_adapter('http://127.0.0.1'))
+
+    def test_resize_pool(self):
+        client = APIClient('http://127.0.0.1', 'testtoken', pool_maxsize=10)
+        previous = client.session.get_adapter('https://striketracker.highwinds.com')
+        client.resize_pool(32)
+        adapter = client.session.get_adapter('https://striketracker.highwinds.com')
+        self.assertIsNot(previous, adapter)
+        self.assertEqual(32, adapter._pool_maxsize)
+        self.assertIs(adapter, client.session.get_adapter('http://127.0.0.1'))
+        # Never shrunk
+        client.resize_pool(4)
+        self.assertIs(adapter, client.session.get_adapter('http://127.0.0.1'))
+        self.assertEqual(32, client.pool_maxsize)
+
+    def test_session_created_once(self):
+        import requests
+        client = APIClient('http://127.0.0.1', 'testtoken')
+        start = threading.Event()
+        sessions = []
+        session = requests.Session
+
+        def slow_session():
+            time.sleep(0.05)
+            return session()
+
+        def first_use():
+            start.wait()
+            sessions.append(client.session)
+        with patch('requests.Session', side_effect=slow_session) as constructor:
+            threads = [threading.Thread(target=first_use) for _ in range(8)]
+            for thread in threads:
+                thread.start()
+            start.set()
+            for thread in threads:
+                thread.join()
+        self.assertEqual(1, constructor.call_count)
+        self.assertEqual(8, len(sessions))
+        self.assertTrue(all(s is sessions[0] for s in sessions))
+
+    @responses.activate
+    def test_session_reused(self):
+        responses.add(responses.GET, 'http://127.0.0.1/api/v1/users/me', json={}, status=200)
+        with patch.object(self.client.session, 'request', wraps=self.client.session.request) as request:
+            self.client.me()
+            self.client.me()
+        self.assertEqual(2, request.call_count)
+        self.assertEqual('Bearer testtoken', request.call_args[1]['headers']['Authorization'])
+
+    @responses.activate
+    def test_timeout(self):
+        client = APIClient('http://127.0.0.1', 'testtoken', timeout=(3, 10))
+        responses.add(responses.GET, 'http://127.0.0.1/api/v1/users/me', json={}, status=200)
+        with patch.object(client.session, 'request', wraps=client.session.request) as request:
+            client.me()
+        self.assertEqual((3, 10), request.call_args[1]['timeout'])
+
+    @responses.activate
+    def test_no_keep_alive(self):
+        client = APIClient('http://127.0.0.1', 'testtoken', keep_alive=False)
+        responses.add(responses.GET, 'http://127.0.0.1/api/v1/users/me', json={}, status=200)
+        client.me()
+        self.assertEqual('close', responses.calls[0].request.headers['Connection'])
+
+    @responses.activate
+    @patch('time.sleep')
+    def test_retry(self, sleep):
+        client = APIClient('http://127.0.0.1', 'testtoken', retry=RetryPolicy(retries=2))
+        responses.add(responses.GET, 'http://127.0.0.1/api/v1/users/me', status=503)
+        responses.add(responses.GET, 'http://127.0.0.1/api/v1/users/me', status=502)
+        responses.add(responses.GET, 'http://127.0.0.1/api/v1/users/me', json={'id': 1}, status=200)
+        self.assertEqual({'id': 1}, client.me())
+        self.assertEqual(3, len(responses.calls))
+        self.assertEqual(2, sleep.call_count)
+
+    @responses.activate
+    @patch('time.sleep')
+    def test_retry_gives_up(self, sleep):
+        client = APIClient('http://127.0.0.1', 'testtoken', retry=RetryPolicy(retries=2))
+        responses.add(responses.GET, 'http://127.0.0.1/api/v1/users/me', status=503)
+        with self.assertRaises(APIError):
+            client.me()
+        self.assertEqual(3, len(responses.calls))
+
+    @responses.activate
+    @patch('time.sleep')
+    def test_retry_post(self, sleep):
+        client = APIClient('http://127.0.0.1', 'testtoken', retry=RetryPolicy())
+        responses.add(responses.POST, 'http://127.0.0.1/api/v1/accounts/x1x2x3x4/purge', status=500,
+                      json={'error': 'Could not send purge to the CDN'})
+        with self.assertRaises(APIError):
+            client.purge('x1x2x3x4', [{"url": '//cdn.foo.com/main.js'}])
+        self.assertEqual(1, len(responses.calls))
+
+    @responses.activate
+    def test_retry_after_pauses_rate_limiter(self):
+        bucket = TokenBucket(10)
+        client = APIClient('http://127.0.0.1', 'testtoken', retry=RetryPolicy(), rate_limiter=bucket)
+        responses.add(responses.POST, 'http://127.0.0.1/api/v1/accounts/x1x2x3x4/purge', status=429,
+                      adding_headers={'Retry-After': '0.05'})
+        responses.add(responses.POST, 'http://127.0.0.1/api/v1/accounts/x1x2x3x4/purge', status=200,
+                      json={'id': 'mwx9034mtc049myx2'})
+        start = time.time()
+        with patch.object(bucket, 'pause', wraps=bucket.pause) as pause:
+            self.assertEqual('mwx9034mtc049myx2', client.purge('x1x2x3x4', [{"url": '//cdn.foo.com/main.js'}]))
+        pause.assert_called_once_with(0.05)
+        self.assertGreaterEqual(time.time() - start, 0.05)
+
+    @responses.activate
+    def test_no_retry_by_default(self):
+        responses.add(responses.GET, 'http://127.0.0.1/api/v1/users/me', status=503)
+        with self.assertRaises(APIError):
+            self.client.me()
+        self.assertEqual(1, len(responses.calls))
@@ -0,0 +1,131 @@
+from StringIO import StringIO
+import unittest
+from mock import patch
+import requests
+from striketracker import APIClient
+from striketracker.clone import normalize_configuration, read_manifest, BulkCloner, HostCloner
+from striketracker.retry import RetryPolicy
+from striketracker.tests.fakeserver import FakeStrikeTrackerServer
+
+
+class TestNormalizeConfiguration(unittest.TestCase):
+    def test_normalize_configuration(self):
+        configuration = {
+            "scope": {"id": 2746296, "platform": "CDS", "path": "/"},
+            "originPullHost": {"id": 92846, "primary": 1234},
+            "cacheControl": [
+                {"id": 2846, "statusCodeMatch": "200", "maxAge": 600},
+                {"id": 26461947, "statusCodeMatch": "4*,5*", "maxAge": 1}
+            ],
+            "hostname": [{"domain": "www.foo.com"}]
+        }
+        self.assertEqual({
+            "originPullHost": {"primary": 1234},
+            "cacheControl": [
+                {"statusCodeMatch": "200", "maxAge": 600},
+                {"statusCodeMatch": "4*,5*", "maxAge": 1}
+            ]
+        }, normalize_configuration(configuration))
+        # Source configuration is left untouched
+        self.assertEqual(92846, configuration['originPullHost']['id'])
+
+
+class TestHostCloner(unittest.TestCase):
+    def setUp(self):
+        self.server = FakeStrikeTrackerServer().start()
+        self.client = APIClient(self.server.base_url, 'testtoken')
+        self.scopes = [{"platform": "CDS", "path": "/%d" % i} for i in range(20)]
+        self.server.add_host('y1y2y3y4', {"name": "test host", "hashCode": "x1x2x3x4", "services": []},
+                             self.scopes, [{"originPullHost": {"id": i, "primary": i}} for i in range(20)])
+
+    def tearDown(self):
+        self.client.close()
+        self.server.stop()
+
+    def test_clone(self):
+        new_host, results = HostCloner(self.client, workers=8).clone('y1y2y3y4', 'x1x2x3x4')
+        self.assertEqual('test host (copy)', new_host['name'])
+        self.assertEqual(['/%d' % i for i in range(20)], [result.new_scope['path'] for result in results])
+        self.assertEqual([{"primary": i} for i in range(20)],
+                         [result.configuration['originPullHost'] for result in results])
+        self.assertEqual(20, len(self.client.get_host('y1y2y3y4', new_host['hashCode'])['scopes']))
+
+    def test_clone_to_account(self):
+        new_host, results = HostCloner(self.client).clone('y1y2y3y4', 'x1x2x3x4', name='new host',
+                                                          target_account='z1z2z3z4')
+        self.assertEqual('new host', self.client.get_host('z1z2z3z4', new_host['hashCode'])['name'])
+        self.assertTrue(all(result.error is None for result in results))
+
+    def test_clone_scope_fails(self):
+        host = self.client.get_host('y1y2y3y4', 'x1x2x3x4')
+        del self.server.configurations[('x1x2x3x4', str(host['scopes'][3]['id']))]
+        new_host, results = HostCloner(self.client, workers=8).clone('y1y2y3y4', 'x1x2x3x4')
+        self.assertEqual('Could not fetch configuration', results[3].error.message)
+        self.assertEqual(19, len([result for result in results if result.error is None]))
+        self.assertEqual(19, len(self.client.get_host('y1y2y3y4', new_host['hashCode'])['scopes']))
+
+    def test_clone_retries_injected_errors(self):
+        self.server.error_rate = 0.2
+        client = APIClient(self.server.base_url, 'testtoken', retry=RetryPolicy(retries=10, backoff=0))
+        new_host, results = HostCloner(client, workers=8).clone('y1y2y3y4', 'x1x2x3x4')
+        client.close()
+        self.assertTrue(all(result.error is None for result in results))
+        self.server.error_rate = 0
+        self.assertEqual(20, len(self.client.get_host('y1y2y3y4', new_host['hashCode'])['scopes']))
+
+
+class TestBulkCloner(unittest.TestCase):
+    def setUp(self):
+        self.server = FakeStrikeTrackerServer().start()
+        self.client = APIClient(self.server.base_url, 'testtoken')
+        for index in range(5):
+            self.server.add_host('y1y2y3y4', {"name": "host %d" % index, "hashCode": "x%d" % index, "services": []},
+                                 [{"platform": "CDS", "path": "/"}, {"platform": "ALL", "path": "/"}])
+
+    def tearDown(self):
+        self.client.close()
+        self.server.stop()
+
+    def test_read_manifest(self):
+        manifest = StringIO('# account,host,target,name\ny1y2y3y4,x0\n\ny1y2y3y4, x1 ,z1z2z3z4,new host\n')
+        self.assertEqual([
+            {"account": "y1y2y3y4", "host": "x0", "target_account": "y1y2y3y4", "name": None},
+            {"account": "y1y2y3y4", "host": "x1", "target_account": "z1z2z3z4", "name": "new host"}
+        ], list(read_manifest(manifest)))
+
+    def test_clone(self):
+        rows = [{"account": "y1y2y3y4", "host": "x%d" % index, "target_account": "z1z2z3z4", "name": None}
+                for index in range(5)]
+        rows.append({"account": "y1y2y3y4", "host": "missing", "target_account": "z1z2z3z4", "name": None})
+        results = list(BulkCloner(self.client, workers=3).clone(iter(rows)))
+        self.assertEqual(['host %d (copy)' % index for index in range(5)] + [None],
+                         [result['name'] for result in results])
+        self.assertEqual([2] * 5 + [0], [result['scopes'] for result in results])
+        self.assertEqual('Could not fetch host', results[-1]['error'])
+        self.assertEqual(2, len(self.client.get_host('z1z2z3z4', results[0]['hashCode'])['scopes']))
+
+    def test_clone_scope_fails(self):
+        host = self.client.get_host('y1y2y3y4', 'x0')
+        del self.server.configurations[('x0', str(host['scopes'][1]['id']))]
+        results = list(BulkCloner(self.client).clone(
+            [{"account": "y1y2y3y4", "host": "x0", "target_account": "y1y2y3y4", "name": "new"}]))
+        self.assertEqual(1, results[0]['scopes'])
+        self.assertEqual([{"platform": "ALL", "path": "/", "error": "Could not fetch configuration"}],
+                         results[0]['failedScopes'])
+
+    def test_clone_connection_error(self):
+        # A dropped connection fails only the row or scope it happened on
+        request = self.client.session.request
+
+        def drop(method, url, **kwargs):
+            if url.endswith('/hosts/x1') or url.endswith('/configuration/scopes'):
+                raise requests.ConnectionError('Connection aborted')
+            return request(method, url, **kwargs)
+        rows = [{"account": "y1y2y3y4", "host": "x%d" % index, "target_account": "z1z2z3z4", "name": None}
+                for index in range(2)]
+        with patch.object(self.client.session, 'request', side_effect=drop):
+            results = list(BulkCloner(self.client).clone(rows))
+        self.assertEqual(0, results[0]['scopes'])
+        self.assertEqual([{"platform": "CDS", "path": "/", "error": "Connection aborted"},
+                          {"platform": "ALL", "path": "/", "error": "Connection aborted"}], results[0]['failedScopes'])
+        self.assertEqual((None, 'Connection aborted'), (results[1]['hashCode'], results[1]['error']))
@@ -1,9 +1,15 @@
 from StringIO import StringIO
+import json
 import os
+import subprocess
+import shutil
+import tempfile
 from tempfile import mkstemp
 import unittest
+import responses
 from mock import patch, mock_open, MagicMock, Mock
 import sys
+import requests
 from requests import Response
 from striketracker import Command, APIError
 
@@ -22,6 +28,8 @@ class TestStrikeTrackerCommand(unittest.TestCase):
     def tearDown(self):
         os.close(self.fd)
         os.unlink(self.cache)
+        if os.path.exists(self.cache + '.lock'):
+            os.unlink(self.cache + '.lock')
         sys.stdout = self._stdout
         sys.stderr = self._stderr
         sys.stdin = self._stdin
@@ -64,6 +72,46 @@ class TestStrikeTrackerCommand(unittest.TestCase):
         self.assertEqual('Initializing configuration...\nSuccessfully saved token\n',
                          sys.stdout.getvalue())
 
+    @patch('striketracker.APIClient.create_token')
+    def test_init_profile(self, create_token):
+        sys.argv = ['striketracker', 'init', '--token', 'foobar', '--profile', 'staging']
+        command = Command(cache=self.cache)
+        self.assertIsNone(command.cache.get('token'))
+        self.assertEqual({'staging': {'token': 'foobar'}}, command.cache.get('profiles'))
+        sys.argv = ['striketracker', 'init', '--token', 'foobar', '--profile', 'staging', '--account', 'y1y2y3y4']
+        command = Command(cache=self.cache)
+        self.assertEqual({'staging': {'token': 'foobar', 'account': 'y1y2y3y4'}}, command.cache.get('profiles'))
+
+    @patch('striketracker.APIClient.me')
+    def test_profile(self, me):
+        os.write(self.fd, 'token: default\nprofiles:\n  staging:\n    token: staging\n')
+        me.return_value = {'id': 1}
+        sys.argv = ['striketracker', 'me', '--profile', 'staging']
+        command = Command(cache=self.cache)
+        self.assertEqual('staging', command.client.token)
+        with patch.dict(os.environ, {'STRIKETRACKER_PROFILE': 'staging'}):
+            sys.argv = ['striketracker', 'me']
+            self.assertEqual('staging', Command(cache=self.cache).client.token)
+        sys.argv = ['striketracker', 'me']
+        self.assertEqual('default', Command(cache=self.cache).client.token)
+
+    @patch('striketracker.APIClient.purge')
+    @patch('striketracker.APIClient.me')
+    def test_saved_token_rejected(self, me, purge):
+        os.write(self.fd, 'token: expired')
+        response = Response()
+        response.status_code = 401
+        response._content = b'{"error": "Invalid token"}'
+        me.side_effect = APIError('Could not fetch user details', response)
+        sys.argv = ['striketracker', 'purge', 'x1x2x3x4']
+        sys.stdin.write('//cdn.foo.com/main.js\n')
+        sys.stdin.seek(0)
+        with self.assertRaises(SystemExit):
+            Command(cache=self.cache)
+        self.assertFalse(purge.called)
+        self.assertEqual('The saved token was rejected. Run `striketracker init` to save a new one.\n'
+                         'Could not fetch user details\nInvalid token\n', sys.stderr.getvalue())
+
     @patch('striketracker.APIClient.version')
     def test_version(self, version):
         sys.argv = ['striketracker', 'version']
@@ -82,6 +130,16 @@ class TestStrikeTrackerCommand(unittest.TestCase):
         self.assertTrue(version.called)
         self.assertEqual('3.0.4-1600\n', sys.stdout.getvalue())
 
+    @responses.activate
+    @patch('logging.getLogger')
+    def test_verbose_timings(self, getLogger):
+        sys.argv = ['striketracker', 'version', '--verbose']
+        responses.add(responses.GET, 'https://striketracker.highwinds.com/version',
+                      adding_headers={'X-Cdnws-Version': '3.0.4-1600'})
+        Command()
+        self.assertEqual('3.0.4-1600\n', sys.stdout.getvalue())
+        self.assertIn('GET /version: 1 calls, 0 failed, 0 bytes sent, 0 received\n', sys.stderr.getvalue())
+
     @patch('striketracker.APIClient.me')
     @patch('striketracker.ConfigurationCache.get')
     def test_me(self, get, me):
@@ -233,11 +291,36 @@ type: HOST
 updatedDate: '2016-04-12 11:22:18'
 """, sys.stdout.getvalue())
 
-    def test_purge_no_hash(self):
+    @patch('striketracker.APIClient.purge')
+    @patch('striketracker.APIClient.me')
+    def test_purge_default_account(self, me, purge):
+        me.return_value = {"id": 12345, "accountHash": "r1r2r3r4"}
+        purge.return_value = 'cmu34ctmy3408xmy'
+        for _ in range(2):
+            sys.argv = ['striketracker', 'purge', '--token', 'foobarwinniethefoobar']
+            sys.stdin.write('//cdn.foo.com/main.js\n')
+            sys.stdin.seek(0)
+            Command(cache=self.cache)
+            self.assertEqual('r1r2r3r4', purge.call_args[0][0])
+        # The account context is remembered for the token, so the second run makes no extra request
+        self.assertEqual(1, me.call_count)
+
+    @patch('striketracker.APIClient.get_host')
+    @patch('striketracker.APIClient.me')
+    def test_profile_account(self, me, get_host):
+        os.write(self.fd, 'profiles:\n  staging:\n    token: staging\n    account: y1y2y3y4\n')
+        get_host.return_value = {}
+        sys.argv = ['striketracker', 'get_host', 'x1x2x3x4', '--profile', 'staging']
+        Command(cache=self.cache)
+        get_host.assert_called_with('y1y2y3y4', 'x1x2x3x4')
+        self.assertFalse(me.called)
+
+    def test_purge_no_account(self):
         sys.argv = ['striketracker', 'purge', '--token', 'foobarwinniethefoobar']
-        with self.assertRaises(SystemExit) as e:
-            command = Command()
-        self.assertIn('too few arguments', sys.stderr.getvalue())
+        with patch('striketracker.APIClient.me', side_effect=APIError('Could not fetch user details', None)):
+            with self.assertRaises(SystemExit):
+                Command(cache=self.cache)
+        self.assertIn('Could not fetch user details', sys.stderr.getvalue())
 
     def test_purge_no_token(self):
         sys.argv = ['striketracker', 'purge', 'x1x2x3x4']
@@ -287,8 +370,10 @@ updatedDate: '2016-04-12 11:22:18'
         with self.assertRaises(SystemExit):
             command = Command()
 
+    @patch('striketracker.APIClient.me')
     @patch('striketracker.APIClient.purge')
-    def test_purge_options(self, purge):
+    def test_purge_options(self, purge, me):
+        me.return_value = {"id": 1, "accountHash": "x1x2x3x4"}
         sys.stdin.write('//cdn.foo.com/main.js\n//cdn.foo.com/main.css')
         os.write(self.fd, 'token: foobar')
         for option in ['--purge-all-dynamic', '--recursive', '--invalidate-only']:
@@ -309,6 +394,72 @@ updatedDate: '2016-04-12 11:22:18'
                     "invalidateOnly": option == '--invalidate-only'
                 }
             ])
+        # The saved token is only checked once, then remembered
+        self.assertEqual(1, me.call_count)
+
+    @patch('striketracker.APIClient.purge')
+    def test_purge_optimize(self, purge):
+        sys.stdin.write('//cdn.foo.com/a/1.js\n//cdn.foo.com/b.js\n//cdn.foo.com/a/2.js\n//cdn.foo.com/a/1.js\n')
+        sys.stdin.seek(0)
+        sys.argv = ['striketracker', 'purge', 'x1x2x3x4', '--token', 'foo', '--collapse-threshold', '2']
+        purge.return_value = 'cmu34ctmy3408xmy'
+        command = Command()
+        purge.assert_called_once_with('x1x2x3x4', [
+            {"url": "//cdn.foo.com/a/", "purgeAllDynamic": False, "recursive": True, "invalidateOnly": False},
+            {"url": "//cdn.foo.com/b.js", "purgeAllDynamic": False, "recursive": False, "invalidateOnly": False},
+        ])
+        self.assertIn('Read 3 urls', sys.stderr.getvalue())
+
+    @patch('striketracker.APIClient.purge')
+    def test_purge_dry_run(self, purge):
+        sys.stdin.write('//cdn.foo.com/a/1.js\n//cdn.foo.com/a/2.js\n')
+        sys.stdin.seek(0)
+        sys.argv = ['striketracker', 'purge', 'x1x2x3x4', '--token', 'foo', '--dry-run']
+        command = Command()
+        self.assertFalse(purge.called)
+        self.assertEqual(['//cdn.foo.com/a/1.js', '//cdn.foo.com/a/2.js'],
+                         [json.loads(line)['url'] for line in sys.stdout.getvalue().splitlines()])
+        self.assertIn('leaving 2 purges', sys.stderr.getvalue())
+
+    @patch('striketracker.APIClient.purge_status')
+    @patch('striketracker.APIClient.purge')
+    def test_purge_resume(self, purge, purge_status):
+        fd, journal = mkstemp()
+        os.close(fd)
+        urls = ''.join('//cdn.foo.com/%d.js\n' % i for i in range(3))
+        try:
+            sys.stdin.write(urls)
+            sys.stdin.seek(0)
+            sys.argv = ['striketracker', 'purge', 'x1x2x3x4', '--token', 'foo', '--batch-size', '1', '--workers', '1',
+                        '--retries', '0', '--journal', journal, '--poll']
+            purge.side_effect = ['job1', 'job2', APIError('Could not send purge batch', None)]
+            purge_status.return_value = 1.0
+            with self.assertRaises(SystemExit):
+                command = Command()
+
+            sys.stdin = StringIO(urls)
+            sys.argv += ['--resume']
+            purge.side_effect = ['job3']
+            purge_status.reset_mock()
+            command = Command()
+            purge.assert_called_with('x1x2x3x4', [
+                {"url": "//cdn.foo.com/2.js", "purgeAllDynamic": False, "recursive": False, "invalidateOnly": False}])
+            self.assertEqual(sorted(['job1', 'job2', 'job3']),
+                             sorted(call[0][1] for call in purge_status.call_args_list))
+            self.assertIn('2 of them by an earlier run', sys.stderr.getvalue())
+
+            # Finished jobs are not polled again
+            sys.stdin = StringIO(urls)
+            purge_status.reset_mock()
+            command = Command()
+            self.assertFalse(purge_status.called)
+
+            sys.argv[sys.argv.index('--batch-size') + 1] = '2'
+            with self.assertRaises(SystemExit):
+                command = Command()
+            self.assertIn('Journal was written by a purge with different settings', sys.stderr.getvalue())
+        finally:
+            os.unlink(journal)
 
     @patch('striketracker.APIClient.purge_status')
     def test_purge_status(self, purge_status):
@@ -517,4 +668,285 @@ updatedDate: '2016-04-12 11:22:18'
         get_configuration.side_effect = APIError('Could not fetch host', {})
 
         with self.assertRaises(SystemExit) as e:
-            command = Command()
\ No newline at end of file
+            command = Command()
+
+    @patch('striketracker.APIClient.purge')
+    def test_purge_batches(self, purge):
+        sys.argv = ['striketracker', 'purge', 'x1x2x3x4', '--token', 'foobarwinniethefoobar', '--batch-size', '2']
+        sys.stdin.write('//cdn.foo.com/main.js\n//cdn.foo.com/main.css\n//cdn.foo.com/logo.png')
+        sys.stdin.seek(0)
+        purge.side_effect = lambda account, urls: 'job-' + urls[0]['url']
+        command = Command()
+        self.assertEqual(2, purge.call_count)
+        self.assertEqual('job-//cdn.foo.com/main.js\njob-//cdn.foo.com/logo.png\n', sys.stdout.getvalue())
+
+    @patch('striketracker.APIClient.purge')
+    def test_purge_batches_fail(self, purge):
+        sys.argv = ['striketracker', 'purge', 'x1x2x3x4', '--token', 'foobarwinniethefoobar', '--batch-size', '2',
+                    '--retries', '0']
+        sys.stdin.write('//cdn.foo.com/main.js\n//cdn.foo.com/main.css\n//cdn.foo.com/logo.png')
+        sys.stdin.seek(0)
+
+        def send(account, urls):
+            if len(urls) == 1:
+                raise APIError('Could not send purge batch', None)
+            return 'cmu34ctmy3408xmy'
+        purge.side_effect = send
+        with self.assertRaises(SystemExit):
+            command = Command()
+        self.assertEqual('cmu34ctmy3408xmy\n', sys.stdout.getvalue())
+        self.assertIn('Could not send purge batch\nSubmitted 2 of 3 urls in 1 of 2 batches\n', sys.stderr.getvalue())
+
+    @patch('striketracker.APIClient.update_configuration')
+    @patch('striketracker.APIClient.get_configuration')
+    @patch('striketracker.APIClient.create_scope')
+    @patch('striketracker.APIClient.create_host')
+    @patch('striketracker.APIClient.get_host')
+    @patch('striketracker.ConfigurationCache.get')
+    def test_clone_host_scope_fails(self, get, get_host, create_host, create_scope, get_configuration,
+                                    update_configuration):
+        sys.argv = ['striketracker', 'clone_host', 'y1y2y3y4', 'x1x2x3x4', '--workers', '1']
+        get.return_value = 'cachedtoken'
+        get_host.return_value = {
+            "name": "test host",
+            "services": [],
+            "scopes": [
+                {"id": 2746294, "platform": "CDS", "path": "/"},
+                {"id": 2746295, "platform": "ALL", "path": "/"}
+            ]
+        }
+        create_host.return_value = {"name": "test host (copy)", "hashCode": "c1c2c3c4"}
+        get_configuration.side_effect = [APIError('Could not fetch configuration', None), {
+            "scope": {"id": 2746295, "platform": "ALL", "path": "/"},
+            "originPullHost": {"id": 92846, "primary": 1234}
+        }]
+        create_scope.return_value = {"id": 2746297, "platform": "ALL", "path": "/"}
+        update_configuration.side_effect = lambda account, host, scope, configuration: configuration
+
+        with self.assertRaises(SystemExit):
+            command = Command()
+        update_configuration.assert_called_once_with('y1y2y3y4', 'c1c2c3c4', 2746297, {
+            "originPullHost": {"primary": 1234}
+        })
+        self.assertIn("ALL\t/\noriginPullHost:\n  primary: 1234\n", sys.stdout.getvalue())
+        self.assertEqual("CDS\t/\tCould not fetch configuration\nCould not clone 1 of 2 scopes\n",
+                         sys.stderr.getvalue())
+
+    @patch('striketracker.clone.BulkCloner.clone')
+    def test_bulk_clone(self, clone):
+        sys.argv = ['striketracker', 'bulk_clone', '--token', 'foobarwinniethefoobar', '--rate', '50']
+        sys.stdin.write('y1y2y3y4,x1x2x3x4,z1z2z3z4,new host\n')
+        sys.stdin.seek(0)
+        clone.side_effect = lambda rows: [dict(row, hashCode='c1c2c3c4', scopes=2, failedScopes=[], error=None)
+                                          for row in rows]
+        command = Command()
+        self.assertEqual(50, command.client.rate_limiter.rate)
+        self.assertEqual('{"account": "y1y2y3y4", "error": null, "failedScopes": [], "hashCode": "c1c2c3c4", '
+                         '"host": "x1x2x3x4", "name": "new host", "scopes": 2, "target_account": "z1z2z3z4"}\n',
+                         sys.stdout.getvalue())
+
+    @patch('striketracker.clone.BulkCloner.clone')
+    def test_bulk_clone_fails(self, clone):
+        sys.argv = ['striketracker', 'bulk_clone', '--token', 'foobarwinniethefoobar']
+        sys.stdin.write('y1y2y3y4,x1x2x3x4\n')
+        sys.stdin.seek(0)
+        clone.side_effect = lambda rows: [dict(row, hashCode=None, scopes=0, failedScopes=[],
+                                               error='Could not fetch host') for row in rows]
+        with self.assertRaises(SystemExit):
+            command = Command()
+        self.assertIn('"error": "Could not fetch host"', sys.stdout.getvalue())
+
+    def test_lazy_imports(self):
+        imported = subprocess.check_output([sys.executable, '-c', (
+            'import sys; from striketracker import Command, APIClient, ConfigurationCache; APIClient(); '
+            'sys.stdout.write(",".join(sorted(set(["argparse", "getpass", "requests", "yaml"]) & set(sys.modules))))'
+        )], cwd=os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+        self.assertEqual('', imported.strip())
+
+    def test_unknown_private_command(self):
+        sys.argv = ['striketracker', '_print']
+        command = Command()
+        self.assertIn('Unknown command: _print\n', sys.stderr.getvalue())
+
+    @patch('striketracker.APIClient.get_host')
+    def test_batch(self, get_host):
+        sys.argv = ['striketracker', 'batch', '--token', 'foobarwinniethefoobar']
+        sys.stdin.write('{"id": 1, "method": "get_host", "params": ["y1y2y3y4", "x1x2x3x4"]}\n')
+        sys.stdin.seek(0)
+        get_host.return_value = {"name": "test host"}
+        command = Command()
+        get_host.assert_called_with('y1y2y3y4', 'x1x2x3x4')
+        self.assertEqual('{"error": null, "id": 1, "result": {"name": "test host"}}\n', sys.stdout.getvalue())
+
+    def test_batch_socket_not_a_socket(self):
+        # --socket naming an ordinary file by mistake must leave it alone
+        sys.argv = ['striketracker', 'batch', '--token', 'foobarwinniethefoobar', '--socket', self.cache]
+        with self.assertRaises(SystemExit):
+            Command()
+        self.assertEqual('%s exists and is not a socket\n' % self.cache, sys.stderr.getvalue())
+        self.assertTrue(os.path.exists(self.cache))
+
+    @responses.activate
+    def test_batch_pool_after_validation(self):
+        # Validating the saved token creates the session before the pool is sized for the workers
+        os.write(self.fd, 'token: foobar')
+        responses.add(responses.GET, 'https://striketracker.highwinds.com/api/v1/users/me',
+                      json={"id": 1, "accountHash": "x1x2x3x4"})
+        sys.argv = ['striketracker', 'batch', '--workers', '24']
+        command = Command(cache=self.cache)
+        self.assertEqual(1, len(responses.calls))
+        self.assertEqual(24, command.client.session.get_adapter('https://striketracker.highwinds.com')._pool_maxsize)
+
+    @patch('striketracker.APIClient.get_host')
+    def test_get_host_json(self, get_host):
+        get_host.return_value = {"name": "test host", "hashCode": "x1x2x3x4"}
+        sys.argv = ['striketracker', 'get_host', 'y1y2y3y4', 'x1x2x3x4', '--token', 'foo', '--output', 'json']
+        command = Command()
+        self.assertEqual('{\n  "hashCode": "x1x2x3x4",\n  "name": "test host"\n}\n', sys.stdout.getvalue())
+
+    @patch('striketracker.APIClient.me')
+    def test_me_jsonl(self, me):
+        me.return_value = {'firstName': 'Bob', 'lastName': 'Saget'}
+        sys.argv = ['striketracker', 'me', '--token', 'foo', '--output', 'jsonl']
+        command = Command()
+        self.assertEqual('{"firstName": "Bob", "lastName": "Saget"}\n', sys.stdout.getvalue())
+
+    def _clone_host_output(self, output):
+        sys.argv = ['striketracker', 'clone_host', 'y1y2y3y4', 'x1x2x3x4', '--token', 'foo', '--output', output]
+        with patch('striketracker.APIClient.get_host') as get_host, \
+                patch('striketracker.APIClient.create_host') as create_host, \
+                patch('striketracker.APIClient.get_configuration') as get_configuration, \
+                patch('striketracker.APIClient.create_scope') as create_scope, \
+                patch('striketracker.APIClient.update_configuration') as update_configuration:
+            get_host.return_value = {"name": "test host", "services": [], "scopes": [
+                {"id": 1, "platform": "CDS", "path": "/"}, {"id": 2, "platform": "ALL", "path": "/"}]}
+            create_host.return_value = {"name": "test host (copy)", "hashCode": "c1c2c3c4"}
+            get_configuration.side_effect = lambda account, host, scope: {"originPullHost": {"primary": scope}}
+            create_scope.side_effect = lambda account, host, scope: dict(scope, id=scope['platform'])
+            update_configuration.side_effect = lambda account, host, scope, configuration: configuration
+            Command()
+        return sys.stdout.getvalue()
+
+    def test_clone_host_json(self):
+        document = json.loads(self._clone_host_output('json'))
+        self.assertEqual('c1c2c3c4', document['host']['hashCode'])
+        self.assertEqual([{"primary": 1}, {"primary": 2}],
+                         [scope['configuration']['originPullHost'] for scope in document['scopes']])
+
+    def test_clone_host_jsonl(self):
+        lines = [json.loads(line) for line in self._clone_host_output('jsonl').splitlines()]
+        self.assertEqual(3, len(lines))
+        self.assertEqual('c1c2c3c4', lines[0]['host']['hashCode'])
+        self.assertEqual({"id": "ALL", "platform": "ALL", "path": "/"}, lines[2]['scope'])
+
+    def _diff_host_output(self, *args):
+        sys.argv = ['striketracker', 'diff_host', 'y1y2y3y4', 'x1x2x3x4', '--token', 'foo'] + list(args)
+        with patch('striketracker.APIClient.get_host') as get_host, \
+                patch('striketracker.APIClient.get_configuration') as get_configuration:
+            get_host.side_effect = lambda account, host: {"name": host, "hashCode": host, "scopes": [
+                {"id": host + "1", "platform": "CDS", "path": "/"}]}
+            get_configuration.side_effect = lambda account, host, scope: {
+                "originPullHost": {"primary": 1 if host == 'x1x2x3x4' else 2}}
+            try:
+                Command()
+            except SystemExit as e:
+                return e.code, sys.stdout.getvalue()
+        return None, sys.stdout.getvalue()
+
+    def test_diff_host(self):
+        code, output = self._diff_host_output('--to-host', 'c1c2c3c4', '--output', 'jsonl')
+        self.assertEqual(1, code)
+        self.assertEqual({"scope": "CDS /", "change": "changed", "path": "originPullHost.primary", "left": 1,
+                          "right": 2}, json.loads(output))
+
+    def test_diff_host_file(self):
+        with open(self.cache, 'w') as f:
+            f.write(json.dumps({"host": {}, "scopes": [
+                {"scope": {"id": 5, "platform": "CDS", "path": "/"},
+                 "configuration": {"originPullHost": {"primary": 1}}}]}))
+        code, output = self._diff_host_output('--file', self.cache, '--output', 'json')
+        self.assertEqual(None, code)
+        self.assertEqual('[]\n', output)
+
+    def test_diff_host_requires_target(self):
+        code, output = self._diff_host_output()
+        self.assertEqual(1, code)
+        self.assertIn('Supply exactly one of --to-host or --file', sys.stderr.getvalue())
+
+    @patch('striketracker.APIClient.get_host')
+    def test_diff_host_connection_error(self, get_host):
+        get_host.side_effect = requests.ConnectionError('Connection aborted')
+        sys.argv = ['striketracker', 'diff_host', 'y1y2y3y4', 'x1x2x3x4', '--to-host', 'c1c2c3c4', '--token', 'foo']
+        with self.assertRaises(SystemExit):
+            Command()
+        self.assertEqual('Connection aborted\n', sys.stderr.getvalue())
+
+    @patch('striketracker.APIClient.get_configuration')
+    @patch('striketracker.APIClient.get_host')
+    def test_get_host_with_configuration(self, get_host, get_configuration):
+        get_host.return_value = {"name": "test host", "scopes": [{"id": 1, "platform": "CDS", "path": "/"}]}
+        get_configuration.return_value = {"originPullHost": {"primary": 1}}
+        sys.argv = ['striketracker', 'get_host', 'y1y2y3y4', 'x1x2x3x4', '--token', 'foo', '--with-configuration',
+                    '--output', 'jsonl']
+        command = Command()
+        self.assertEqual({"host": get_host.return_value, "scopes": [
+            {"scope": {"id": 1, "platform": "CDS", "path": "/"}, "configuration": {"originPullHost": {"primary": 1}}}
+        ]}, json.loads(sys.stdout.getvalue()))
+
+    @patch('striketracker.APIClient.update_configuration')
+    @patch('striketracker.APIClient.create_scope')
+    @patch('striketracker.APIClient.get_configuration')
+    @patch('striketracker.APIClient.get_host')
+    def test_sync_host(self, get_host, get_configuration, create_scope, update_configuration):
+        sys.argv = ['striketracker', 'sync_host', 'y1y2y3y4', 'x1x2x3x4', 'c1c2c3c4', '--token', 'foo',
+                    '--output', 'jsonl']
+        get_host.side_effect = lambda account, host: {"scopes": [{"id": host + "1", "platform": "CDS", "path": "/"}] + (
+            [{"id": host + "2", "platform": "ALL", "path": "/"}] if host == 'x1x2x3x4' else [])}
+        get_configuration.return_value = {"originPullHost": {"primary": 1}}
+        create_scope.side_effect = lambda account, host, scope: dict(scope, id='new')
+        update_configuration.side_effect = lambda account, host, scope, configuration: configuration
+        command = Command()
+        self.assertEqual([{"platform": "CDS", "path": "/", "change": "unchanged"},
+                          {"platform": "ALL", "path": "/", "change": "created"}],
+                         [json.loads(line) for line in sys.stdout.getvalue().splitlines()])
+        update_configuration.assert_called_once_with('y1y2y3y4', 'c1c2c3c4', 'new', {"originPullHost": {"primary": 1}})
+        self.assertIn('Created 1, updated 0 and left 1 scopes unchanged', sys.stderr.getvalue())
+
+    @patch('striketracker.export.AccountExporter.export')
+    def test_export(self, export):
+        export.return_value = {"account": "y1y2y3y4", "hosts": 1, "scopes": 2, "fetched": 3, "unchanged": 0,
+                               "removed": 0, "errors": []}
+        sys.argv = ['striketracker', 'export', 'y1y2y3y4', '/tmp/export', '--token', 'foo', '--output', 'jsonl']
+        command = Command()
+        export.assert_called_with('y1y2y3y4')
+        self.assertEqual(export.return_value, json.loads(sys.stdout.getvalue()))
+
+    @patch('striketracker.export.AccountImporter.restore')
+    def test_restore(self, restore):
+        restore.return_value = [{"account": "z1z2z3z4", "host": "a1a2a3a4", "hashCode": None, "scopes": 0,
+                                 "failedScopes": [], "error": "Could not create host"}]
+        sys.argv = ['striketracker', 'restore', '/tmp/export', 'y1y2y3y4', '--to-account', 'z1z2z3z4',
+                    '--token', 'foo']
+        with self.assertRaises(SystemExit):
+            command = Command()
+        restore.assert_called_with('y1y2y3y4', 'z1z2z3z4', [])
+        self.assertIn('"error": "Could not create host"', sys.stdout.getvalue())
+
+    def test_query(self):
+        from striketracker.export import SnapshotStore
+        directory = tempfile.mkdtemp()
+        try:
+            SnapshotStore(directory).save('y1y2y3y4', {"host": {"hashCode": "x1x2x3x4", "name": "test host"}, "scopes": [
+                {"scope": {"id": 1, "platform": "CDS", "path": "/"}, "configuration": {"originPullHost": {"primary": 1}}}
+            ]})
+            sys.argv = ['striketracker', 'query', directory, 'originPullHost.primary=1', '--output', 'jsonl']
+            command = Command()
+            self.assertEqual({"account": "y1y2y3y4", "host": "x1x2x3x4", "name": "test host", "platform": "CDS",
+                              "path": "/"}, json.loads(sys.stdout.getvalue()))
+
+            sys.argv = ['striketracker', 'query', directory, 'originPullHost.primary<x']
+            with self.assertRaises(SystemExit):
+                command = Command()
+            self.assertIn('originPullHost.primary < requires a number', sys.stderr.getvalue())
+        finally:
+            shutil.rmtree(directory)
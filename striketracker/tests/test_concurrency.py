@@ -0,0 +1,73 @@
+import threading
+import time
+import unittest
+from striketracker.concurrency import Future, WorkerPool, parallel_map
+
+
+class TestFuture(unittest.TestCase):
+    def test_result(self):
+        future = Future()
+        callback = []
+        future.add_done_callback(callback.append)
+        self.assertFalse(future.done())
+        future.set_result(42)
+        self.assertTrue(future.done())
+        self.assertEqual(42, future.result())
+        self.assertEqual([future], callback)
+
+    def test_exception(self):
+        future = Future()
+        future.set_exception(ValueError('nope'))
+        self.assertIsInstance(future.exception(), ValueError)
+        with self.assertRaises(ValueError):
+            future.result()
+
+    def test_timeout(self):
+        with self.assertRaises(RuntimeError):
+            Future().result(timeout=0.01)
+
+
+class TestParallelMap(unittest.TestCase):
+    def test_ordered(self):
+        def slow(n):
+            time.sleep(0.01 * (5 - n))
+            return n * 2
+        self.assertEqual([0, 2, 4, 6, 8], [f.result() for n, f in parallel_map(slow, range(5), workers=5)])
+
+    def test_workers_joined(self):
+        before = set(threading.enumerate())
+        self.assertEqual([0, 1, 2, 3], [f.result() for n, f in parallel_map(lambda n: n, range(4), workers=4)])
+        self.assertEqual([], [thread for thread in threading.enumerate() if thread not in before and thread.is_alive()])
+
+    def test_errors(self):
+        results = list(parallel_map(lambda n: 1 / n, [1, 0, 2], workers=2))
+        self.assertEqual(1, results[0][1].result())
+        self.assertIsInstance(results[1][1].exception(), ZeroDivisionError)
+
+    def test_bounded(self):
+        consumed = []
+
+        def source():
+            for n in range(100):
+                consumed.append(n)
+                yield n
+        results = parallel_map(lambda n: n, source(), workers=2)
+        next(results)
+        self.assertLessEqual(len(consumed), 4)
+        results.close()
+
+    def test_pool_concurrency(self):
+        pool = WorkerPool(3)
+        barrier = threading.Semaphore(0)
+        release = threading.Event()
+
+        def task():
+            barrier.release()
+            release.wait()
+        futures = [pool.submit(task) for _ in range(3)]
+        for _ in range(3):
+            barrier.acquire()
+        release.set()
+        for future in futures:
+            future.result()
+        pool.shutdown()
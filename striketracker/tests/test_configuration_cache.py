@@ -1,17 +1,22 @@
+import errno
 import os
-from tempfile import mkstemp
+import shutil
+from tempfile import mkdtemp
+import threading
 import unittest
-from striketracker import ConfigurationCache
+from mock import patch
+from striketracker import ConfigurationCache, atomic_write
 
 
 class TestStrikeTrackerAPIClient(unittest.TestCase):
     def setUp(self):
-        self.fd, self.filename = mkstemp()
+        # A directory of its own, so that only this test's files are in it
+        self.directory = mkdtemp()
+        self.filename = os.path.join(self.directory, '.highwinds')
         self.cache = ConfigurationCache(filename=self.filename)
 
     def tearDown(self):
-        os.close(self.fd)
-        os.unlink(self.filename)
+        shutil.rmtree(self.directory)
 
     def test_lazy_get(self):
         token = self.cache.get('token')
@@ -27,4 +32,75 @@ class TestStrikeTrackerAPIClient(unittest.TestCase):
     def test_set(self):
         self.cache.set('token', 'bar')
         with open(self.filename, 'r') as f:
-            self.assertEqual('token: bar\n', f.read())
\ No newline at end of file
+            self.assertEqual('token: bar\n', f.read())
+
+    def test_set_preserves_other_keys(self):
+        self.cache.set('token', 'bar')
+        self.cache.set('account', 'x1x2x3x4')
+        self.assertEqual({'account': 'x1x2x3x4', 'token': 'bar'}, ConfigurationCache(self.filename).read())
+
+    def test_update(self):
+        self.cache.set('profiles', {'staging': {'token': 'foo'}})
+        self.cache.update('profiles', lambda profiles: dict(profiles, production={'token': 'bar'}))
+        self.cache.update('missing', lambda value: [value])
+        self.assertEqual({'profiles': {'staging': {'token': 'foo'}, 'production': {'token': 'bar'}}, 'missing': [None]},
+                         ConfigurationCache(self.filename).read())
+
+    def test_set_atomic(self):
+        self.cache.set('token', 'bar')
+        self.assertEqual(0o600, os.stat(self.filename).st_mode & 0o777)
+        self.assertEqual(['.highwinds'], [name for name in os.listdir(self.directory) if name != '.highwinds.lock'])
+
+    @patch('os.name', 'nt')
+    def test_set_replaces_on_windows(self):
+        rename = os.rename
+
+        def windows_rename(source, destination):
+            if os.path.exists(destination):
+                raise OSError(errno.EEXIST, 'Cannot create a file when that file already exists')
+            rename(source, destination)
+        self.cache.set('token', 'foo')
+        with patch('os.rename', side_effect=windows_rename):
+            self.cache.set('token', 'bar')
+        self.assertEqual({'token': 'bar'}, ConfigurationCache(self.filename).read())
+
+    def test_atomic_write_fsyncs(self):
+        with patch('os.fsync') as fsync:
+            atomic_write(self.filename, 'token: bar\n')
+        self.assertTrue(fsync.called)
+        with open(self.filename, 'r') as f:
+            self.assertEqual('token: bar\n', f.read())
+
+    def test_atomic_write_cleans_up(self):
+        atomic_write(self.filename, 'token: foo\n')
+        with patch('os.fsync', side_effect=OSError(errno.EIO, 'Input/output error')):
+            self.assertRaises(OSError, atomic_write, self.filename, 'token: bar\n')
+        self.assertEqual(['.highwinds'], os.listdir(self.directory))
+        with open(self.filename, 'r') as f:
+            self.assertEqual('token: foo\n', f.read())
+
+    def test_set_merges_concurrent_writers(self):
+        def write(index):
+            ConfigurationCache(self.filename).set('key%d' % index, index)
+        threads = [threading.Thread(target=write, args=(index,)) for index in range(10)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(dict(('key%d' % index, index) for index in range(10)),
+                         ConfigurationCache(self.filename).read())
+
+    def test_read_skips_unchanged(self):
+        with open(self.filename, 'w') as f:
+            f.write('token: foo')
+        self.cache.read()
+        with patch('yaml.load') as load:
+            self.assertEqual({'token': 'foo'}, self.cache.read())
+            self.assertFalse(load.called)
+        os.utime(self.filename, (0, 0))
+        with open(self.filename, 'w') as f:
+            f.write('token: bar')
+        self.assertEqual({'token': 'bar'}, self.cache.read())
+
+    def test_read_missing(self):
+        self.assertEqual({}, ConfigurationCache(self.filename + '.missing').read())
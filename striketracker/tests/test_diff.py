@@ -0,0 +1,74 @@
+import unittest
+from striketracker import APIClient, APIError
+from striketracker.diff import diff_host, diff_snapshots, diff_values, host_snapshot
+from striketracker.tests.fakeserver import FakeStrikeTrackerServer
+
+
+class TestDiffValues(unittest.TestCase):
+    def test_equal(self):
+        self.assertEqual([], list(diff_values({"a": [1, {"b": 2}]}, {"a": [1, {"b": 2}]})))
+
+    def test_nested(self):
+        left = {"originPullHost": {"primary": 1}, "cacheControl": [{"maxAge": 600}], "gzip": {"enabled": True}}
+        right = {"originPullHost": {"primary": 2}, "cacheControl": [{"maxAge": 600}, {"maxAge": 1}],
+                 "compression": {"gzip": "txt"}}
+        self.assertEqual([
+            ('added', 'cacheControl[1]', None, {"maxAge": 1}),
+            ('added', 'compression', None, {"gzip": "txt"}),
+            ('removed', 'gzip', {"enabled": True}, None),
+            ('changed', 'originPullHost.primary', 1, 2),
+        ], list(diff_values(left, right)))
+
+    def test_type_changed(self):
+        self.assertEqual([('changed', 'a', [1], {"b": 1})], list(diff_values({"a": [1]}, {"a": {"b": 1}})))
+
+
+class TestDiffSnapshots(unittest.TestCase):
+    def test_scopes_matched_by_platform_and_path(self):
+        left = {"host": {}, "scopes": [
+            {"scope": {"id": 1, "platform": "CDS", "path": "/"},
+             "configuration": {"scope": {"id": 1}, "originPullHost": {"id": 5, "primary": 1}}},
+            {"scope": {"id": 2, "platform": "CDS", "path": "/old"}, "configuration": {}},
+        ]}
+        right = {"host": {}, "scopes": [
+            {"scope": {"id": 9, "platform": "CDS", "path": "/new"}, "configuration": {}},
+            {"scope": {"id": 8, "platform": "CDS", "path": "/"},
+             "configuration": {"scope": {"id": 8}, "originPullHost": {"id": 6, "primary": 1}}},
+        ]}
+        self.assertEqual([
+            {"scope": "CDS /old", "change": "removed", "path": "", "left": {}, "right": None},
+            {"scope": "CDS /new", "change": "added", "path": "", "left": None, "right": {}},
+        ], diff_snapshots(left, right))
+
+
+class TestDiffHost(unittest.TestCase):
+    def setUp(self):
+        self.server = FakeStrikeTrackerServer().start()
+        self.client = APIClient(self.server.base_url, 'testtoken')
+        scopes = [{"platform": "CDS", "path": "/%d" % i} for i in range(10)]
+        self.server.add_host('y1y2y3y4', {"name": "left", "hashCode": "a1a2a3a4"}, scopes,
+                             [{"originPullHost": {"id": i, "primary": i}} for i in range(10)])
+        self.server.add_host('z1z2z3z4', {"name": "right", "hashCode": "b1b2b3b4"}, scopes,
+                             [{"originPullHost": {"id": 100 + i, "primary": i if i != 4 else 40}} for i in range(10)])
+
+    def tearDown(self):
+        self.client.close()
+        self.server.stop()
+
+    def test_host_snapshot(self):
+        snapshot = host_snapshot(self.client, 'y1y2y3y4', 'a1a2a3a4', workers=4)
+        self.assertEqual('left', snapshot['host']['name'])
+        self.assertEqual(['/%d' % i for i in range(10)], [item['scope']['path'] for item in snapshot['scopes']])
+        self.assertEqual(7, snapshot['scopes'][7]['configuration']['originPullHost']['primary'])
+
+    def test_diff_host(self):
+        self.assertEqual([
+            {"scope": "CDS /4", "change": "changed", "path": "originPullHost.primary", "left": 4, "right": 40},
+        ], diff_host(self.client, 'y1y2y3y4', 'a1a2a3a4', 'z1z2z3z4', 'b1b2b3b4'))
+
+    def test_diff_same_host(self):
+        self.assertEqual([], diff_host(self.client, 'y1y2y3y4', 'a1a2a3a4', 'y1y2y3y4', 'a1a2a3a4'))
+
+    def test_diff_host_missing(self):
+        with self.assertRaises(APIError):
+            diff_host(self.client, 'y1y2y3y4', 'a1a2a3a4', 'z1z2z3z4', 'c1c2c3c4')
@@ -0,0 +1,132 @@
+import shutil
+import tempfile
+import unittest
+from mock import patch
+import requests
+from striketracker import APIClient
+from striketracker.diff import diff_snapshots, host_snapshot
+from striketracker.export import AccountExporter, AccountImporter, SnapshotStore
+from striketracker.tests.fakeserver import FakeStrikeTrackerServer
+
+
+class TestSnapshotStore(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.store = SnapshotStore(self.directory)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_save_load(self):
+        snapshot = {"host": {"hashCode": "a1a2a3a4"}, "etag": '"x"', "scopes": []}
+        self.assertEqual(None, self.store.load('y1y2y3y4', 'a1a2a3a4'))
+        self.store.save('y1y2y3y4', snapshot)
+        self.assertEqual(snapshot, self.store.load('y1y2y3y4', 'a1a2a3a4'))
+        self.assertEqual(['a1a2a3a4'], self.store.hosts('y1y2y3y4'))
+        self.assertEqual(['y1y2y3y4'], self.store.accounts())
+        self.store.remove('y1y2y3y4', 'a1a2a3a4')
+        self.assertEqual([], self.store.hosts('y1y2y3y4'))
+
+
+class TestAccountExporter(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.store = SnapshotStore(self.directory)
+        self.server = FakeStrikeTrackerServer().start()
+        self.client = APIClient(self.server.base_url, 'testtoken')
+        for index in range(3):
+            self.server.add_host('y1y2y3y4', {"name": "host %d" % index, "hashCode": "a%d" % index, "services": []},
+                                 [{"platform": "CDS", "path": "/%d" % i} for i in range(4)],
+                                 [{"originPullHost": {"id": i, "primary": index * 10 + i}} for i in range(4)])
+
+    def tearDown(self):
+        self.client.close()
+        self.server.stop()
+        shutil.rmtree(self.directory)
+
+    def test_export(self):
+        result = AccountExporter(self.client, self.store, workers=4).export('y1y2y3y4')
+        self.assertEqual({"account": "y1y2y3y4", "hosts": 3, "scopes": 12, "fetched": 15, "unchanged": 0,
+                          "removed": 0, "errors": []}, result)
+        self.assertEqual(['a0', 'a1', 'a2'], self.store.hosts('y1y2y3y4'))
+        # Stored snapshots can be compared like those from get_host --with-configuration
+        self.assertEqual([], diff_snapshots(self.store.load('y1y2y3y4', 'a1'),
+                                            host_snapshot(self.client, 'y1y2y3y4', 'a1')))
+
+    def test_export_incremental(self):
+        exporter = AccountExporter(self.client, self.store)
+        exporter.export('y1y2y3y4')
+        host = self.client.get_host('y1y2y3y4', 'a1')
+        self.client.update_configuration('y1y2y3y4', 'a1', host['scopes'][2]['id'], {"originPullHost": {"primary": 99}})
+        del self.server.hosts[('y1y2y3y4', 'a2')]
+
+        result = exporter.export('y1y2y3y4')
+        self.assertEqual((2, 1, 9, 1), (result['hosts'], result['fetched'], result['unchanged'], result['removed']))
+        self.assertEqual(['a0', 'a1'], self.store.hosts('y1y2y3y4'))
+        configuration = self.store.load('y1y2y3y4', 'a1')['scopes'][2]['configuration']
+        self.assertEqual(99, configuration['originPullHost']['primary'])
+
+    def test_export_host_fails(self):
+        exporter = AccountExporter(self.client, self.store)
+        exporter.export('y1y2y3y4')
+        host = self.client.get_host('y1y2y3y4', 'a1')
+        self.client.update_configuration('y1y2y3y4', 'a1', host['scopes'][0]['id'], {"originPullHost": {"primary": 99}})
+        del self.server.configurations[('a1', str(host['scopes'][3]['id']))]
+
+        result = exporter.export('y1y2y3y4')
+        self.assertEqual([{"host": "a1", "error": "Could not fetch configuration"}], result['errors'])
+        # The failed host keeps its previous snapshot
+        configuration = self.store.load('y1y2y3y4', 'a1')['scopes'][0]['configuration']
+        self.assertEqual(10, configuration['originPullHost']['primary'])
+
+    def test_export_connection_error(self):
+        request = self.client.session.request
+
+        def drop(method, url, **kwargs):
+            if '/hosts/a1/configuration/' in url:
+                raise requests.ConnectionError('Connection aborted')
+            return request(method, url, **kwargs)
+        with patch.object(self.client.session, 'request', side_effect=drop):
+            result = AccountExporter(self.client, self.store).export('y1y2y3y4')
+        self.assertEqual([{"host": "a1", "error": "Connection aborted"}], result['errors'])
+        self.assertEqual(['a0', 'a2'], self.store.hosts('y1y2y3y4'))
+
+
+class TestAccountImporter(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.store = SnapshotStore(self.directory)
+        self.server = FakeStrikeTrackerServer().start()
+        self.client = APIClient(self.server.base_url, 'testtoken')
+        self.server.add_host('y1y2y3y4', {"name": "test host", "hashCode": "a1a2a3a4", "services": []},
+                             [{"platform": "CDS", "path": "/%d" % i} for i in range(5)],
+                             [{"originPullHost": {"id": i, "primary": i}} for i in range(5)])
+        AccountExporter(self.client, self.store).export('y1y2y3y4')
+
+    def tearDown(self):
+        self.client.close()
+        self.server.stop()
+        shutil.rmtree(self.directory)
+
+    def test_restore(self):
+        results = list(AccountImporter(self.client, self.store).restore('y1y2y3y4', 'z1z2z3z4'))
+        self.assertEqual(1, len(results))
+        self.assertEqual((None, 5, []), (results[0]['error'], results[0]['scopes'], results[0]['failedScopes']))
+        self.assertEqual([], diff_snapshots(self.store.load('y1y2y3y4', 'a1a2a3a4'),
+                                            host_snapshot(self.client, 'z1z2z3z4', results[0]['hashCode'])))
+
+    def test_restore_missing(self):
+        results = list(AccountImporter(self.client, self.store).restore('y1y2y3y4', hosts=['b1b2b3b4']))
+        self.assertEqual('Could not read snapshot', results[0]['error'])
+
+    def test_restore_connection_error(self):
+        request = self.client.session.request
+
+        def drop(method, url, **kwargs):
+            if method == 'PUT':
+                raise requests.ConnectionError('Connection aborted')
+            return request(method, url, **kwargs)
+        with patch.object(self.client.session, 'request', side_effect=drop):
+            results = list(AccountImporter(self.client, self.store).restore('y1y2y3y4', 'z1z2z3z4'))
+        self.assertEqual(0, results[0]['scopes'])
+        self.assertEqual(['Connection aborted'] * 5, [scope['error'] for scope in results[0]['failedScopes']])
@@ -0,0 +1,84 @@
+from StringIO import StringIO
+import unittest
+import requests
+import responses
+from mock import patch
+from striketracker import APIClient, APIError
+from striketracker.instrumentation import LatencyHistogram, RequestEvent
+from striketracker.retry import RetryPolicy
+from striketracker.tests.fakeserver import FakeStrikeTrackerServer
+
+
+class TestRequestHooks(unittest.TestCase):
+    def setUp(self):
+        self.server = FakeStrikeTrackerServer().start()
+        self.server.add_host('y1y2y3y4', {"name": "test host", "hashCode": "x1x2x3x4", "services": []},
+                             [{"platform": "CDS", "path": "/"}])
+        self.events = []
+        self.client = APIClient(self.server.base_url, 'testtoken', hooks=[self.events.append])
+
+    def tearDown(self):
+        self.client.close()
+        self.server.stop()
+
+    def test_events(self):
+        self.client.get_host('y1y2y3y4', 'x1x2x3x4')
+        self.client.purge('y1y2y3y4', [{"url": "//cdn.foo.com/main.js"}])
+        self.assertEqual([('GET', '/api/v1/accounts/{account}/hosts/{host}', 200),
+                          ('POST', '/api/v1/accounts/{account_hash}/purge', 200)],
+                         [(event.method, event.endpoint, event.status) for event in self.events])
+        get, post = self.events
+        self.assertEqual(self.server.base_url + '/api/v1/accounts/y1y2y3y4/hosts/x1x2x3x4', get.url)
+        self.assertEqual(0, get.sent)
+        self.assertGreater(get.received, 0)
+        self.assertGreater(post.sent, 0)
+        self.assertLessEqual(get.elapsed, get.duration)
+        self.assertFalse(get.failed)
+
+    def test_failed(self):
+        with self.assertRaises(APIError):
+            self.client.get_host('y1y2y3y4', 'nothere')
+        self.assertEqual(404, self.events[0].status)
+        self.assertTrue(self.events[0].failed)
+
+    @responses.activate
+    @patch('time.sleep')
+    def test_retries(self, sleep):
+        client = APIClient('http://127.0.0.1', 'testtoken', retry=RetryPolicy(retries=2), hooks=[self.events.append])
+        responses.add(responses.GET, 'http://127.0.0.1/api/v1/users/me', body=requests.ConnectionError('refused'))
+        responses.add(responses.GET, 'http://127.0.0.1/api/v1/users/me', status=503)
+        responses.add(responses.GET, 'http://127.0.0.1/api/v1/users/me', json={'id': 1}, status=200)
+        client.me()
+        self.assertEqual([(0, None), (1, 503), (2, 200)], [(event.attempt, event.status) for event in self.events])
+        self.assertEqual('refused', str(self.events[0].error))
+        self.assertTrue(self.events[0].failed)
+
+
+class TestLatencyHistogram(unittest.TestCase):
+    def test_report(self):
+        histogram = LatencyHistogram()
+        for duration in (0.003, 0.004, 0.004, 0.012, 0.150):
+            histogram(RequestEvent('GET', '/api/v1/users/me', 'http://127.0.0.1/api/v1/users/me', status=200,
+                                   received=10, duration=duration))
+        histogram(RequestEvent('GET', '/api/v1/users/me', 'http://127.0.0.1/api/v1/users/me', status=500,
+                               duration=0.004))
+        histogram.record('yaml output', 0.0005)
+        stream = StringIO()
+        histogram.report(stream, width=6)
+        self.assertEqual(
+            'GET /api/v1/users/me: 6 calls, 1 failed, 0 bytes sent, 50 received\n'
+            '  p50 4.0 ms, p99 150.0 ms, max 150.0 ms\n'
+            '      < 5 ms |####   4\n'
+            '     < 10 ms |       0\n'
+            '     < 20 ms |#      1\n'
+            '     < 50 ms |       0\n'
+            '    < 100 ms |       0\n'
+            '    < 200 ms |#      1\n'
+            'yaml output: 1 calls, 0 failed, 0 bytes sent, 0 received\n'
+            '  p50 0.5 ms, p99 0.5 ms, max 0.5 ms\n'
+            '      < 1 ms |###### 1\n', stream.getvalue())
+
+    def test_report_empty(self):
+        stream = StringIO()
+        LatencyHistogram().report(stream)
+        self.assertEqual('', stream.getvalue())
@@ -0,0 +1,136 @@
+import socket
+import unittest
+import requests
+from striketracker import APIClient, APIError
+from striketracker.instrumentation import RequestEvent
+from striketracker.metrics import Metrics, PrometheusMetrics, StatsdMetrics
+from striketracker.tests.fakeserver import FakeStrikeTrackerServer
+
+
+class TestPrometheusMetrics(unittest.TestCase):
+    def setUp(self):
+        self.server = FakeStrikeTrackerServer().start()
+        self.server.add_host('y1y2y3y4', {"name": "test host", "hashCode": "x1x2x3x4", "services": []})
+        self.metrics = PrometheusMetrics()
+        self.client = APIClient(self.server.base_url, 'testtoken', hooks=[self.metrics])
+
+    def tearDown(self):
+        self.client.close()
+        self.server.stop()
+
+    def test_requests(self):
+        self.client.get_host('y1y2y3y4', 'x1x2x3x4')
+        self.client.get_host('y1y2y3y4', 'x1x2x3x4')
+        with self.assertRaises(APIError):
+            self.client.get_host('y1y2y3y4', 'nothere')
+        text = self.metrics.render()
+        self.assertIn('# TYPE striketracker_requests_total counter\n', text)
+        self.assertIn('striketracker_requests_total{method="GET",endpoint="/api/v1/accounts/{account}/hosts/{host}",'
+                      'status="200"} 2\n', text)
+        self.assertIn('striketracker_request_errors_total{method="GET",'
+                      'endpoint="/api/v1/accounts/{account}/hosts/{host}",error="Could not fetch host"} 1\n', text)
+        self.assertIn('# TYPE striketracker_request_duration_seconds histogram\n', text)
+        self.assertIn('striketracker_request_duration_seconds_bucket{method="GET",'
+                      'endpoint="/api/v1/accounts/{account}/hosts/{host}",le="+Inf"} 3\n', text)
+        self.assertIn('striketracker_request_duration_seconds_count{method="GET",'
+                      'endpoint="/api/v1/accounts/{account}/hosts/{host}"} 3\n', text)
+
+    def test_purge(self):
+        job_id = self.client.purge('y1y2y3y4', [{"url": "//cdn.foo.com/1.js"}, {"url": "//cdn.foo.com/2.js"}])
+        self.assertIn('striketracker_purge_urls_total 2\n', self.metrics.render())
+        self.client.purge_status('y1y2y3y4', job_id)
+        self.assertNotIn('striketracker_purge_job_duration_seconds', self.metrics.render())
+        self.client.purge_status('y1y2y3y4', job_id)
+        self.assertIn('striketracker_purge_job_duration_seconds_count 1\n', self.metrics.render())
+        # Polling a finished job again is not counted twice
+        self.client.purge_status('y1y2y3y4', job_id)
+        self.assertIn('striketracker_purge_job_duration_seconds_count 1\n', self.metrics.render())
+
+    def test_max_jobs(self):
+        self.metrics.max_jobs = 1
+        first = self.client.purge('y1y2y3y4', [{"url": "//cdn.foo.com/1.js"}])
+        self.client.purge('y1y2y3y4', [{"url": "//cdn.foo.com/2.js"}])
+        for _ in range(2):
+            self.client.purge_status('y1y2y3y4', first)
+        self.assertNotIn('striketracker_purge_job_duration_seconds', self.metrics.render())
+
+    def test_exception(self):
+        self.metrics(RequestEvent('GET', '/api/v1/users/me', 'http://127.0.0.1/api/v1/users/me',
+                                  error=requests.ConnectionError(), duration=0.2))
+        text = self.metrics.render()
+        self.assertIn('striketracker_requests_total{method="GET",endpoint="/api/v1/users/me",status=""} 1\n', text)
+        self.assertIn('striketracker_request_errors_total{method="GET",endpoint="/api/v1/users/me",'
+                      'error="no response"} 1\n', text)
+        self.assertIn('striketracker_request_duration_seconds_bucket{method="GET",endpoint="/api/v1/users/me",'
+                      'le="0.1"} 0\n', text)
+        self.assertIn('striketracker_request_duration_seconds_bucket{method="GET",endpoint="/api/v1/users/me",'
+                      'le="0.25"} 1\n', text)
+        self.assertIn('striketracker_request_duration_seconds_sum{method="GET",endpoint="/api/v1/users/me"} 0.2\n',
+                      text)
+
+    def test_retried(self):
+        self.metrics(RequestEvent('GET', '/api/v1/users/me', 'http://127.0.0.1/api/v1/users/me', status=503,
+                                  retried=True))
+        self.metrics(RequestEvent('GET', '/api/v1/users/me', 'http://127.0.0.1/api/v1/users/me', status=503,
+                                  api_error=APIError('Could not fetch user details', None)))
+        text = self.metrics.render()
+        self.assertIn('striketracker_requests_total{method="GET",endpoint="/api/v1/users/me",status="503"} 2\n', text)
+        self.assertIn('striketracker_request_errors_total{method="GET",endpoint="/api/v1/users/me",'
+                      'error="retried"} 1\n', text)
+        self.assertIn('striketracker_request_errors_total{method="GET",endpoint="/api/v1/users/me",'
+                      'error="Could not fetch user details"} 1\n', text)
+
+    def test_base_records_nothing(self):
+        client = APIClient(self.server.base_url, 'testtoken', hooks=[Metrics()])
+        self.assertEqual('test host', client.get_host('y1y2y3y4', 'x1x2x3x4')['name'])
+        client.close()
+
+    def test_serve(self):
+        self.client.get_host('y1y2y3y4', 'x1x2x3x4')
+        server = self.metrics.serve(0, '127.0.0.1')
+        try:
+            url = 'http://127.0.0.1:%d' % server.server_address[1]
+            response = requests.get(url + '/metrics')
+            self.assertEqual(200, response.status_code)
+            self.assertEqual(self.metrics.render(), response.text)
+            self.assertEqual(404, requests.get(url + '/other').status_code)
+        finally:
+            server.shutdown()
+            server.server_close()
+
+
+class TestStatsdMetrics(unittest.TestCase):
+    def setUp(self):
+        self.collector = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.collector.bind(('127.0.0.1', 0))
+        self.collector.settimeout(5)
+
+    def tearDown(self):
+        self.collector.close()
+
+    def test_push(self):
+        metrics = StatsdMetrics(port=self.collector.getsockname()[1], interval=60)
+        metrics(RequestEvent('GET', '/api/v1/accounts/{account}/hosts/{host}', 'http://127.0.0.1/', status=404,
+                             duration=0.0125, api_error=APIError('Could not fetch host', None)))
+        metrics.close()
+        self.assertEqual([
+            'striketracker.requests.GET.api_v1_accounts_account_hosts_host.404:1|c',
+            'striketracker.request_errors.GET.api_v1_accounts_account_hosts_host.Could_not_fetch_host:1|c',
+            'striketracker.request_duration.GET.api_v1_accounts_account_hosts_host:12.500|ms',
+        ], self.collector.recv(65536).decode('utf-8').split('\n'))
+
+    def test_packets(self):
+        metrics = StatsdMetrics(port=self.collector.getsockname()[1], prefix='p', interval=60, max_packet=40)
+        for _ in range(3):
+            metrics.increment('purge_urls', value=100)
+        metrics.close()
+        self.assertEqual('p.purge_urls:100|c\np.purge_urls:100|c', self.collector.recv(65536).decode('utf-8'))
+        self.assertEqual('p.purge_urls:100|c', self.collector.recv(65536).decode('utf-8'))
+
+    def test_interval(self):
+        metrics = StatsdMetrics(port=self.collector.getsockname()[1], interval=0.01)
+        try:
+            metrics.increment('purge_urls', value=5)
+            self.assertEqual('striketracker.purge_urls:5|c', self.collector.recv(65536).decode('utf-8'))
+        finally:
+            metrics.close()
@@ -0,0 +1,400 @@
+from StringIO import StringIO
+import itertools
+import os
+import tempfile
+import threading
+import unittest
+from mock import Mock, patch
+import responses
+from striketracker import APIClient, APIError
+from striketracker.concurrency import Future
+from striketracker.purge import batches, normalize_url, read_urls, BatchPurger, PurgeJournal, PurgeOptimizer, \
+    PurgePoller, PurgeQueue
+from striketracker.retry import RetryPolicy
+
+
+class TestBatches(unittest.TestCase):
+    def test_batches(self):
+        self.assertEqual([[0, 1, 2], [3, 4, 5], [6]], list(batches(range(7), 3)))
+
+    def test_batches_empty(self):
+        self.assertEqual([], list(batches([], 3)))
+
+
+class TestBatchPurger(unittest.TestCase):
+    def setUp(self):
+        self.client = Mock()
+        self.urls = [{"url": "//cdn.foo.com/%d.js" % i} for i in range(10)]
+
+    def test_submit(self):
+        self.client.purge.side_effect = lambda account, batch: 'job-%s' % batch[0]['url']
+        result = BatchPurger(self.client, 'x1x2x3x4', batch_size=3, workers=2).submit(iter(self.urls))
+        self.assertEqual(4, self.client.purge.call_count)
+        self.assertEqual(['job-//cdn.foo.com/0.js', 'job-//cdn.foo.com/3.js',
+                          'job-//cdn.foo.com/6.js', 'job-//cdn.foo.com/9.js'], result.job_ids)
+        self.assertEqual(10, result.submitted)
+        self.assertEqual(0, result.failed)
+        self.assertEqual('Submitted 10 of 10 urls in 4 of 4 batches', result.summary())
+
+    @responses.activate
+    def test_submit_retries(self):
+        # Only the client's policy retries, so a batch refused with 503 is sent 1 + 3 times in all
+        responses.add(responses.POST, 'http://127.0.0.1/api/v1/accounts/x1x2x3x4/purge', status=503,
+                      json={"error": "Service unavailable"})
+        client = APIClient('http://127.0.0.1', 'testtoken', retry=RetryPolicy(retries=3, backoff=0))
+        result = BatchPurger(client, 'x1x2x3x4').submit(self.urls)
+        self.assertEqual(4, len(responses.calls))
+        self.assertEqual(10, result.failed)
+
+    @responses.activate
+    def test_submit_not_replayed(self):
+        # A purge that failed with 500 may have been accepted, so it is not sent again
+        responses.add(responses.POST, 'http://127.0.0.1/api/v1/accounts/x1x2x3x4/purge', status=500,
+                      json={"error": "Could not send purge batch"})
+        client = APIClient('http://127.0.0.1', 'testtoken', retry=RetryPolicy(retries=3, backoff=0))
+        result = BatchPurger(client, 'x1x2x3x4', batch_size=5).submit(self.urls)
+        self.assertEqual(2, len(responses.calls))
+        self.assertEqual(10, result.failed)
+
+    def test_submit_fails(self):
+        def purge(account, batch):
+            if batch[0]['url'] == '//cdn.foo.com/5.js':
+                raise APIError('Could not send purge batch', None)
+            return 'job'
+        self.client.purge.side_effect = purge
+        result = BatchPurger(self.client, 'x1x2x3x4', batch_size=5).submit(self.urls)
+        self.assertEqual(2, self.client.purge.call_count)
+        self.assertEqual(['job'], result.job_ids)
+        self.assertEqual(5, result.submitted)
+        self.assertEqual(5, result.failed)
+        self.assertEqual(1, len(result.errors))
+        self.assertEqual('Submitted 5 of 10 urls in 1 of 2 batches', result.summary())
+
+    def test_submit_unexpected_error(self):
+        self.client.purge.side_effect = KeyError('id')
+        with self.assertRaises(KeyError):
+            BatchPurger(self.client, 'x1x2x3x4').submit(self.urls)
+
+
+class TestReadUrls(unittest.TestCase):
+    def test_normalize_url(self):
+        self.assertEqual('//cdn.foo.com/Main.js', normalize_url(' //CDN.foo.com/Main.js\n'))
+        self.assertEqual('http://cdn.foo.com/a//B', normalize_url('HTTP://cdn.Foo.com/a//B'))
+        self.assertEqual('/a//B', normalize_url('/a//B'))
+        self.assertEqual('https://cdn.foo.com/a', normalize_url('https://cdn.foo.com:443/a#top'))
+        self.assertEqual('http://cdn.foo.com:443/a', normalize_url('http://cdn.foo.com:443/a'))
+
+    def test_read_urls(self):
+        stream = StringIO('//cdn.foo.com/main.js\n\n//CDN.foo.com/main.js\n  //cdn.foo.com/main.css  \n')
+        self.assertEqual([
+            {"url": "//cdn.foo.com/main.js", "purgeAllDynamic": False, "recursive": True, "invalidateOnly": False},
+            {"url": "//cdn.foo.com/main.css", "purgeAllDynamic": False, "recursive": True, "invalidateOnly": False}
+        ], list(read_urls(stream, recursive=True)))
+
+    def test_read_urls_lazy(self):
+        stream = StringIO(''.join('//cdn.foo.com/%d.js\n' % i for i in range(1000)))
+        urls = read_urls(stream)
+        self.assertEqual('//cdn.foo.com/0.js', next(urls)['url'])
+        self.assertLess(stream.tell(), 100)
+
+    def test_read_urls_dedupe_window(self):
+        stream = StringIO('//cdn.foo.com/a\n//cdn.foo.com/b\n//cdn.foo.com/c\n//cdn.foo.com/b\n//cdn.foo.com/a\n')
+        self.assertEqual(['//cdn.foo.com/a', '//cdn.foo.com/b', '//cdn.foo.com/c', '//cdn.foo.com/a'],
+                         [url['url'] for url in read_urls(stream, dedupe_window=2)])
+
+    def test_streaming_submit(self):
+        client = Mock()
+        client.purge.return_value = 'job'
+        stream = StringIO(''.join('//cdn.foo.com/%d.js\n' % i for i in range(25)))
+        result = BatchPurger(client, 'x1x2x3x4', batch_size=10, workers=1).submit(read_urls(stream))
+        self.assertEqual(['job', 'job', 'job'], result.job_ids)
+        self.assertEqual(25, result.submitted)
+
+
+def entry(url, recursive=False, invalidate_only=False):
+    return {"url": url, "purgeAllDynamic": False, "recursive": recursive, "invalidateOnly": invalidate_only}
+
+
+class TestPurgeOptimizer(unittest.TestCase):
+    def test_dedupe(self):
+        optimizer = PurgeOptimizer()
+        self.assertEqual([entry('//cdn.foo.com/a/1.js'), entry('//cdn.foo.com/a/2.js'), entry('//cdn.foo.com/b.js')],
+                         list(optimizer.optimize([
+                             entry('//cdn.foo.com/b.js'), entry('//cdn.foo.com/a/2.js'), entry('//cdn.foo.com/a/1.js'),
+                             entry('//cdn.foo.com/a/2.js'), entry('//cdn.foo.com/b.js')])))
+        self.assertEqual((5, 2, 3), (optimizer.urls, optimizer.duplicates, optimizer.purges))
+
+    def test_options_kept_apart(self):
+        self.assertEqual([entry('//cdn.foo.com/a'), entry('//cdn.foo.com/a', invalidate_only=True)],
+                         list(PurgeOptimizer().optimize([entry('//cdn.foo.com/a', invalidate_only=True),
+                                                         entry('//cdn.foo.com/a')])))
+
+    def test_recursive_covers(self):
+        optimizer = PurgeOptimizer()
+        self.assertEqual([entry('//cdn.foo.com/a'), entry('//cdn.foo.com/a/', recursive=True),
+                          entry('//cdn.foo.com/b', recursive=True)],
+                         list(optimizer.optimize([
+                             entry('//cdn.foo.com/a/1.js'), entry('//cdn.foo.com/a/b/2.js'),
+                             entry('//cdn.foo.com/a/', recursive=True), entry('//cdn.foo.com/a/3.js'),
+                             entry('//cdn.foo.com/a'), entry('//cdn.foo.com/b'),
+                             entry('//cdn.foo.com/b', recursive=True),
+                             entry('//cdn.foo.com/b/c.js')])))
+        self.assertEqual((4, 1), (optimizer.covered, optimizer.duplicates))
+
+    def test_collapse(self):
+        urls = [entry('//cdn.foo.com/img/%d.png' % i) for i in range(5)] + \
+            [entry('//cdn.foo.com/js/%d.js' % i) for i in range(2)] + \
+            [entry('//cdn.foo.com/css/%s/%d.css' % (theme, i)) for theme in ('dark', 'light') for i in range(2)]
+        optimizer = PurgeOptimizer(threshold=3)
+        # css holds four urls, but only two directories directly
+        self.assertEqual([entry('//cdn.foo.com/css/dark/0.css'), entry('//cdn.foo.com/css/dark/1.css'),
+                          entry('//cdn.foo.com/css/light/0.css'), entry('//cdn.foo.com/css/light/1.css'),
+                          entry('//cdn.foo.com/img/', recursive=True),
+                          entry('//cdn.foo.com/js/0.js'), entry('//cdn.foo.com/js/1.js')],
+                         list(optimizer.optimize(urls)))
+        self.assertEqual(5, optimizer.collapsed)
+
+    def test_collapse_nested(self):
+        urls = [entry('//cdn.foo.com/a/b/%d.png' % i) for i in range(3)] + \
+            [entry('//cdn.foo.com/a/c/%d.png' % i) for i in range(2)] + \
+            [entry('//cdn.foo.com/a/d.png'), entry('//cdn.foo.com/a/e', recursive=True)]
+        optimizer = PurgeOptimizer(threshold=2)
+        self.assertEqual([entry('//cdn.foo.com/a/', recursive=True)], list(optimizer.optimize(urls)))
+        self.assertEqual('Read 7 urls: dropped 0 duplicates and 0 covered by recursive purges, collapsed 7 into '
+                         'recursive purges, leaving 1 purges', optimizer.summary())
+
+        optimizer = PurgeOptimizer(threshold=1)
+        self.assertEqual([entry('//cdn.foo.com/a/', recursive=True)],
+                         list(optimizer.optimize(entry('//cdn.foo.com/a/b/%d.png' % i) for i in range(3))))
+        self.assertEqual(3, optimizer.collapsed)
+
+    def test_collapse_never_purges_whole_host(self):
+        urls = [entry('//cdn.foo.com/%d.png' % i) for i in range(5)]
+        self.assertEqual(urls, list(PurgeOptimizer(threshold=3).optimize(urls)))
+        self.assertEqual([entry('//cdn.foo.com/', recursive=True)],
+                         list(PurgeOptimizer(threshold=3, min_depth=0).optimize(urls)))
+
+    def test_many_urls(self):
+        urls = (entry('//cdn.foo.com/%d/%d.png' % (i % 100, i)) for i in range(100000))
+        self.assertEqual(100, len(list(PurgeOptimizer(threshold=500).optimize(urls))))
+
+
+class TestPurgePoller(unittest.TestCase):
+    def setUp(self):
+        self.client = Mock()
+
+    @patch('time.sleep')
+    def test_poll(self, sleep):
+        statuses = {'job1': [0.5, 1.0], 'job2': [0.0, 0.2, 1.0]}
+        self.client.purge_status.side_effect = lambda account, job_id: statuses[job_id].pop(0)
+        updates = []
+        progress = PurgePoller(self.client, 'x1x2x3x4').poll(
+            ['job1', 'job2'], callback=lambda job_id, progress, overall: updates.append((job_id, progress, overall)))
+        self.assertEqual({'job1': 1.0, 'job2': 1.0}, progress)
+        self.assertEqual(5, self.client.purge_status.call_count)
+        self.assertEqual(('job1', 0.5, 0.25), updates[0])
+        self.assertEqual(('job2', 1.0, 1.0), updates[-1])
+
+    def test_poll_joins_workers(self):
+        self.client.purge_status.return_value = 1.0
+        before = set(threading.enumerate())
+        PurgePoller(self.client, 'x1x2x3x4', workers=4).poll(['job1', 'job2', 'job3'])
+        self.assertEqual([], [thread for thread in threading.enumerate() if thread not in before and thread.is_alive()])
+
+    @patch('time.sleep')
+    def test_poll_backoff(self, sleep):
+        poller = PurgePoller(self.client, 'x1x2x3x4', interval=0.1, max_interval=0.3, backoff=2.0)
+        job = {'progress': 0.5, 'polled': 10.0, 'interval': 0.1}
+        self.assertEqual(0.2, poller._next_interval(job, 0.5, 10.1))
+        job['interval'] = 0.2
+        self.assertEqual(0.3, poller._next_interval(job, 0.5, 10.3))
+        # Halfway to completion with 0.25 remaining at 0.5 progress per second
+        job['interval'] = 0.3
+        self.assertAlmostEqual(0.25, poller._next_interval(job, 0.75, 10.5))
+        self.assertAlmostEqual(0.1, poller._next_interval(job, 0.99, 10.5))
+
+    @responses.activate
+    def test_poll_retries(self):
+        responses.add(responses.GET, 'http://127.0.0.1/api/v1/accounts/x1x2x3x4/purge/job1', status=500,
+                      json={"error": "Could not fetch purge status"})
+        responses.add(responses.GET, 'http://127.0.0.1/api/v1/accounts/x1x2x3x4/purge/job1', json={"progress": 1.0})
+        client = APIClient('http://127.0.0.1', 'testtoken', retry=RetryPolicy(retries=3, backoff=0))
+        self.assertEqual({'job1': 1.0}, PurgePoller(client, 'x1x2x3x4').poll(['job1']))
+        self.assertEqual(2, len(responses.calls))
+
+    @responses.activate
+    def test_poll_fails(self):
+        responses.add(responses.GET, 'http://127.0.0.1/api/v1/accounts/x1x2x3x4/purge/job1', status=500,
+                      json={"error": "Could not fetch purge status"})
+        client = APIClient('http://127.0.0.1', 'testtoken', retry=RetryPolicy(retries=2, backoff=0))
+        with self.assertRaises(APIError):
+            PurgePoller(client, 'x1x2x3x4').poll(['job1'])
+        self.assertEqual(3, len(responses.calls))
+
+    def test_poll_timeout(self):
+        self.client.purge_status.return_value = 0.5
+        self.assertEqual({'job1': 0.5}, PurgePoller(self.client, 'x1x2x3x4').poll(['job1'], timeout=0.05))
+
+
+class TestPurgeQueue(unittest.TestCase):
+    def setUp(self):
+        self.client = Mock()
+        job_ids = itertools.count(1)
+        self.client.purge.side_effect = lambda account, batch: 'job%d' % next(job_ids)
+
+    def test_coalesce(self):
+        queue = PurgeQueue(self.client, max_delay=0.05)
+        futures = [queue.purge('x1x2x3x4', '//cdn.foo.com/%d.js' % (i % 5)) for i in range(20)]
+        self.assertEqual(['job1'] * 20, [future.result(timeout=1) for future in futures])
+        self.client.purge.assert_called_once_with('x1x2x3x4', [
+            {"url": "//cdn.foo.com/%d.js" % i, "purgeAllDynamic": False, "recursive": False, "invalidateOnly": False}
+            for i in range(5)])
+        queue.close()
+
+    def test_batch_by_account_and_options(self):
+        queue = PurgeQueue(self.client, max_delay=0.05)
+        futures = [queue.purge('x1x2x3x4', '//cdn.foo.com/a'), queue.purge('y1y2y3y4', '//cdn.foo.com/a'),
+                   queue.purge('x1x2x3x4', '//cdn.foo.com/b', recursive=True),
+                   queue.purge('x1x2x3x4', '//cdn.foo.com/c')]
+        queue.close()
+        job_ids = [future.result() for future in futures]
+        self.assertEqual(3, self.client.purge.call_count)
+        self.assertEqual(job_ids[0], job_ids[3])
+        self.assertEqual(3, len(set(job_ids)))
+
+    def test_max_batch(self):
+        queue = PurgeQueue(self.client, max_batch=10, max_delay=60)
+        futures = [queue.purge('x1x2x3x4', '//cdn.foo.com/%d.js' % i) for i in range(25)]
+        self.assertEqual(['job1'] * 10 + ['job2'] * 10, sorted(future.result(timeout=1) for future in futures[:20]))
+        self.assertFalse(futures[20].done())
+        queue.close()
+        self.assertEqual(3, self.client.purge.call_count)
+        self.assertTrue(futures[20].done())
+
+    def test_purge_fails(self):
+        self.client.purge.side_effect = APIError('Could not send purge batch', None)
+        queue = PurgeQueue(self.client, max_delay=0)
+        with self.assertRaises(APIError):
+            queue.purge('x1x2x3x4', '//cdn.foo.com/a.js').result(timeout=1)
+        queue.close()
+
+    def test_complete(self):
+        progress = {'job1': [0.0, 0.5, 1.0]}
+        self.client.purge_status.side_effect = lambda account, job_id: progress[job_id].pop(0)
+        queue = PurgeQueue(self.client, max_delay=0.05, poll_interval=0.01)
+        accepted = queue.purge('x1x2x3x4', '//cdn.foo.com/a.js')
+        completed = queue.purge('x1x2x3x4', '//cdn.foo.com/b.js', complete=True)
+        self.assertEqual('job1', accepted.result(timeout=1))
+        self.assertEqual('job1', completed.result(timeout=1))
+        self.assertEqual(3, self.client.purge_status.call_count)
+        queue.close()
+
+    def test_callback_runs_unlocked(self):
+        # A batch that has already been sent when its callback is attached calls back at once, which must happen
+        # without the queue's lock held, since callers' callbacks may wait on other threads that purge
+        queue = PurgeQueue(self.client, max_batch=2, max_delay=60)
+
+        def submit(fn, *args):
+            sent = Future()
+            sent.set_result(fn(*args))
+            return sent
+        queue.pool.submit = submit
+        purged = []
+
+        def purge_elsewhere(future):
+            thread = threading.Thread(target=lambda: purged.append(queue.purge('x1x2x3x4', '//cdn.foo.com/c.js')))
+            thread.start()
+            thread.join(1)
+        queue.purge('x1x2x3x4', '//cdn.foo.com/a.js').add_done_callback(purge_elsewhere)
+        queue.purge('x1x2x3x4', '//cdn.foo.com/b.js')
+        self.assertEqual(1, len(purged))
+        queue.close()
+        self.assertEqual('job2', purged[0].result())
+
+    def test_closed(self):
+        queue = PurgeQueue(self.client)
+        queue.close()
+        with self.assertRaises(RuntimeError):
+            queue.purge('x1x2x3x4', '//cdn.foo.com/a.js')
+
+
+class TestPurgeJournal(unittest.TestCase):
+    def setUp(self):
+        fd, self.filename = tempfile.mkstemp()
+        os.close(fd)
+        self.urls = [entry('//cdn.foo.com/%d.js' % i) for i in range(25)]
+        self.client = Mock()
+        job_ids = itertools.count(1)
+        self.client.purge.side_effect = lambda account, batch: 'job%d' % next(job_ids)
+
+    def tearDown(self):
+        os.unlink(self.filename)
+
+    def test_resume(self):
+        journal = PurgeJournal(self.filename)
+        journal.start({"account": "x1x2x3x4"})
+        purger = BatchPurger(self.client, 'x1x2x3x4', batch_size=10, workers=1)
+        # The first run dies after two batches
+        self.client.purge.side_effect = ['job1', 'job2', RuntimeError('Killed')]
+        with self.assertRaises(RuntimeError):
+            purger.submit(self.urls, journal=journal)
+        journal.polled('job1', 1.0)
+        journal.close()
+
+        self.client.purge.side_effect = ['job3']
+        journal = PurgeJournal(self.filename, resume=True)
+        journal.start({"account": "x1x2x3x4"})
+        result = purger.submit(self.urls, journal=journal)
+        self.assertEqual(['job1', 'job2', 'job3'], result.job_ids)
+        self.assertEqual((25, 20), (result.submitted, result.resumed))
+        self.client.purge.assert_called_with('x1x2x3x4', self.urls[20:])
+        self.assertEqual(['job2', 'job3'], journal.pending(result.job_ids))
+        journal.close()
+
+    def test_resume_changed_batch(self):
+        journal = PurgeJournal(self.filename)
+        BatchPurger(self.client, 'x1x2x3x4', batch_size=10, workers=1).submit(self.urls, journal=journal)
+        journal.close()
+
+        journal = PurgeJournal(self.filename, resume=True)
+        self.urls[15] = entry('//cdn.foo.com/changed.js')
+        result = BatchPurger(self.client, 'x1x2x3x4', batch_size=10, workers=1).submit(self.urls, journal=journal)
+        self.assertEqual(['job1', 'job4', 'job3'], result.job_ids)
+
+    def test_settings_must_match(self):
+        journal = PurgeJournal(self.filename)
+        journal.start({"account": "x1x2x3x4", "batch_size": 10})
+        journal.close()
+        journal = PurgeJournal(self.filename, resume=True)
+        with self.assertRaises(ValueError):
+            journal.start({"account": "x1x2x3x4", "batch_size": 20})
+
+    def test_truncated_line(self):
+        journal = PurgeJournal(self.filename)
+        journal.polled('job1', 0.5)
+        journal.close()
+        with open(self.filename, 'a') as f:
+            f.write('{"job": "job1", "prog')
+        self.assertEqual({'job1': 0.5}, dict(PurgeJournal(self.filename, resume=True).progress))
+
+    def test_write_after_truncated_line(self):
+        journal = PurgeJournal(self.filename)
+        journal.polled('job1', 0.5)
+        journal.close()
+        with open(self.filename, 'a') as f:
+            f.write('{"job": "job1", "prog')
+        journal = PurgeJournal(self.filename, resume=True)
+        journal.polled('job2', 0.25)
+        journal.close()
+        journal = PurgeJournal(self.filename, resume=True)
+        journal.polled('job3', 1.0)
+        journal.close()
+        self.assertEqual({'job1': 0.5, 'job2': 0.25, 'job3': 1.0},
+                         dict(PurgeJournal(self.filename, resume=True).progress))
+
+    def test_without_resume_starts_over(self):
+        journal = PurgeJournal(self.filename)
+        journal.polled('job1', 0.5)
+        journal.close()
+        self.assertEqual({}, dict(PurgeJournal(self.filename).progress))
+        self.assertEqual('', open(self.filename).read())
@@ -0,0 +1,119 @@
+import os
+import shutil
+import tempfile
+import unittest
+from mock import patch
+from striketracker.export import SnapshotStore
+from striketracker.query import ConfigurationIndex, configuration_fields, parse_expression
+
+
+def snapshot(hash_code, name, configurations):
+    return {"host": {"hashCode": hash_code, "name": name}, "scopes": [
+        {"scope": {"id": index, "platform": "CDS", "path": "/%d" % index}, "configuration": configuration}
+        for index, configuration in enumerate(configurations)]}
+
+
+class TestParseExpression(unittest.TestCase):
+    def test_operators(self):
+        self.assertEqual(('cacheControl.maxAge', '<=', 60), parse_expression('cacheControl.maxAge<=60'))
+        self.assertEqual(('originPullHost.primary', '!=', 1), parse_expression('originPullHost.primary!=1'))
+        self.assertEqual(('hostname.domain', '~', 'foo.com'), parse_expression('hostname.domain~foo.com'))
+        self.assertEqual(('a', '=', 'b=c'), parse_expression('a=b=c'))
+        self.assertEqual(('gzip', None, None), parse_expression('gzip'))
+
+    def test_invalid(self):
+        for expression in ('', '=1', 'a!', 'a=[1]'):
+            with self.assertRaises(ValueError):
+                parse_expression(expression)
+
+
+class TestConfigurationFields(unittest.TestCase):
+    def test_configuration_fields(self):
+        self.assertEqual(sorted([
+            ['cacheControl.maxAge', 600], ['cacheControl.maxAge', 1], ['cacheControl.statusCodeMatch', '200'],
+            ['hostname.domain', 'www.foo.com'], ['originPullHost.primary', 1234],
+        ]), sorted(configuration_fields({
+            "scope": {"id": 1, "platform": "CDS", "path": "/"},
+            "originPullHost": {"id": 5, "primary": 1234},
+            "cacheControl": [{"id": 6, "statusCodeMatch": "200", "maxAge": 600}, {"id": 7, "maxAge": 1}],
+            "hostname": [{"domain": "www.foo.com"}]
+        })))
+
+
+class TestConfigurationIndex(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.store = SnapshotStore(self.directory)
+        self.store.save('y1y2y3y4', snapshot('a1', 'first', [
+            {"originPullHost": {"primary": 1}, "cacheControl": [{"maxAge": 30}, {"maxAge": 600}]},
+            {"originPullHost": {"primary": 2}, "hostname": [{"domain": "www.foo.com"}]},
+        ]))
+        self.store.save('z1z2z3z4', snapshot('b1', 'second', [
+            {"originPullHost": {"primary": 1}, "cacheControl": [{"maxAge": 60}]},
+        ]))
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def paths(self, *expressions):
+        return [(scope['host'], scope['path']) for scope in ConfigurationIndex(self.store).refresh().query(expressions)]
+
+    def test_query(self):
+        self.assertEqual([('a1', '/0'), ('b1', '/0')], self.paths('originPullHost.primary=1'))
+        self.assertEqual([('a1', '/1')], self.paths('originPullHost.primary!=1'))
+        self.assertEqual([('a1', '/0')], self.paths('cacheControl.maxAge<60'))
+        self.assertEqual([('a1', '/0'), ('b1', '/0')], self.paths('cacheControl.maxAge<=60'))
+        self.assertEqual([('a1', '/0')], self.paths('cacheControl.maxAge>60'))
+        self.assertEqual([('a1', '/1')], self.paths('hostname.domain~foo'))
+        self.assertEqual([('a1', '/0'), ('b1', '/0')], self.paths('cacheControl'))
+        self.assertEqual([('b1', '/0')], self.paths('originPullHost.primary=1', 'cacheControl.maxAge=60'))
+        # Each expression may be met by a different instance of a type
+        self.assertEqual([('a1', '/0'), ('b1', '/0')], self.paths('cacheControl.maxAge>=60', 'cacheControl.maxAge<100'))
+        self.assertEqual(3, len(self.paths()))
+        self.assertEqual([], self.paths('nothing=1'))
+
+    def test_booleans_apart_from_numbers(self):
+        self.store.save('z1z2z3z4', snapshot('c1', 'third', [
+            {"compression": {"level": True}},
+            {"compression": {"level": 1}},
+            {"compression": {"level": False}},
+        ]))
+        self.assertEqual([('c1', '/1')], self.paths('compression.level<5'))
+        self.assertEqual([('c1', '/1')], self.paths('compression.level=1'))
+        self.assertEqual([('c1', '/0')], self.paths('compression.level=true'))
+        self.assertEqual([('c1', '/2')], self.paths('compression.level=false'))
+        self.assertEqual([('c1', '/0'), ('c1', '/2')], self.paths('compression.level!=1'))
+
+    def test_range_requires_number(self):
+        with self.assertRaises(ValueError):
+            self.paths('cacheControl.maxAge<foo')
+
+    def test_refresh(self):
+        index = ConfigurationIndex(self.store).refresh()
+        self.assertTrue(os.path.exists(index.filename))
+        self.store.save('z1z2z3z4', snapshot('b1', 'second', [{"originPullHost": {"primary": 30}}]))
+        self.store.remove('y1y2y3y4', 'a1')
+        self.assertEqual([('b1', '/0')], self.paths('originPullHost.primary>2'))
+        self.assertEqual(1, len(self.paths()))
+
+    def test_refresh_reuses_saved_index(self):
+        ConfigurationIndex(self.store).refresh()
+        # Unchanged snapshots are read from the saved index rather than parsed again
+        with patch.object(self.store, 'load') as load:
+            self.assertEqual([('a1', '/1')], self.paths('hostname.domain=www.foo.com'))
+        self.assertFalse(load.called)
+
+    def test_refresh_renumbers_unchanged_hosts(self):
+        ConfigurationIndex(self.store).refresh()
+        # A new host listed first moves the saved scopes of every other host along
+        self.store.save('y1y2y3y4', snapshot('a0', 'zeroth', [{"originPullHost": {"primary": 1}}]))
+        self.assertEqual([('a0', '/0'), ('a1', '/0'), ('b1', '/0')], self.paths('originPullHost.primary=1'))
+        self.assertEqual([('a1', '/1')], self.paths('hostname'))
+
+    def test_loads_only_queried_fields(self):
+        ConfigurationIndex(self.store).refresh()
+        index = ConfigurationIndex(self.store).refresh()
+        self.assertEqual({}, index.fields)
+        self.assertEqual([('a1', '/0'), ('b1', '/0')],
+                         [(scope['host'], scope['path']) for scope in index.query(['originPullHost.primary=1'])])
+        self.assertEqual(['originPullHost.primary'], list(index.fields))
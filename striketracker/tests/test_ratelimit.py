@@ -0,0 +1,38 @@
+import threading
+import time
+import unittest
+from mock import patch
+from striketracker.ratelimit import TokenBucket
+
+
+class TestTokenBucket(unittest.TestCase):
+    def test_burst(self):
+        bucket = TokenBucket(10, capacity=5)
+        with patch('time.sleep') as sleep:
+            for _ in range(5):
+                bucket.acquire()
+        self.assertFalse(sleep.called)
+
+    def test_rate(self):
+        bucket = TokenBucket(100, capacity=1)
+        start = time.time()
+        for _ in range(11):
+            bucket.acquire()
+        self.assertGreaterEqual(time.time() - start, 0.09)
+
+    def test_shared(self):
+        bucket = TokenBucket(200, capacity=1)
+        start = time.time()
+        threads = [threading.Thread(target=lambda: [bucket.acquire() for _ in range(5)]) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertGreaterEqual(time.time() - start, 0.09)
+
+    def test_pause(self):
+        bucket = TokenBucket(100, capacity=10)
+        bucket.pause(0.05)
+        start = time.time()
+        bucket.acquire()
+        self.assertGreaterEqual(time.time() - start, 0.05)
@@ -0,0 +1,111 @@
+import os
+import shutil
+from tempfile import mkdtemp
+import unittest
+from mock import patch
+from striketracker import APIClient
+from striketracker.responsecache import ResponseCache
+from striketracker.tests.fakeserver import FakeStrikeTrackerServer
+
+
+class TestResponseCache(unittest.TestCase):
+    def setUp(self):
+        self.server = FakeStrikeTrackerServer().start()
+        self.host = self.server.add_host(
+            'y1y2y3y4', {"name": "test host", "hashCode": "x1x2x3x4", "services": []},
+            [{"platform": "CDS", "path": "/"}], [{"originPullHost": {"primary": 42}}])
+        self.scope = self.host['scopes'][0]['id']
+        self.directory = mkdtemp()
+
+    def tearDown(self):
+        self.server.stop()
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def client(self, **kwargs):
+        return APIClient(self.server.base_url, 'testtoken', response_cache=ResponseCache(**kwargs))
+
+    def test_fresh_hit(self):
+        client = self.client(ttl=60)
+        self.assertEqual(self.host, client.get_host('y1y2y3y4', 'x1x2x3x4'))
+        self.assertEqual(self.host, client.get_host('y1y2y3y4', 'x1x2x3x4'))
+        self.assertEqual(1, len(self.server.requests))
+
+    def test_hit_is_a_copy(self):
+        client = self.client(ttl=60)
+        client.get_host('y1y2y3y4', 'x1x2x3x4')['name'] = 'changed'
+        self.assertEqual('test host', client.get_host('y1y2y3y4', 'x1x2x3x4')['name'])
+
+    def test_revalidate(self):
+        client = self.client(ttl=0)
+        statuses = []
+        request = client.session.request
+
+        def record(*args, **kwargs):
+            response = request(*args, **kwargs)
+            statuses.append(response.status_code)
+            return response
+        client.session.request = record
+        configuration = client.get_configuration('y1y2y3y4', 'x1x2x3x4', self.scope)
+        self.assertEqual(configuration, client.get_configuration('y1y2y3y4', 'x1x2x3x4', self.scope))
+        self.assertEqual([200, 304], statuses)
+
+    def test_if_changed(self):
+        client = self.client(ttl=60)
+        host, etag = client.get_host_if_changed('y1y2y3y4', 'x1x2x3x4', None)
+        self.assertEqual(self.host, host)
+        self.assertIsNone(client.get_host_if_changed('y1y2y3y4', 'x1x2x3x4', etag))
+        configuration, etag = client.get_configuration_if_changed('y1y2y3y4', 'x1x2x3x4', self.scope, None)
+        client.update_configuration('y1y2y3y4', 'x1x2x3x4', self.scope, {"originPullHost": {"primary": 7}})
+        configuration, _ = client.get_configuration_if_changed('y1y2y3y4', 'x1x2x3x4', self.scope, etag)
+        self.assertEqual({"primary": 7}, configuration['originPullHost'])
+        # Always asks the server, whatever the response cache holds
+        self.assertEqual(5, len(self.server.requests))
+
+    def test_invalidate_on_update(self):
+        client = self.client(ttl=60)
+        client.get_host('y1y2y3y4', 'x1x2x3x4')
+        client.get_configuration('y1y2y3y4', 'x1x2x3x4', self.scope)
+        client.update_configuration('y1y2y3y4', 'x1x2x3x4', self.scope, {"originPullHost": {"primary": 7}})
+        self.assertEqual({"primary": 7},
+                         client.get_configuration('y1y2y3y4', 'x1x2x3x4', self.scope)['originPullHost'])
+        client.create_scope('y1y2y3y4', 'x1x2x3x4', {"platform": "ALL", "path": "/"})
+        self.assertEqual(2, len(client.get_host('y1y2y3y4', 'x1x2x3x4')['scopes']))
+
+    def test_lru(self):
+        client = self.client(ttl=60, maxsize=1)
+        client.get_host('y1y2y3y4', 'x1x2x3x4')
+        client.get_configuration('y1y2y3y4', 'x1x2x3x4', self.scope)
+        client.get_host('y1y2y3y4', 'x1x2x3x4')
+        self.assertEqual(3, len(self.server.requests))
+        self.assertEqual(1, len(client.response_cache.entries))
+
+    def test_disk(self):
+        self.client(ttl=60, directory=self.directory).get_configuration('y1y2y3y4', 'x1x2x3x4', self.scope)
+        client = self.client(ttl=60, directory=self.directory)
+        self.assertEqual({"primary": 42},
+                         client.get_configuration('y1y2y3y4', 'x1x2x3x4', self.scope)['originPullHost'])
+        self.assertEqual(1, len(self.server.requests))
+        client.update_configuration('y1y2y3y4', 'x1x2x3x4', self.scope, {})
+        self.assertIsNone(self.client(ttl=60, directory=self.directory).response_cache.get(
+            ('y1y2y3y4', 'x1x2x3x4', str(self.scope))))
+
+    def test_disk_removed_during_write(self):
+        client = self.client(ttl=60, directory=self.directory)
+        host = os.path.join(self.directory, 'y1y2y3y4', 'x1x2x3x4')
+
+        # A concurrent invalidate() removes the host directory between creating the entry and moving it into place
+        with patch('os.fsync', side_effect=lambda fd: shutil.rmtree(host)):
+            self.assertEqual({"primary": 42},
+                             client.get_configuration('y1y2y3y4', 'x1x2x3x4', self.scope)['originPullHost'])
+        self.assertFalse(os.path.exists(host))
+        self.assertEqual({"primary": 42},
+                         client.get_configuration('y1y2y3y4', 'x1x2x3x4', self.scope)['originPullHost'])
+        self.assertEqual(1, len(self.server.requests))
+
+    def test_disk_unwritable(self):
+        with open(os.path.join(self.directory, 'y1y2y3y4'), 'w'):
+            pass
+        client = self.client(ttl=60, directory=self.directory)
+        client.get_host('y1y2y3y4', 'x1x2x3x4')
+        client.get_host('y1y2y3y4', 'x1x2x3x4')
+        self.assertEqual(1, len(self.server.requests))
@@ -0,0 +1,40 @@
+import time
+import unittest
+from email.utils import formatdate
+from mock import Mock
+import requests
+from striketracker.retry import RetryPolicy
+
+
+def response(status, headers=None):
+    return Mock(status_code=status, headers=headers or {})
+
+
+class TestRetryPolicy(unittest.TestCase):
+    def setUp(self):
+        self.policy = RetryPolicy(retries=2)
+
+    def test_should_retry(self):
+        self.assertTrue(self.policy.should_retry('GET', 0, response=response(500)))
+        self.assertTrue(self.policy.should_retry('POST', 0, response=response(429)))
+        self.assertTrue(self.policy.should_retry('POST', 1, response=response(503)))
+        self.assertFalse(self.policy.should_retry('POST', 0, response=response(500)))
+        self.assertFalse(self.policy.should_retry('GET', 0, response=response(404)))
+        self.assertFalse(self.policy.should_retry('GET', 2, response=response(503)))
+
+    def test_should_retry_error(self):
+        self.assertTrue(self.policy.should_retry('GET', 0, error=requests.ConnectionError()))
+        self.assertFalse(self.policy.should_retry('POST', 0, error=requests.ConnectionError()))
+        self.assertFalse(self.policy.should_retry('GET', 0, error=requests.TooManyRedirects()))
+
+    def test_delay(self):
+        policy = RetryPolicy(backoff=1, max_backoff=3)
+        for attempt in range(5):
+            self.assertLessEqual(policy.delay(attempt), min(3, 2 ** attempt))
+
+    def test_retry_after(self):
+        self.assertEqual(7, self.policy.delay(0, response(429, {'Retry-After': '7'})))
+        self.assertEqual(120, self.policy.delay(0, response(429, {'Retry-After': '3600'})))
+        delay = self.policy.delay(0, response(503, {'Retry-After': formatdate(time.time() + 30)}))
+        self.assertTrue(28 <= delay <= 30)
+        self.assertLessEqual(self.policy.delay(0, response(503, {'Retry-After': 'soon'})), 0.5)
@@ -0,0 +1,71 @@
+import unittest
+from mock import patch
+import requests
+from striketracker import APIClient
+from striketracker.sync import HostSyncer, configuration_hash
+from striketracker.tests.fakeserver import FakeStrikeTrackerServer
+
+
+class TestConfigurationHash(unittest.TestCase):
+    def test_key_order(self):
+        self.assertEqual(configuration_hash({"a": 1, "b": [{"c": 2, "d": 3}]}),
+                         configuration_hash({"b": [{"d": 3, "c": 2}], "a": 1}))
+        self.assertNotEqual(configuration_hash({"a": 1}), configuration_hash({"a": 2}))
+
+
+class TestHostSyncer(unittest.TestCase):
+    def setUp(self):
+        self.server = FakeStrikeTrackerServer().start()
+        self.client = APIClient(self.server.base_url, 'testtoken')
+        self.server.add_host('y1y2y3y4', {"name": "source", "hashCode": "a1a2a3a4"},
+                             [{"platform": "CDS", "path": "/%d" % i} for i in range(10)],
+                             [{"originPullHost": {"id": i, "primary": i}} for i in range(10)])
+        # Target is missing the last two scopes, and one of its scopes is out of date
+        self.server.add_host('z1z2z3z4', {"name": "target", "hashCode": "b1b2b3b4"},
+                             [{"platform": "CDS", "path": "/%d" % i} for i in range(8)],
+                             [{"originPullHost": {"id": 100 + i, "primary": i if i != 3 else 30}} for i in range(8)])
+
+    def tearDown(self):
+        self.client.close()
+        self.server.stop()
+
+    def test_sync(self):
+        results = HostSyncer(self.client, workers=4).sync('y1y2y3y4', 'a1a2a3a4', 'b1b2b3b4', 'z1z2z3z4')
+        self.assertEqual(['unchanged'] * 3 + ['updated'] + ['unchanged'] * 4 + ['created'] * 2,
+                         [result.change for result in results])
+        writes = [request for request in self.server.requests if request[0] != 'GET']
+        self.assertEqual(5, len(writes))
+        # Missing scopes are created concurrently, so they may be added in any order
+        host = self.client.get_host('z1z2z3z4', 'b1b2b3b4')
+        configurations = dict((scope['path'], self.client.get_configuration('z1z2z3z4', 'b1b2b3b4', scope['id']))
+                              for scope in host['scopes'])
+        self.assertEqual(dict(('/%d' % i, i) for i in range(10)),
+                         dict((path, configuration['originPullHost']['primary'])
+                              for path, configuration in configurations.items()))
+
+    def test_sync_again_makes_no_changes(self):
+        syncer = HostSyncer(self.client)
+        syncer.sync('y1y2y3y4', 'a1a2a3a4', 'b1b2b3b4', 'z1z2z3z4')
+        del self.server.requests[:]
+        results = syncer.sync('y1y2y3y4', 'a1a2a3a4', 'b1b2b3b4', 'z1z2z3z4')
+        self.assertEqual(['unchanged'] * 10, [result.change for result in results])
+        self.assertEqual(set(['GET']), set(method for method, path in self.server.requests))
+
+    def test_sync_scope_fails(self):
+        host = self.client.get_host('y1y2y3y4', 'a1a2a3a4')
+        del self.server.configurations[('a1a2a3a4', str(host['scopes'][3]['id']))]
+        results = HostSyncer(self.client).sync('y1y2y3y4', 'a1a2a3a4', 'b1b2b3b4', 'z1z2z3z4')
+        self.assertEqual('Could not fetch configuration', results[3].error.message)
+        self.assertEqual(9, len([result for result in results if result.error is None]))
+
+    def test_sync_connection_error(self):
+        request = self.client.session.request
+
+        def drop(method, url, **kwargs):
+            if method == 'POST':
+                raise requests.ConnectionError('Connection aborted')
+            return request(method, url, **kwargs)
+        with patch.object(self.client.session, 'request', side_effect=drop):
+            results = HostSyncer(self.client).sync('y1y2y3y4', 'a1a2a3a4', 'b1b2b3b4', 'z1z2z3z4')
+        self.assertEqual(['Connection aborted'] * 2, [str(result.error) for result in results[8:]])
+        self.assertEqual(8, len([result for result in results if result.error is None]))
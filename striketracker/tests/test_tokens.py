@@ -0,0 +1,111 @@
+import os
+from tempfile import mkstemp
+import unittest
+from mock import Mock, patch
+from striketracker import APIError, ConfigurationCache
+from striketracker.tokens import TokenManager, token_digest
+
+
+class TestTokenManager(unittest.TestCase):
+    def setUp(self):
+        self.fd, self.filename = mkstemp()
+        self.cache = ConfigurationCache(self.filename)
+        self.client = Mock(token='foobar')
+        self.client.me.return_value = {"id": 12345, "accountHash": "x1x2x3x4", "firstName": "Bob"}
+
+    def tearDown(self):
+        os.close(self.fd)
+        os.unlink(self.filename)
+        if os.path.exists(self.filename + '.lock'):
+            os.unlink(self.filename + '.lock')
+
+    def test_token(self):
+        self.cache.set('token', 'default')
+        self.cache.set('profiles', {"staging": {"token": "staging"}})
+        self.assertEqual('default', TokenManager(self.client, self.cache).token())
+        self.assertEqual('staging', TokenManager(self.client, self.cache, profile='staging').token())
+        self.assertIsNone(TokenManager(self.client, self.cache, profile='other').token())
+
+    def test_save(self):
+        TokenManager(self.client, self.cache, profile='staging').save('one')
+        TokenManager(self.client, self.cache, profile='production').save('two')
+        TokenManager(self.client, self.cache).save('three', 'w1w2w3w4')
+        self.assertEqual({"token": "three", "account": "w1w2w3w4",
+                          "profiles": {"staging": {"token": "one"}, "production": {"token": "two"}}},
+                         ConfigurationCache(self.filename).read())
+
+    def test_save_keeps_profile_settings(self):
+        self.cache.set('profiles', {"staging": {"token": "old", "account": "y1y2y3y4"}})
+        TokenManager(self.client, self.cache, profile='staging').save('new')
+        self.assertEqual({"staging": {"token": "new", "account": "y1y2y3y4"}},
+                         ConfigurationCache(self.filename).read()['profiles'])
+
+    @patch('time.time')
+    def test_validate(self, time):
+        time.return_value = 1000.0
+        tokens = TokenManager(self.client, self.cache, ttl=60)
+        self.assertEqual({"id": 12345, "accountHash": "x1x2x3x4"}, tokens.validate())
+        self.assertEqual({token_digest('foobar'): {"at": 1000.0, "user": {"id": 12345, "accountHash": "x1x2x3x4"}}},
+                         ConfigurationCache(self.filename).read()['validated'])
+        # Remembered by other processes sharing the file until the ttl runs out
+        time.return_value = 1059.0
+        self.assertEqual(12345, TokenManager(self.client, ConfigurationCache(self.filename), ttl=60).validate()['id'])
+        self.assertEqual(1, self.client.me.call_count)
+        time.return_value = 1060.0
+        tokens.validate()
+        self.assertEqual(2, self.client.me.call_count)
+        tokens.validate(force=True)
+        self.assertEqual(3, self.client.me.call_count)
+
+    def test_validate_other_token(self):
+        tokens = TokenManager(self.client, self.cache)
+        tokens.validate()
+        self.client.token = 'other'
+        tokens.validate()
+        self.assertEqual(2, self.client.me.call_count)
+        self.assertEqual(2, len(ConfigurationCache(self.filename).read()['validated']))
+
+    @patch('time.time')
+    def test_validate_drops_expired(self, time):
+        time.return_value = 1000.0
+        tokens = TokenManager(self.client, self.cache, ttl=60)
+        tokens.validate()
+        time.return_value = 2000.0
+        self.client.token = 'other'
+        tokens.validate()
+        self.assertEqual([token_digest('other')], list(ConfigurationCache(self.filename).read()['validated']))
+
+    @patch('time.time')
+    def test_validate_rejected(self, time):
+        time.return_value = 1000.0
+        tokens = TokenManager(self.client, self.cache, ttl=60)
+        tokens.validate()
+        time.return_value = 1100.0
+        self.client.me.side_effect = APIError('Could not fetch user details', None)
+        with self.assertRaises(APIError):
+            tokens.validate()
+        self.assertEqual({}, ConfigurationCache(self.filename).read()['validated'])
+
+    def test_context(self):
+        self.client.list_subaccounts.return_value = [{"accountHash": "z1z2z3z4", "accountName": "Sub", "other": 1}]
+        expected = {"id": 12345, "accountHash": "x1x2x3x4", "subaccounts": [{"accountHash": "z1z2z3z4",
+                                                                            "accountName": "Sub"}]}
+        self.assertEqual(expected, TokenManager(self.client, self.cache).context())
+        self.assertEqual(expected, TokenManager(self.client, ConfigurationCache(self.filename)).context())
+        self.assertEqual(1, self.client.me.call_count)
+        self.client.list_subaccounts.assert_called_once_with('x1x2x3x4')
+
+    def test_context_after_validate(self):
+        self.client.list_subaccounts.return_value = []
+        tokens = TokenManager(self.client, self.cache)
+        tokens.validate()
+        self.assertEqual([], tokens.context()['subaccounts'])
+        self.assertEqual(1, self.client.me.call_count)
+
+    def test_default_account(self):
+        self.cache.set('profiles', {"staging": {"token": "staging", "account": "y1y2y3y4"}})
+        self.assertEqual('y1y2y3y4', TokenManager(self.client, self.cache, profile='staging').default_account())
+        self.assertEqual('x1x2x3x4', TokenManager(self.client, self.cache).default_account())
+        self.cache.set('account', 'w1w2w3w4')
+        self.assertEqual('w1w2w3w4', TokenManager(self.client, self.cache).default_account())
+        self.assertEqual(1, self.client.me.call_count)
@@ -0,0 +1,113 @@
+import hashlib
+import time
+
+from striketracker import APIError
+
+# Fields of the user kept with a validated token
+USER_FIELDS = ('id', 'accountHash', 'username')
+
+
+def token_digest(token):
+    # Validations are stored under a digest of the token so the configuration file never holds a second copy of it
+    return hashlib.sha1(token.encode('utf-8')).hexdigest()
+
+
+class TokenManager(object):
+    # Reads the token and default account from the top level of the configuration file, or from a named profile under
+    # "profiles". The user and account context a token resolves to is remembered for ttl seconds, so that checking a
+    # token or defaulting an account usually costs no request:
+    #
+    #     token: ...
+    #     account: ...
+    #     profiles:
+    #       staging:
+    #         token: ...
+    #         account: ...
+    #     validated:
+    #       <token digest>: {at: <timestamp>, user: {id: ..., accountHash: ...}, subaccounts: [...]}
+    def __init__(self, client, cache, profile=None, ttl=3600):
+        self.client = client
+        self.cache = cache
+        self.profile = profile
+        self.ttl = ttl
+
+    def _profile(self):
+        profiles = self.cache.get('profiles')
+        profile = profiles.get(self.profile) if isinstance(profiles, dict) else None
+        return profile if isinstance(profile, dict) else {}
+
+    def token(self):
+        if self.profile is None:
+            return self.cache.get('token')
+        return self._profile().get('token')
+
+    def account(self):
+        # The account configured for this profile, if any
+        if self.profile is None:
+            return self.cache.get('account')
+        return self._profile().get('account')
+
+    def save(self, token, account=None):
+        settings = {"token": token}
+        if account is not None:
+            settings['account'] = account
+        if self.profile is None:
+            for key, value in settings.items():
+                self.cache.set(key, value)
+            return
+        profile = self.profile
+        self.cache.update('profiles', lambda profiles: dict(
+            profiles or {}, **{profile: dict((profiles or {}).get(profile) or {}, **settings)}))
+
+    def _entry(self, digest, now):
+        validated = self.cache.get('validated')
+        entry = validated.get(digest) if isinstance(validated, dict) else None
+        if isinstance(entry, dict) and 0 <= now - entry.get('at', 0) < self.ttl:
+            return entry
+        return None
+
+    def _remember(self, digest, entry, now):
+        # Record what a token resolved to, or forget it when entry is None, dropping anything that has expired
+        def update(validated):
+            validated = dict((key, value) for key, value in (validated or {}).items()
+                             if isinstance(value, dict) and now - value.get('at', 0) < self.ttl)
+            if entry is None:
+                validated.pop(digest, None)
+            else:
+                validated[digest] = entry
+            return validated
+        self.cache.update('validated', update)
+
+    def validate(self, force=False):
+        # Return the id, account and username of the user the client's token belongs to, only asking the API if the
+        # token has not been accepted within ttl seconds. Raises APIError if the token is rejected
+        digest = token_digest(self.client.token)
+        now = time.time()
+        entry = self._entry(digest, now)
+        if not force and entry is not None:
+            return entry['user']
+        try:
+            user = self.client.me()
+        except APIError:
+            self._remember(digest, None, now)
+            raise
+        user = dict((key, user[key]) for key in USER_FIELDS if key in user)
+        self._remember(digest, {"at": now, "user": user}, now)
+        return user
+
+    def context(self, force=False):
+        # The validated user together with the subaccounts of their root account, resolved once per ttl
+        user = self.validate(force)
+        digest = token_digest(self.client.token)
+        now = time.time()
+        entry = self._entry(digest, now)
+        if entry is None or 'subaccounts' not in entry:
+            subaccounts = [dict((key, subaccount[key]) for key in ('accountHash', 'accountName') if key in subaccount)
+                           for subaccount in self.client.list_subaccounts(user['accountHash'])]
+            entry = dict(entry or {"at": now, "user": user}, subaccounts=subaccounts)
+            self._remember(digest, entry, now)
+        return dict(entry['user'], subaccounts=entry['subaccounts'])
+
+    def default_account(self):
+        # The configured account, otherwise the root account of the token's user
+        return self.account() or self.validate()['accountHash']